@@ -0,0 +1,264 @@
+# Admission control for the heavy routes when Drift is hosted as a website (-w). Every job has a
+# cost in slots, estimated from its recording's duration and whether calc_intense is on (see
+# pipeline.job_cost). Jobs run while the global budget has room. Once it is spent they wait in a
+# bounded queue, first come first served. Requests that can't be taken are turned away at once
+# with a Retry-After:
+#   - 429 when the client already has max_client jobs running or queued,
+#   - 503 when the queue is full, or when a job waited max_wait seconds without getting in.
+# A job keeps its slots until its handler returns, not just until its client goes away: handlers
+# are wrapped with job() and told their job number, like cancellation.cancellable. Going away only
+# stops the job where it's also a CancellableResource.
+# All the bookkeeping happens on the reactor thread, so there are no locks.
+
+import collections
+import io
+import itertools
+import json
+import math
+import time
+
+from twisted.internet import reactor
+from twisted.web import resource, server
+
+# how quickly the average job time follows the latest jobs
+SMOOTHING = 0.2
+
+# release() of admitted jobs whose handler hasn't returned yet, by job number
+jobs = {}
+numbers = itertools.count(1)
+
+
+class Gate:
+    def __init__(self, capacity, max_client=2, max_queue=16, max_wait=60):
+        self.capacity = capacity
+        self.max_client = max_client
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self.used = 0
+        # jobs running or queued, by client
+        self.clients = collections.Counter()
+        # [cost, client, start, timeout] of jobs waiting for slots
+        self.waiting = collections.deque()
+        # seconds a job usually takes, for Retry-After
+        self.job_secs = 5.0
+        self.turned_away = 0
+
+    def stats(self):
+        return {
+            "capacity": self.capacity,
+            "used": self.used,
+            "queued": len(self.waiting),
+            "clients": len(self.clients),
+            "job_secs": round(self.job_secs, 2),
+            "turned_away": self.turned_away,
+        }
+
+    def retry_after(self):
+        # seconds until the jobs ahead are likely done
+        return min(300, max(1, math.ceil(self.job_secs * (len(self.waiting) + 1) * self.max_client / self.capacity)))
+
+    def admit(self, client, cost, start):
+        # start(release=...) is called once the job has its slots, or start(expired=True) if it waited
+        # too long. returns None if the job was started or queued, otherwise the (status, reason) to
+        # turn it away with
+        cost = min(cost, self.capacity)
+        if self.clients[client] >= self.max_client:
+            return 429, "too many jobs from this client"
+        if not self.waiting and self.used + cost <= self.capacity:
+            self.clients[client] += 1
+            self.run(cost, client, start)
+            return None
+        if len(self.waiting) >= self.max_queue:
+            return 503, "server busy"
+
+        self.clients[client] += 1
+        entry = [cost, client, start]
+        self.waiting.append(entry)
+
+        def timeout():
+            if entry in self.waiting:
+                self.waiting.remove(entry)
+                self.leave(client)
+                self.turned_away += 1
+                start(expired=True)
+                self.drain()
+
+        entry.append(reactor.callLater(self.max_wait, timeout))
+        return None
+
+    def withdraw(self, start):
+        # a queued job's client went away
+        for entry in self.waiting:
+            if entry[2] is start:
+                self.waiting.remove(entry)
+                entry[3].cancel()
+                self.leave(entry[1])
+                self.drain()
+                return
+
+    def run(self, cost, client, start):
+        self.used += cost
+        began = time.time()
+        released = []
+
+        def release():
+            if released:
+                return
+            released.append(True)
+            self.used -= cost
+            self.leave(client)
+            self.job_secs += SMOOTHING * (time.time() - began - self.job_secs)
+            self.drain()
+
+        start(release=release)
+
+    def leave(self, client):
+        self.clients[client] -= 1
+        if self.clients[client] <= 0:
+            del self.clients[client]
+
+    def drain(self):
+        while self.waiting and self.used + self.waiting[0][0] <= self.capacity:
+            cost, client, start, timer = self.waiting.popleft()
+            timer.cancel()
+            self.run(cost, client, start)
+
+
+def client_of(req, trusted_proxies=()):
+    # behind a proxy every request comes from the proxy, so X-Forwarded-For says who the client is.
+    # anyone can send one, so only hops added by trusted proxies count: the client is the last
+    # address in the chain that isn't one of them
+    host = req.getClientAddress().host
+    forwarded = req.getHeader("x-forwarded-for")
+    if forwarded and host in trusted_proxies:
+        for hop in reversed([X.strip() for X in forwarded.split(",")]):
+            host = hop
+            if hop not in trusted_proxies:
+                break
+    return host
+
+
+def job(fn):
+    # wraps a handler served through AdmittedResource, so its job's slots are freed once it returns
+    def run(*args, **kwargs):
+        cmd = args[0] if args and isinstance(args[0], dict) else kwargs
+        number = cmd.pop("_job", None)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if number is not None:
+                reactor.callFromThread(done, int(number))
+
+    run.__name__ = fn.__name__
+    return run
+
+
+def done(number):
+    release = jobs.pop(number, None)
+    if release is not None:
+        release()
+
+
+def job_finished(req):
+    # for handlers that are given the request rather than its args (see export.py), called from
+    # their thread once the job is over
+    number = (req.args.get(b"_job") or [None])[0]
+    if number is not None:
+        reactor.callFromThread(done, int(number))
+
+
+def add_job(req, number):
+    # tell the handler its job number, the way job_args reads the request. False if it can't be
+    if req.method == b"POST":
+        try:
+            body = json.loads(req.content.read())
+        except ValueError:
+            body = None
+        if not isinstance(body, dict):
+            req.content.seek(0)
+            return False
+        body["_job"] = number
+        req.content = io.BytesIO(json.dumps(body).encode())
+        return True
+    req.args[b"_job"] = [str(number).encode()]
+    return True
+
+
+def job_args(req):
+    # the query args of a GET or the JSON body of a POST, without consuming the body
+    if req.method == b"POST":
+        try:
+            body = json.loads(req.content.read())
+        except ValueError:
+            body = None
+        req.content.seek(0)
+        return body if isinstance(body, dict) else {}
+    return {k.decode(): v[0].decode() for k, v in req.args.items()}
+
+
+class AdmittedResource(resource.Resource):
+    # passes requests through to the wrapped resource once gate lets them in. cost(args) is the
+    # job's cost in slots, given its query args or JSON body. trusted_proxies: addresses whose
+    # X-Forwarded-For is believed (see client_of). the wrapped handler has to be wrapped with job(),
+    # or call job_finished, or its slots are only freed when it answers
+    def __init__(self, wrapped, gate, cost, trusted_proxies=()):
+        super().__init__()
+        self.wrapped = wrapped
+        self.gate = gate
+        self.cost = cost
+        self.trusted_proxies = trusted_proxies
+
+    @property
+    def isLeaf(self):
+        return self.wrapped.isLeaf
+
+    def getChildWithDefault(self, path, req):
+        return AdmittedResource(self.wrapped.getChildWithDefault(path, req), self.gate, self.cost, self.trusted_proxies)
+
+    def render(self, req):
+        queued = []
+        rendered = []
+
+        def start(release=None, expired=False):
+            if expired:
+                req.write(self.refuse(req, 503, "server busy"))
+                req.finish()
+                return
+            number = next(numbers)
+            jobs[number] = release
+            if add_job(req, number):
+                # a client going away leaves the job running until its handler returns
+                req.notifyFinish().addCallbacks(lambda _: done(number), lambda _: None)
+            else:
+                # a malformed request the handler turns down without running
+                req.notifyFinish().addBoth(lambda _: done(number))
+            if not queued:
+                rendered.append(self.wrapped.render(req))
+                return
+            body = self.wrapped.render(req)
+            if body is not server.NOT_DONE_YET:
+                req.write(body)
+                req.finish()
+
+        try:
+            cost = self.cost(job_args(req))
+        except (KeyError, TypeError, ValueError):
+            # a malformed request, the handler will say what's wrong with it
+            cost = 1
+        refused = self.gate.admit(client_of(req, self.trusted_proxies), cost, start)
+        if refused is not None:
+            self.gate.turned_away += 1
+            return self.refuse(req, *refused)
+        if rendered:
+            return rendered[0]
+
+        queued.append(True)
+        req.notifyFinish().addErrback(lambda _: self.gate.withdraw(start))
+        return server.NOT_DONE_YET
+
+    def refuse(self, req, status, reason):
+        req.setResponseCode(status)
+        req.setHeader(b"Retry-After", str(self.gate.retry_after()).encode())
+        req.setHeader(b"Content-Type", b"application/json")
+        return json.dumps({"error": reason, "retry_after": self.gate.retry_after()}).encode()
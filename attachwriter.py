@@ -0,0 +1,110 @@
+# Writes an attachment straight into the attachments directory, hashing it on the way, then
+# publishes it under <sha1><suffix> with a rename. Unlike writing a temp file and attach()ing it,
+# nothing is copied or read back, and nothing is left behind in /tmp.
+# Half-written files are hidden (.part-*) and never published; sweep() removes any left by a crash.
+
+import hashlib
+import os
+import tempfile
+import time
+
+PART_PREFIX = ".part-"
+# mkstemp makes files only their owner can read. published attachments get the mode open() would
+# have given them. read at import, as os.umask can only be read by setting it
+UMASK = os.umask(0)
+os.umask(UMASK)
+# .part files older than this are from a crashed or killed writer
+STALE_AFTER = 60 * 60
+
+
+class AttachmentWriter:
+    # with store.attach_writer(".json") as fh:
+    #     json.dump(data, fh)
+    # name = fh.publish()
+    def __init__(self, attachpath, suffix, mode="w", published=None):
+        self.attachpath = attachpath
+        self.suffix = suffix
+        self.text = "b" not in mode
+        # published(path) is called with the attachment's final path, e.g. to precompress it
+        self.published = published
+
+        # the suffix is kept last, for writers like np.savez that add their own extension otherwise
+        fd, self.path = tempfile.mkstemp(dir=attachpath, prefix=PART_PREFIX, suffix=suffix)
+        self.fh = os.fdopen(fd, "wb")
+        self.sha = hashlib.sha1()
+        self.size = 0
+        # nothing but whitespace written so far
+        self.blank = True
+        self.name = None
+
+    def write(self, data):
+        if self.text:
+            data = data.encode("utf-8")
+        self.sha.update(data)
+        self.size += len(data)
+        self.blank = self.blank and not data.strip()
+        return self.fh.write(data)
+
+    def writelines(self, lines):
+        for line in lines:
+            self.write(line)
+
+    def flush(self):
+        self.fh.flush()
+
+    def adopt(self):
+        # for files written to self.path by something else (an external program, np.savez):
+        # hash what is there now instead of what went through write()
+        self.fh.close()
+        self.sha = hashlib.sha1()
+        self.size = 0
+        self.blank = True
+        with open(self.path, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                self.sha.update(block)
+                self.size += len(block)
+                self.blank = self.blank and not block.strip()
+
+    def publish(self):
+        # returns the attachment's name in attachpath
+        if self.name is not None:
+            return self.name
+
+        self.fh.close()
+        name = self.sha.hexdigest() + self.suffix
+        dest = os.path.join(self.attachpath, name)
+        if os.path.exists(dest):
+            # same content already attached
+            os.remove(self.path)
+        else:
+            os.chmod(self.path, 0o666 & ~UMASK)
+            os.replace(self.path, dest)
+        self.name = name
+
+        if self.published is not None:
+            self.published(dest)
+        return name
+
+    def discard(self):
+        self.fh.close()
+        if self.name is None and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        # anything not published by the end of the block is thrown away
+        self.discard()
+
+
+def sweep(attachpath):
+    # remove .part files left by writers that never finished
+    for filename in os.listdir(attachpath):
+        path = os.path.join(attachpath, filename)
+        if filename.startswith(PART_PREFIX):
+            try:
+                if time.time() - os.path.getmtime(path) > STALE_AFTER:
+                    os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,74 @@
+# Duration, sample rate and channel count of a recording from its headers, without decoding it.
+# libsndfile reads them for the formats it knows (wav, flac, ogg, aiff). Everything else goes to
+# ffprobe, and audioread (what Drift used before) is the fallback when ffprobe isn't around.
+
+import json
+import os
+import subprocess
+
+import audioread
+import soundfile
+
+# formats whose headers libsndfile reads directly
+SNDFILE_EXTENSIONS = [".wav", ".flac", ".ogg", ".aif", ".aiff"]
+
+# set to False the first time ffprobe turns out not to be installed
+have_ffprobe = True
+
+
+def probe(path):
+    # {"duration_ms", "sample_rate", "channels"}
+    if os.path.splitext(path)[1].lower() in SNDFILE_EXTENSIONS:
+        probes = [probe_soundfile, probe_ffprobe, probe_audioread]
+    else:
+        probes = [probe_ffprobe, probe_audioread]
+
+    errors = []
+    for fn in probes:
+        try:
+            found = fn(path)
+        except Exception as e:
+            errors.append(f"{fn.__name__}: {e}")
+            continue
+        if found is not None:
+            return found
+    raise ValueError(f"couldn't read audio info of {path} ({'; '.join(errors)})")
+
+
+def audio_info(duration, sample_rate, channels):
+    return {
+        "duration_ms": int(round(float(duration) * 1000)),
+        "sample_rate": int(sample_rate),
+        "channels": int(channels),
+    }
+
+
+def probe_soundfile(path):
+    info = soundfile.info(path)
+    return audio_info(info.frames / info.samplerate, info.samplerate, info.channels)
+
+
+def probe_ffprobe(path):
+    global have_ffprobe
+    if not have_ffprobe:
+        return None
+
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", "-show_streams", "-select_streams", "a:0", path],
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+    except FileNotFoundError:
+        have_ffprobe = False
+        return None
+
+    found = json.loads(out)
+    stream = found["streams"][0]
+    duration = stream.get("duration") or found["format"]["duration"]
+    return audio_info(duration, stream["sample_rate"], stream["channels"])
+
+
+def probe_audioread(path):
+    with audioread.audio_open(path) as f:
+        return audio_info(f.duration, f.samplerate, f.channels)
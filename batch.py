@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+# Runs Drift's whole pipeline (pitch, alignment, rms, harvest, csv, measures, mat) over a folder of
+# recordings without the web server, using the same functions the server does (see pipeline.py).
+# Each recording needs a transcript next to it with the same name and a .txt extension.
+# Like ./serve, run this from Drift's main directory with Gentle running.
+
+import argparse
+import os
+
+parser = argparse.ArgumentParser(description = "Drift4 batch processing")
+parser.add_argument("input", help="directory of recordings, each with a transcript of the same name ending in .txt")
+parser.add_argument("output", help="directory to write measures, csv and mat files to. running again with the same output directory resumes from what was already computed")
+parser.add_argument("-j", "--jobs", help="number of recordings to process at once. default: number of cores", type=int, default=os.cpu_count())
+parser.add_argument("-g", "--gentle_port", help="specify port Drift should find Gentle on, or a comma separated list of ports and host:ports to spread alignments over several Gentle servers. default: 8765", default="8765")
+parser.add_argument("-e", "--pitch_engine", help="pitch tracker: sacc, or the faster in-process dio or yin (not yet compared with sacc on real recordings). default: sacc", choices=["sacc", "dio", "yin"], default="sacc")
+parser.add_argument("--sacc_workers", help="keep this many SAcC processes running with the model loaded in each job, instead of starting SAcC for every recording. default: 0", type=int, default=0)
+parser.add_argument("--pitch_chunks", help="track pitch of long recordings as this many overlapping chunks at once with SAcC. default: 1", type=int, default=1)
+parser.add_argument("-s", "--align_shards", help="align long recordings as this many Gentle jobs at once, split at speaker turns or silences. default: 1", type=int, default=1)
+parser.add_argument("-c", "--calc_intense", help="allow for more intensive Voxit calculations, disabled by default", action='store_true')
+
+AUDIO_EXTENSIONS = [".wav", ".mp3", ".m4a", ".flac", ".ogg", ".aac", ".aif", ".aiff", ".wma", ".mp4", ".webm"]
+
+import csv
+import hashlib
+import json
+import multiprocessing
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+
+import attachwriter
+import pipeline
+import tracing
+
+
+class FolderStore:
+    # pipeline document store keeping each document's meta as a json file, for use without guts.
+    # attachments are named by the sha1 of their content, so rerunning never duplicates them
+    def __init__(self, outdir):
+        self.outdir = outdir
+        self.metapath = os.path.join(outdir, "_meta")
+        self.attachpath = os.path.join(outdir, "_attachments")
+        os.makedirs(self.metapath, exist_ok=True)
+        os.makedirs(self.attachpath, exist_ok=True)
+        attachwriter.sweep(self.attachpath)
+
+    def get_meta(self, docid):
+        try:
+            with open(os.path.join(self.metapath, docid + ".json")) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def set_meta(self, docid, key, val):
+        meta = self.get_meta(docid)
+        meta[key] = val
+        # write then rename, so an interrupted run never leaves a half-written meta behind
+        with tempfile.NamedTemporaryFile(mode="w", dir=self.metapath, suffix=".tmp", delete=False) as fh:
+            json.dump(meta, fh, indent=2)
+        os.replace(fh.name, os.path.join(self.metapath, docid + ".json"))
+
+    def wait_for(self, docid, key):
+        # stages run one after another here, so there is never another process to wait on
+        while not self.get_meta(docid).get(key):
+            time.sleep(0.1)
+        return self.get_meta(docid)[key]
+
+    def attach(self, filepath):
+        sha = hashlib.sha1()
+        with open(filepath, "rb") as fh:
+            for block in iter(lambda: fh.read(1 << 20), b""):
+                sha.update(block)
+        name = sha.hexdigest() + os.path.splitext(filepath)[1]
+        dest = os.path.join(self.attachpath, name)
+        if not os.path.exists(dest):
+            shutil.copyfile(filepath, dest + ".tmp")
+            os.replace(dest + ".tmp", dest)
+        return name
+
+    def attach_writer(self, suffix, mode="w"):
+        return attachwriter.AttachmentWriter(self.attachpath, suffix, mode)
+
+    def get_infos(self):
+        infos = []
+        for filename in sorted(os.listdir(self.metapath)):
+            if filename.endswith(".json"):
+                docid = filename[:-len(".json")]
+                infos.append({"id": docid, "title": self.get_meta(docid).get("title", docid)})
+        return infos
+
+
+# (meta key, stage) in the order the server runs them. a stage is skipped if its key is already set
+STAGES = [
+    ("pitch", pipeline.pitch),
+    ("rms", pipeline.rms),
+    ("aligncsv", pipeline.align),
+    ("harvest", pipeline._harvest),
+    ("csv", pipeline.gen_csv),
+    ("full_ts", lambda cmd: pipeline._measure(id=cmd["id"])),
+    ("mat", pipeline.gen_mat),
+]
+
+# keys that depend on the transcript, and have to be recomputed if it changes
+TRANSCRIPT_KEYS = ["align", "aligncsv", "csv", "full_ts", "mat"]
+
+
+def stage_done(meta, key):
+    if key == "aligncsv" and meta.get("align_transcript"):
+        return meta["align_transcript"] == meta.get("transcript")
+    return bool(meta.get(key))
+
+
+def find_recordings(indir):
+    recordings = []
+    for filename in sorted(os.listdir(indir)):
+        stem, ext = os.path.splitext(filename)
+        if ext.lower() not in AUDIO_EXTENSIONS:
+            continue
+        transcript = os.path.join(indir, stem + ".txt")
+        if not os.path.exists(transcript):
+            print(f"SYSTEM: skipping {filename}, no transcript {stem}.txt")
+            continue
+        recordings.append((stem, os.path.join(indir, filename), transcript))
+    return recordings
+
+
+def add_recording(store, docid, audio_path, transcript_path):
+    meta = store.get_meta(docid)
+
+    if not meta.get("path"):
+        store.set_meta(docid, "title", os.path.basename(audio_path))
+        store.set_meta(docid, "path", store.attach(audio_path))
+
+    transcript = store.attach(transcript_path)
+    if meta.get("transcript") != transcript:
+        if meta.get("transcript"):
+            print(f"SYSTEM: {docid} transcript changed, realigning")
+        for key in TRANSCRIPT_KEYS:
+            # an alignment that records its transcript is kept, align then only realigns the lines that changed
+            if key in ["align", "aligncsv"] and meta.get("align_transcript"):
+                continue
+            if meta.get(key):
+                store.set_meta(docid, key, None)
+        store.set_meta(docid, "transcript", transcript)
+
+
+def init_worker(outdir, gentle_port, calc_intense, align_shards, pitch_engine, sacc_workers, pitch_chunks):
+    pipeline.use_store(FolderStore(outdir))
+    pipeline.use_gentle(gentle_port)
+    pipeline.calc_intense = calc_intense
+    pipeline.align_shards = align_shards
+    pipeline.pitch_engine = pitch_engine
+    pipeline.use_sacc_workers(sacc_workers)
+    pipeline.pitch_chunks = pitch_chunks
+    tracing.dirpath = os.path.join(outdir, "_traces")
+
+
+def process_recording(docid):
+    store = pipeline.store
+    started = time.time()
+
+    try:
+        for key, stage in STAGES:
+            if key == "harvest" and not pipeline.calc_intense:
+                continue
+            if stage_done(store.get_meta(docid), key):
+                continue
+
+            stage_start = time.time()
+            ret = stage({"id": docid})
+            if isinstance(ret, dict) and ret.get("error"):
+                return docid, ret["error"]
+            print(f"SYSTEM: {docid} {key} took {time.time() - stage_start:.2f}s")
+
+        export_recording(store, docid)
+    except Exception:
+        return docid, traceback.format_exc()
+
+    print(f"SYSTEM: {docid} done (took {time.time() - started:.2f}s)")
+    return docid, None
+
+
+def export_recording(store, docid):
+    # copy results out of the attachment store under the recording's own name
+    meta = store.get_meta(docid)
+    for key, ext in [("csv", ".csv"), ("mat", ".mat"), ("full_ts", ".measures.json")]:
+        if meta.get(key):
+            shutil.copyfile(os.path.join(store.attachpath, meta[key]), os.path.join(store.outdir, docid + ext))
+    # where the time went, for chrome://tracing or ui.perfetto.dev
+    with open(os.path.join(store.outdir, docid + ".trace.json"), "w") as fh:
+        json.dump(tracing.trace(docid), fh)
+
+
+def write_summary(store, docids):
+    # one row of full transcript measures per recording
+    rows = []
+    labels = []
+    for docid in docids:
+        meta = store.get_meta(docid)
+        if not meta.get("full_ts"):
+            continue
+        measures = json.load(open(os.path.join(store.attachpath, meta["full_ts"])))["measure"]
+        for label in measures:
+            if label not in labels:
+                labels.append(label)
+        rows.append(dict(measures, id=docid))
+
+    with open(os.path.join(store.outdir, "measures.csv"), "w", newline="") as fh:
+        w = csv.DictWriter(fh, fieldnames=["id"] + labels)
+        w.writeheader()
+        w.writerows(rows)
+
+
+def main():
+    driftargs = parser.parse_args()
+
+    print(f"SYSTEM: CALC_INTENSE is { driftargs.calc_intense }")
+    print(f"SYSTEM: GENTLE is { driftargs.gentle_port }")
+
+    store = FolderStore(driftargs.output)
+    recordings = find_recordings(driftargs.input)
+    for docid, audio_path, transcript_path in recordings:
+        add_recording(store, docid, audio_path, transcript_path)
+    docids = [X[0] for X in recordings]
+
+    print(f"SYSTEM: processing {len(docids)} recordings with {driftargs.jobs} workers")
+
+    failed = []
+    initargs = (driftargs.output, driftargs.gentle_port, driftargs.calc_intense, driftargs.align_shards, driftargs.pitch_engine, driftargs.sacc_workers, driftargs.pitch_chunks)
+    with multiprocessing.Pool(max(1, driftargs.jobs), initializer=init_worker, initargs=initargs) as pool:
+        for docid, error in pool.imap_unordered(process_recording, docids):
+            if error:
+                print(f"SYSTEM: {docid} failed: {error}")
+                failed.append(docid)
+
+    write_summary(store, docids)
+
+    print(f"SYSTEM: finished, {len(docids) - len(failed)} succeeded, {len(failed)} failed")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
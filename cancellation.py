@@ -0,0 +1,140 @@
+# Stopping analysis requests whose results nobody will read. A request is cancelled when
+#   - its client disconnects before the answer is sent,
+#   - a newer request arrives with the same cancel_token (e.g. the next drag of a selection), or
+#   - /_cancel is posted with its cancel_token.
+# Cancellation is cooperative: long loops call check(), which raises Cancelled in the thread
+# serving a cancelled request and does nothing anywhere else.
+
+import io
+import itertools
+import json
+import threading
+
+from twisted.web import resource
+
+
+class Cancelled(Exception):
+    pass
+
+
+class CancelToken:
+    def __init__(self, key=None):
+        # the client's cancel_token, if it sent one
+        self.key = key
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    def cancelled(self):
+        return self.event.is_set()
+
+    def check(self):
+        if self.event.is_set():
+            raise Cancelled()
+
+
+# the token of code not serving a cancellable request, never cancelled
+NEVER = CancelToken()
+
+local = threading.local()
+# tokens of requests being served, by request number
+running = {}
+lock = threading.Lock()
+numbers = itertools.count(1)
+
+
+def current():
+    return getattr(local, "token", NEVER)
+
+
+def check():
+    current().check()
+
+
+def cancel(key):
+    # cancel every running request sent with this cancel_token, returning how many there were
+    with lock:
+        tokens = [X for X in running.values() if X.key == key]
+    for token in tokens:
+        token.cancel()
+    return len(tokens)
+
+
+def _cancel(cmd):
+    return {"cancelled": cancel(cmd["cancel_token"])}
+
+
+def cancellable(fn):
+    # wraps a guts handler served through CancellableResource, running it with its request's token
+    def run(*args, **kwargs):
+        cmd = args[0] if args and isinstance(args[0], dict) else kwargs
+        number = cmd.pop("_request", None)
+        cmd.pop("cancel_token", None)
+
+        with lock:
+            token = running.get(int(number)) if number is not None else None
+        local.token = token or NEVER
+        try:
+            return fn(*args, **kwargs)
+        except Cancelled:
+            print(f"SYSTEM: {fn.__name__} cancelled")
+            return {"error": "cancelled", "cancelled": True}
+        finally:
+            local.token = NEVER
+
+    run.__name__ = fn.__name__
+    return run
+
+
+class CancellableResource(resource.Resource):
+    # passes requests through to a guts GetArgs/PostJson resource whose handler is wrapped with
+    # cancellable(), giving each request a token and telling the handler which one is its own
+    def __init__(self, wrapped):
+        super().__init__()
+        self.wrapped = wrapped
+
+    @property
+    def isLeaf(self):
+        return self.wrapped.isLeaf
+
+    def getChildWithDefault(self, path, req):
+        return CancellableResource(self.wrapped.getChildWithDefault(path, req))
+
+    def render(self, req):
+        number = next(numbers)
+
+        if req.method == b"POST":
+            try:
+                body = json.loads(req.content.read())
+            except ValueError:
+                body = None
+            if isinstance(body, dict):
+                key = body.get("cancel_token")
+                body["_request"] = number
+                req.content = io.BytesIO(json.dumps(body).encode())
+            else:
+                key = None
+                req.content.seek(0)
+        else:
+            key = (req.args.get(b"cancel_token") or [b""])[0].decode() or None
+            req.args[b"_request"] = [str(number).encode()]
+
+        if key is not None:
+            # superseded
+            cancel(key)
+
+        token = CancelToken(key)
+        with lock:
+            running[number] = token
+
+        def finished(_):
+            with lock:
+                running.pop(number, None)
+
+        def lost(_):
+            token.cancel()
+            finished(_)
+
+        req.notifyFinish().addCallbacks(finished, lost)
+        return self.wrapped.render(req)
@@ -0,0 +1,241 @@
+# Resumable uploads, for recordings too big to send in one request.
+#
+#   POST /_upload           {"name", "size", "id"?, "sha1"?}  -> {"upload", "offset"}
+#   GET  /_upload/<upload>                                    -> {"upload", "offset", "size"}
+#   PUT  /_upload/<upload>  body: the next chunk, headers Upload-Offset (where it goes) and
+#                           Chunk-Sha1 (optional, of the chunk) -> {"offset"} or, with the
+#                           last chunk, {"offset", "path", "sha1"}
+#
+# Chunks are appended straight to a .part file and hashed as they arrive. A client that loses its
+# connection asks for the offset and carries on from there. Once the last chunk is in, the file is
+# renamed into the attachments as <sha1><ext> like any other attachment. With "id" the document's
+# path is set too, so its stages can start without waiting on the client.
+# Sessions are kept on disk, so uploads can also be resumed after a restart.
+# Chunks are hashed and written on a thread, not the reactor, one chunk of an upload at a time.
+
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import uuid
+
+from twisted.internet import threads
+from twisted.web import resource, server
+
+# biggest chunk accepted in one PUT. twisted holds a request's body until it is complete
+MAX_CHUNK = 64 * 1024 * 1024
+# unfinished uploads untouched for this long are removed
+EXPIRE_AFTER = 24 * 60 * 60
+
+UPLOAD_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def json_response(req, obj, code=200):
+    req.setResponseCode(code)
+    req.setHeader(b"Content-Type", b"application/json")
+    return json.dumps(obj).encode()
+
+
+class ChunkedUpload(resource.Resource):
+    def __init__(self, uploadpath, attachpath, set_meta=None, completed=None):
+        super().__init__()
+        self.uploadpath = uploadpath
+        self.attachpath = attachpath
+        # set_meta(docid, key, val) to give the document its path, then completed(docid)
+        self.set_meta = set_meta
+        self.completed = completed
+        # running sha1 of each upload's .part, rebuilt from the file after a restart
+        self.hashes = {}
+        # held while a chunk of the upload is checked and written
+        self.locks = {}
+        os.makedirs(uploadpath, exist_ok=True)
+        self.sweep()
+
+    def getChild(self, path, req):
+        if path == b"":
+            return self
+        upload = path.decode("utf-8", "replace")
+        if not UPLOAD_ID.match(upload) or not os.path.exists(self.session_path(upload)):
+            return resource.NoResource("no such upload")
+        return UploadSession(self, upload)
+
+    def render_POST(self, req):
+        try:
+            cmd = json.loads(req.content.read())
+            size = int(cmd["size"])
+        except (ValueError, KeyError, TypeError):
+            return json_response(req, {"error": "expected {\"name\", \"size\"}"}, 400)
+
+        upload = uuid.uuid4().hex
+        session = {
+            "name": cmd.get("name", ""),
+            "ext": os.path.splitext(cmd.get("name", ""))[1].lower(),
+            "size": size,
+            "id": cmd.get("id"),
+            "sha1": cmd.get("sha1"),
+            "created": time.time(),
+        }
+        open(self.part_path(upload), "wb").close()
+        self.save_session(upload, session)
+        self.hashes[upload] = hashlib.sha1()
+
+        return json_response(req, {"upload": upload, "offset": 0})
+
+    def session_path(self, upload):
+        return os.path.join(self.uploadpath, upload + ".json")
+
+    def part_path(self, upload):
+        return os.path.join(self.uploadpath, upload + ".part")
+
+    def load_session(self, upload):
+        with open(self.session_path(upload)) as fh:
+            return json.load(fh)
+
+    def save_session(self, upload, session):
+        with open(self.session_path(upload) + ".tmp", "w") as fh:
+            json.dump(session, fh)
+        os.replace(self.session_path(upload) + ".tmp", self.session_path(upload))
+
+    def running_hash(self, upload):
+        if upload not in self.hashes:
+            sha = hashlib.sha1()
+            with open(self.part_path(upload), "rb") as fh:
+                for block in iter(lambda: fh.read(1 << 20), b""):
+                    sha.update(block)
+            self.hashes[upload] = sha
+        return self.hashes[upload]
+
+    def finish(self, upload, session):
+        # move the finished upload into the attachments, returning its name there
+        sha1 = self.running_hash(upload).hexdigest()
+        name = sha1 + session["ext"]
+        dest = os.path.join(self.attachpath, name)
+        if os.path.exists(dest):
+            os.remove(self.part_path(upload))
+        else:
+            os.replace(self.part_path(upload), dest)
+        self.forget(upload)
+        return name, sha1
+
+    def announce(self, session, name):
+        # on the reactor thread, once the upload is an attachment
+        if session.get("id") and self.set_meta is not None:
+            self.set_meta(session["id"], "path", name)
+            if self.completed is not None:
+                self.completed(session["id"])
+
+    def forget(self, upload):
+        self.hashes.pop(upload, None)
+        self.locks.pop(upload, None)
+        for path in [self.part_path(upload), self.session_path(upload)]:
+            if os.path.exists(path):
+                os.remove(path)
+
+    def sweep(self):
+        for filename in os.listdir(self.uploadpath):
+            upload = filename.split(".")[0]
+            if not UPLOAD_ID.match(upload):
+                continue
+            try:
+                if time.time() - os.path.getmtime(os.path.join(self.uploadpath, filename)) > EXPIRE_AFTER:
+                    self.forget(upload)
+            except OSError:
+                pass
+
+
+class UploadSession(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, uploads, upload):
+        super().__init__()
+        self.uploads = uploads
+        self.upload = upload
+
+    def render_GET(self, req):
+        session = self.uploads.load_session(self.upload)
+        return json_response(req, {
+            "upload": self.upload,
+            "offset": os.path.getsize(self.uploads.part_path(self.upload)),
+            "size": session["size"],
+        })
+
+    def render_PUT(self, req):
+        claimed = req.getHeader("upload-offset")
+        expected = req.getHeader("chunk-sha1")
+        lock = self.uploads.locks.setdefault(self.upload, threading.Lock())
+
+        gone = []
+        req.notifyFinish().addErrback(lambda _: gone.append(True))
+
+        def put():
+            with lock:
+                return self.put_chunk(req.content, claimed, expected)
+
+        def send(result):
+            code, obj, session = result
+            if "path" in obj:
+                self.uploads.announce(session, obj["path"])
+            if not gone:
+                req.write(json_response(req, obj, code))
+                req.finish()
+
+        def failed(failure):
+            print(f"SYSTEM: couldn't write a chunk of upload {self.upload}: {failure.getErrorMessage()}")
+            send((500, {"error": "couldn't write the chunk"}, None))
+
+        threads.deferToThread(put).addCallbacks(send, failed)
+        return server.NOT_DONE_YET
+
+    def put_chunk(self, body, claimed, expected):
+        # (code, response, session), on a thread
+        try:
+            session = self.uploads.load_session(self.upload)
+        except FileNotFoundError:
+            # finished or expired while the chunk waited its turn
+            return 404, {"error": "no such upload"}, None
+        part_path = self.uploads.part_path(self.upload)
+        offset = os.path.getsize(part_path)
+
+        # a chunk is only appended where the last one ended. anything else is a retry of a chunk that
+        # already arrived, or one sent after a lost chunk. either way the client goes on from offset
+        if claimed is None or not claimed.isdigit() or int(claimed) != offset:
+            return 409, {"error": "wrong offset", "offset": offset}, session
+
+        body.seek(0, os.SEEK_END)
+        length = body.tell()
+        body.seek(0)
+        if length > MAX_CHUNK:
+            return 413, {"error": f"chunks are at most {MAX_CHUNK} bytes", "offset": offset}, session
+        if offset + length > session["size"]:
+            return 400, {"error": "more data than the upload's size", "offset": offset}, session
+
+        chunk_sha = hashlib.sha1()
+        for block in iter(lambda: body.read(1 << 20), b""):
+            chunk_sha.update(block)
+        if expected is not None and expected.lower() != chunk_sha.hexdigest():
+            return 400, {"error": "chunk corrupted in transit", "offset": offset}, session
+
+        sha = self.uploads.running_hash(self.upload)
+        body.seek(0)
+        try:
+            with open(part_path, "ab") as fh:
+                for block in iter(lambda: body.read(1 << 20), b""):
+                    sha.update(block)
+                    fh.write(block)
+        except OSError:
+            # the hash may be ahead of what made it to disk, rebuild it on the next chunk
+            self.uploads.hashes.pop(self.upload, None)
+            raise
+        offset += length
+
+        if offset < session["size"]:
+            return 200, {"offset": offset}, session
+
+        if session.get("sha1") and session["sha1"].lower() != sha.hexdigest():
+            self.uploads.forget(self.upload)
+            return 400, {"error": "upload corrupted, sha1 does not match"}, session
+
+        name, sha1 = self.uploads.finish(self.upload, session)
+        return 200, {"offset": offset, "path": name, "sha1": sha1}, session
@@ -0,0 +1,137 @@
+# Corpus-wide distribution of each measure, kept up to date one document at a time.
+# Both summaries are mergeable and support removing a value, so a document whose measures
+# change is taken out and put back in without going over the rest of the corpus.
+
+import math
+
+
+class Moments:
+    # count, mean and variance (Welford, merged with Chan et al.)
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, val):
+        self.count += 1
+        delta = val - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (val - self.mean)
+
+    def remove(self, val):
+        if self.count <= 1:
+            self.__init__()
+            return
+        delta = val - self.mean
+        self.mean -= delta / (self.count - 1)
+        self.m2 -= delta * (val - self.mean)
+        self.count -= 1
+        self.m2 = max(self.m2, 0.0)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count == 0:
+            return
+        delta = other.mean - self.mean
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.mean += delta * other.count / count
+        self.count = count
+
+    def variance(self):
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+
+class QuantileSketch:
+    # DDSketch (Masson, Rim & Lee 2019): values are counted in logarithmically sized buckets, so every
+    # quantile is within relative_accuracy of a true value. merging adds counts, removing subtracts one
+    MIN_VALUE = 1e-9
+
+    def __init__(self, relative_accuracy=0.01):
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zeros = 0
+        self.count = 0
+
+    def key(self, val):
+        return math.ceil(math.log(val) / self.log_gamma)
+
+    def value(self, key):
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, val, n=1):
+        if val > self.MIN_VALUE:
+            bump(self.positive, self.key(val), n)
+        elif val < -self.MIN_VALUE:
+            bump(self.negative, self.key(-val), n)
+        else:
+            self.zeros += n
+        self.count += n
+
+    def remove(self, val):
+        self.add(val, -1)
+
+    def merge(self, other):
+        for key, n in other.positive.items():
+            bump(self.positive, key, n)
+        for key, n in other.negative.items():
+            bump(self.negative, key, n)
+        self.zeros += other.zeros
+        self.count += other.count
+
+    def quantile(self, q):
+        if self.count <= 0:
+            return None
+
+        rank = q * (self.count - 1)
+        seen = 0
+        # most negative first
+        for key in sorted(self.negative, reverse=True):
+            seen += self.negative[key]
+            if seen > rank:
+                return -self.value(key)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for key in sorted(self.positive):
+            seen += self.positive[key]
+            if seen > rank:
+                return self.value(key)
+        return self.value(max(self.positive)) if self.positive else 0.0
+
+
+def bump(buckets, key, n):
+    buckets[key] = buckets.get(key, 0) + n
+    if buckets[key] == 0:
+        del buckets[key]
+
+
+class CorpusStats:
+    # {label: (Moments, QuantileSketch)} over every document's value of that measure
+    def __init__(self):
+        self.labels = {}
+
+    def add(self, label, val):
+        if label not in self.labels:
+            self.labels[label] = (Moments(), QuantileSketch())
+        for summary in self.labels[label]:
+            summary.add(val)
+
+    def remove(self, label, val):
+        if label not in self.labels:
+            return
+        for summary in self.labels[label]:
+            summary.remove(val)
+        if self.labels[label][0].count == 0:
+            del self.labels[label]
+
+    def summary(self, label, quantiles):
+        moments, sketch = self.labels[label]
+        return {
+            "count": moments.count,
+            "mean": moments.mean,
+            "variance": moments.variance(),
+            "std": math.sqrt(moments.variance()),
+            "quantiles": {str(q): sketch.quantile(q) for q in quantiles},
+        }
@@ -14,27 +14,181 @@ def smooth(y, N=7, polyorder=2):
     return scipy.signal.savgol_filter(arr, N, polyorder)
 
 
+def pitched_runs(pitch):
+    # A pitched chunk starts on a frame above 20hz and lasts until a frame
+    # drops below 20hz. Returns [start, end) frame indices of each chunk.
+    cont = np.concatenate(([False], ~(pitch < 20), [False]))
+    edges = np.flatnonzero(cont[1:] != cont[:-1])
+    cont_starts, cont_ends = edges[::2], edges[1::2]
+
+    # frames sitting exactly on 20hz can extend a chunk but not start one
+    above = np.flatnonzero(pitch > 20)
+    first_above = np.searchsorted(above, cont_starts)
+    has_start = first_above < len(above)
+    starts = np.full(len(cont_starts), -1)
+    starts[has_start] = above[first_above[has_start]]
+    keep = (starts >= 0) & (starts < cont_ends)
+
+    return starts[keep], cont_ends[keep]
+
+
+@functools.lru_cache()
+def savgol_matrix(N, polyorder):
+    # Row i holds the weights savgol_filter applies to a length-N input to
+    # produce output i.
+    return scipy.signal.savgol_filter(np.eye(N), N, polyorder, axis=0)
+
+
+def smooth_runs(pitch, starts, ends, N=7, polyorder=2):
+    # Equivalent to calling `smooth` on each chunk, concatenating the results.
+    # savgol_filter is linear, so it can be applied to every chunk at once with
+    # the same 7-tap kernel for interior frames and per-edge fit matrices.
+    lengths = ends - starts
+    run_ids = np.repeat(np.arange(len(starts)), lengths)
+    offsets = np.arange(len(run_ids)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    frames = np.repeat(starts, lengths) + offsets
+    vals = pitch[frames]
+
+    out = vals.astype(float)
+    run_len = lengths[run_ids]
+    smoothable = run_len >= N
+    if not smoothable.any():
+        return out, run_ids
+
+    half = N // 2
+    fit = savgol_matrix(N, polyorder)
+    padded = np.concatenate((np.zeros(half), pitch, np.zeros(half)))
+    windows = np.lib.stride_tricks.sliding_window_view(padded, N)
+
+    # interior frames
+    interior = smoothable & (offsets >= half) & (offsets < run_len - half)
+    out[interior] = windows[frames[interior]] @ fit[half]
+
+    # leading and trailing edges are fit to the first/last N frames of the chunk
+    lead = smoothable & (offsets < half)
+    lead_win = windows[(frames - offsets)[lead] + half]
+    out[lead] = np.einsum("ij,ij->i", lead_win, fit[offsets[lead]])
+
+    trail = smoothable & (offsets >= run_len - half) & ~lead
+    trail_pos = offsets[trail] - run_len[trail] + N
+    trail_win = windows[(frames - offsets)[trail] + run_len[trail] - N + half]
+    out[trail] = np.einsum("ij,ij->i", trail_win, fit[trail_pos])
+
+    return out, run_ids
+
+
+def binary_string(mask):
+    return (np.asarray(mask, dtype=np.uint8) + ord("0")).tobytes().decode("ascii")
+
+
+# Segment stats that are plain sums, see Measure.compute_additive
+ADDITIVE_STATS = [
+    "duration",
+    "number_of_words",
+    "number_of_phonemes",
+    "number_of_long_pauses",
+    "number_of_pauses",
+    "pause_duration",
+]
+
+
+class IntervalIndex:
+    # Binary-searchable view over items (segments, words) listed in time
+    # order. Running max/min bounds keep lookups correct even if neighbouring
+    # items overlap or are out of order.
+    def __init__(self, starts, ends):
+        starts = np.asarray(starts, dtype=float)
+        ends = np.asarray(ends, dtype=float)
+        self.start_max = np.maximum.accumulate(starts) if len(starts) else starts
+        self.end_max = np.maximum.accumulate(ends) if len(ends) else ends
+        self.start_min_after = (
+            np.minimum.accumulate(starts[::-1])[::-1] if len(starts) else starts
+        )
+
+    def ending_at_or_after(self, t):
+        # index of the first item whose end could be >= t
+        return int(np.searchsorted(self.end_max, t, side="left"))
+
+    def ending_after(self, t):
+        # index of the first item whose end could be > t
+        return int(np.searchsorted(self.end_max, t, side="right"))
+
+    def starting_after(self, t):
+        # index of the first item starting after t
+        return int(np.searchsorted(self.start_max, t, side="right"))
+
+    def all_starting_from(self, t):
+        # index from which every remaining item starts at or after t
+        return int(np.searchsorted(self.start_min_after, t, side="left"))
+
+
 class Measure:
     def __init__(self, pitch, alignment=None):
-        self.pitch = pitch
+        self.pitch = np.asarray(pitch, dtype=float)
         self.alignment = alignment
 
+        if alignment is not None:
+            segments = alignment["segments"]
+            self.segment_index = IntervalIndex(
+                [X["start"] for X in segments], [X["end"] for X in segments]
+            )
+            # words without an end are never kept by a start_time trim. words
+            # Gentle couldn't find in the audio have no times at all, and are
+            # indexed as starting after and ending before everything
+            self.word_indexes = [
+                IntervalIndex(
+                    [np.inf if X.get("start") is None else X["start"] for X in seg["wdlist"]],
+                    [X.get("end") or -np.inf for X in seg["wdlist"]],
+                )
+                for seg in segments
+            ]
+
+            # Running totals of each whole segment's word stats, for compute_additive
+            self.segments_sorted = all(
+                a["start"] <= b["start"] and a["end"] <= b["end"]
+                for a, b in zip(segments, segments[1:])
+            )
+            seg_stats = [
+                self._clipped_word_stats(seg_idx, None, None)
+                for seg_idx in range(len(segments))
+            ]
+            self.segment_has_words = [X is not None for X in seg_stats]
+            self.segment_totals = {
+                key: np.concatenate(([0], np.cumsum([(X or {}).get(key, 0) for X in seg_stats])))
+                for key in ADDITIVE_STATS
+            }
+
+    def _segment_range(self, start_time, end_time):
+        first = 0
+        if start_time is not None:
+            first = self.segment_index.ending_at_or_after(start_time)
+        last = len(self.alignment["segments"])
+        if end_time is not None:
+            last = self.segment_index.starting_after(end_time)
+        return first, last
+
+    def _clip_segment(self, seg_idx, start_time, end_time):
+        seg = self.alignment["segments"][seg_idx]
+        seg_st = seg["start"]
+        if start_time is not None:
+            seg_st = max(seg_st, start_time)
+        seg_end = seg["end"]
+        if end_time is not None:
+            seg_end = min(end_time, seg_end)
+        return seg_st, seg_end
+
     def _raw_compute(self, start_time=None, end_time=None):
+        segments = self.alignment["segments"]
+        first, last = self._segment_range(start_time, end_time)
+
         stat_list = []
-        for seg in self.alignment["segments"]:
-            if end_time is not None and seg["start"] > end_time:
-                break
+        for seg_idx in range(first, last):
+            seg = segments[seg_idx]
             if start_time is not None and seg["end"] < start_time:
                 continue
 
-            seg_st = seg["start"]
-            if start_time is not None:
-                seg_st = max(seg_st, start_time)
-            seg_end = seg["end"]
-            if end_time is not None:
-                seg_end = min(end_time, seg_end)
-
-            stat_list.append(self._raw_measure_for_segment(seg, seg_st, seg_end))
+            seg_st, seg_end = self._clip_segment(seg_idx, start_time, end_time)
+            stat_list.append(self._raw_measure_for_segment(seg_idx, seg_st, seg_end))
 
         stats = self._accumulate_stats(stat_list)
         return stats
@@ -43,61 +197,83 @@ class Measure:
         stats = self._raw_compute(start_time, end_time)
         return self._compute_measure(stats)
 
-    def _raw_measure_for_segment(self, segment, start_time=0, end_time=None):
+    def compute_additive(self, start_time=None, end_time=None):
+        # The pause and rate measures of `compute`, which only need sums and
+        # counts. Segments entirely inside the range come from running totals;
+        # only the (at most two) segments cut by the range are trimmed.
+        if not self.segments_sorted:
+            return self._compute_rates(self._raw_compute(start_time, end_time))
+
+        segments = self.alignment["segments"]
+        first, last = self._segment_range(start_time, end_time)
+
+        def inside(seg):
+            return (start_time is None or seg["start"] >= start_time) and (
+                end_time is None or seg["end"] <= end_time
+            )
+
+        inner_first = first
+        while inner_first < last and not inside(segments[inner_first]):
+            inner_first += 1
+        inner_last = last
+        while inner_last > inner_first and not inside(segments[inner_last - 1]):
+            inner_last -= 1
+
+        stat_list = [
+            self._clipped_word_stats(seg_idx, start_time, end_time)
+            for seg_idx in range(first, inner_first)
+        ]
+        if inner_last > inner_first:
+            if not self.segment_has_words[inner_first]:
+                stat_list.append(None)
+            stat_list.append(
+                {
+                    key: cum[inner_last] - cum[inner_first]
+                    for key, cum in self.segment_totals.items()
+                }
+            )
+        stat_list += [
+            self._clipped_word_stats(seg_idx, start_time, end_time)
+            for seg_idx in range(inner_last, last)
+        ]
+
+        # like `compute`, a range starting in a segment with no words has no measures
+        if len(stat_list) == 0 or stat_list[0] is None:
+            return {}
+
+        stats = self._accumulate_stats([X for X in stat_list if X is not None])
+        return self._compute_rates(stats)
+
+    def _clipped_word_stats(self, seg_idx, start_time, end_time):
+        seg_st, seg_end = self._clip_segment(seg_idx, start_time, end_time)
+        wdlist, _pitch = self._trim_segment(seg_idx, seg_st, seg_end)
+        if len(wdlist) == 0:
+            return None
+        return self._word_stats(wdlist, seg_st, seg_end)
+
+    def _raw_measure_for_segment(self, seg_idx, start_time=0, end_time=None):
         out = {}
 
-        wdlist, pitch = self._trim_segment(segment, start_time, end_time)
+        wdlist, pitch = self._trim_segment(seg_idx, start_time, end_time)
 
-        out["pitched"] = [X for X in pitch if X > 20]
+        out["pitched"] = pitch[pitch > 20]
 
         # Compute pitch velocity and acceleration deltas on smoothed
         # voiced chunks, in log-space.
+        run_starts, run_ends = pitched_runs(pitch)
+        smoothed, run_ids = smooth_runs(pitch, run_starts, run_ends)
 
-        # first, get pitched chunks
-        is_pitched = False
-        pitched_chunks = []
-        cur_pitches = None
-        for p_val in pitch:
-            if is_pitched:
-                if p_val < 20:
-                    # End a pitched chunk
-                    is_pitched = False
-                else:
-                    cur_pitches.append(p_val)
-            else:
-                if p_val > 20:
-                    # Start a pitched chunk!
-                    is_pitched = True
-                    cur_pitches = [p_val]
-                    pitched_chunks.append(cur_pitches)
-
-        # then, smooth out each pitched segment
-        pitched_chunks = [smooth(ch) for ch in pitched_chunks]
-
-        # pitch_dt -
-        dt_chunks = []
-        for ch in pitched_chunks:
-            dt_chunk = []
-            dt_chunks.append(dt_chunk)
-            for idx, p1_val in enumerate(ch[:-1]):
-                p2_val = ch[idx + 1]
-                dt_chunk.append(abs(np.log2(p1_val) - np.log2(p2_val)))
+        # pitch_dt - only between neighbours within the same chunk
+        same_run = run_ids[1:] == run_ids[:-1]
+        dt = np.abs(np.diff(np.log2(smoothed)))[same_run]
+        dt_run_ids = run_ids[1:][same_run]
 
         # pitch_dv -
-        dv_chunks = []
-        for ch in dt_chunks:
-            dv_chunk = []
-            dv_chunks.append(dv_chunk)
-            for idx, p1_val in enumerate(ch[:-1]):
-                p2_val = ch[idx + 1]
-                dv_chunk.append(abs(p1_val - p2_val))
-
-        out["pitch_log_deltas"] = functools.reduce(
-            lambda acc, x: acc + x, dt_chunks, []
-        )
-        out["pitch_velocity_deltas"] = functools.reduce(
-            lambda acc, x: acc + x, dv_chunks, []
-        )
+        same_run = dt_run_ids[1:] == dt_run_ids[:-1]
+        dv = np.abs(np.diff(dt))[same_run]
+
+        out["pitch_log_deltas"] = dt
+        out["pitch_velocity_deltas"] = dv
 
         if len(wdlist) == 0:
             return out
@@ -105,6 +281,37 @@ class Measure:
         if end_time is None:
             end_time = wdlist[-1]["end"]
 
+        out.update(self._word_stats(wdlist, start_time, end_time))
+
+        # Based on `prosodic_measures.py`, accumulate a binary string indicating gap or non-gap, sampled at 100hz.
+        # Sample times accumulate 0.01 at a time, exactly like stepping a clock.
+        n_est = int((end_time - start_time) * 100) + 3
+        clock = np.cumsum(np.concatenate(([start_time], np.full(n_est, 0.01))))
+        n_samples = int(np.searchsorted(clock, end_time, side="left"))
+
+        # ...voiced sequence: one pitch frame per tick, holding the last frame
+        pitch_idx = np.minimum(np.arange(n_samples), max(len(pitch) - 1, 0))
+        voiced = pitch[pitch_idx] > 20
+
+        # Word sequence: the current word advances at most one step per
+        # tick, and only once the clock has passed its end.
+        wd_ends = np.array([X.get("end", np.inf) for X in wdlist[:-1]], dtype=float)
+        passed = np.searchsorted(clock, wd_ends, side="right")
+        lag = np.maximum.accumulate(
+            np.concatenate(([0], passed - np.arange(1, len(passed) + 1)))
+        )
+        advance_at = (lag + np.arange(len(lag)))[1:]
+        wd_idx = np.searchsorted(advance_at, np.arange(n_samples), side="right")
+        is_gap = np.array([X.get("type") == "gap" for X in wdlist], dtype=bool)
+
+        out["word_gap_sequence"] = binary_string(~is_gap[wd_idx])
+        out["voiced_gap_sequence"] = binary_string(voiced)
+
+        return out
+
+    def _word_stats(self, wdlist, start_time, end_time):
+        out = {}
+
         out["duration"] = end_time - start_time
 
         out["number_of_words"] = len([X for X in wdlist if X.get("word") is not None])
@@ -132,37 +339,6 @@ class Measure:
 
         out["pause_duration"] = sum([X["end"] - X["start"] for X in pauses])
 
-        # Based on `prosodic_measures.py`, accumulate a binary string indicating gap or non-gap, sampled at 100hz.
-
-        wd_s = ""
-        voice_s = ""
-
-        cur_t = start_time
-        cur_wd_idx = 0
-        cur_pitch_idx = 0
-        while cur_t < end_time:
-            # Word sequence
-            obj = wdlist[cur_wd_idx]
-            if obj.get("type") == "gap":
-                wd_s += "0"
-            else:
-                wd_s += "1"
-
-            # ...voiced sequence
-            if pitch[cur_pitch_idx] > 20:
-                voice_s += "1"
-            else:
-                voice_s += "0"
-
-            cur_t += 0.01
-            if len(pitch) > cur_pitch_idx + 1:
-                cur_pitch_idx += 1
-            if obj["end"] < cur_t and len(wdlist) > cur_wd_idx + 1:
-                cur_wd_idx += 1
-
-        out["word_gap_sequence"] = wd_s
-        out["voiced_gap_sequence"] = voice_s
-
         return out
 
     def _accumulate_stats(self, stat_list):
@@ -170,12 +346,16 @@ class Measure:
         out = {}
         if len(stat_list) > 0:
             for key in stat_list[0].keys():
-                out[key] = functools.reduce(
-                    lambda acc, x: acc + x, [S[key] for S in stat_list]
-                )
+                vals = [S[key] for S in stat_list]
+                if isinstance(vals[0], np.ndarray):
+                    out[key] = np.concatenate(vals)
+                elif isinstance(vals[0], str):
+                    out[key] = "".join(vals)
+                else:
+                    out[key] = sum(vals)
         return out
 
-    def _compute_measure(self, stats):
+    def _compute_rates(self, stats):
         out = {}
         if stats.get("number_of_pauses") is None:
             return out
@@ -196,19 +376,24 @@ class Measure:
             stats["duration"] / 60.0
         )
 
+        return out
+
+    def _compute_measure(self, stats):
+        out = self._compute_rates(stats)
+        if len(out) == 0:
+            return out
+
         # Replace "entropy" with "chroma_uniformity"
         n_bins = 10
         # quantize to 25 bins, per-octave
-        chroma = [int((np.log2(X) % 1) * n_bins) for X in stats["pitched"]]
+        chroma = ((np.log2(stats["pitched"]) % 1) * n_bins).astype(int)
         # return the ratio of 10th to 90th percentile
-        cnts = {}
-        for c in chroma:
-            cnts[c] = cnts.get(c, 0) + 1
-        cnts = sorted(cnts.values())
-        out["octave_variation"] = cnts[-2] / max(1, cnts[1])
+        cnts = np.bincount(chroma)
+        cnts = np.sort(cnts[cnts > 0])
+        out["octave_variation"] = int(cnts[-2]) / max(1, int(cnts[1]))
 
         # filter pitch within 9-91% distribution
-        pitched = sorted(stats["pitched"])
+        pitched = np.sort(stats["pitched"])
         trim_pt = int(len(pitched) * 0.09)
         pitched = pitched[trim_pt:-trim_pt]
 
@@ -217,18 +402,12 @@ class Measure:
 
         out["pitch_range_octaves"] = np.log2(max_pitch / min_pitch)
 
-        out["log_mean_pitch_hz"] = 2 ** (
-            sum([np.log2(X) for X in pitched]) / len(pitched)
-        )
+        out["log_mean_pitch_hz"] = 2 ** np.mean(np.log2(pitched))
 
         # pitch speed (octaves/sec)
-        out["pitch_speed_octaves"] = 100 * (
-            sum(stats["pitch_log_deltas"]) / len(stats["pitch_log_deltas"])
-        )
+        out["pitch_speed_octaves"] = 100 * np.mean(stats["pitch_log_deltas"])
         # pitch accel (octaves/sec^2)
-        out["pitch_acceleration"] = 100 * (
-            sum(stats["pitch_velocity_deltas"]) / len(stats["pitch_velocity_deltas"])
-        )
+        out["pitch_acceleration"] = 100 * np.mean(stats["pitch_velocity_deltas"])
 
         wd_s = stats["word_gap_sequence"]
         voice_s = stats["voiced_gap_sequence"]
@@ -242,14 +421,23 @@ class Measure:
 
         return out
 
-    def _trim_segment(self, segment, start_time, end_time):
+    def _trim_segment(self, seg_idx, start_time, end_time):
         # Compute measures for some or all of a segment
-        wdlist = segment["wdlist"]
+        wdlist = self.alignment["segments"][seg_idx]["wdlist"]
+        word_index = self.word_indexes[seg_idx]
         pitch = self.pitch
 
         # print("trim", segment, start_time, end_time)
 
-        # 1. Trim segment words & pitch
+        # 1. Trim segment words & pitch, only looking at words that can overlap
+        first = 0
+        last = len(wdlist)
+        if start_time is not None:
+            first = word_index.ending_after(start_time)
+        if end_time is not None:
+            last = max(first, word_index.all_starting_from(end_time))
+        wdlist = wdlist[first:last]
+
         if start_time is not None:
             wdlist = [X for X in wdlist if X.get("end") and X["end"] > start_time]
             pitch = pitch[int(start_time * 100) :]
@@ -0,0 +1,162 @@
+# Corpus export: a zip of every chosen document's pitch, rms, alignment and measures as tables in
+# one of FORMATS, read from the attachments already computed (see pipeline.export_tables).
+#
+#   GET /_export?format=csv|npz|parquet&ids=<id>,<id>...   (no ids: every aligned document)
+#
+# The zip is written as it's sent, a table at a time, with no temporary files. The writer thread
+# blocks while the client is behind, so memory stays around one document's tables whatever the
+# size of the corpus. Parquet needs pyarrow.
+
+import csv
+import io
+import threading
+import time
+import zipfile
+
+import numpy as np
+from twisted.internet import reactor, threads
+from twisted.web import resource, server
+
+import admission
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+FORMATS = ["csv", "npz"] + (["parquet"] if pyarrow is not None else [])
+# bytes collected before they're handed to the reactor
+SEND_CHUNK = 256 * 1024
+
+
+class ClientGone(Exception):
+    pass
+
+
+def write_table(zf, name, columns, fmt):
+    # columns: {column name: list or array}, all the same length
+    if fmt == "csv":
+        with zf.open(name + ".csv", "w") as fh, io.TextIOWrapper(fh, encoding="utf-8", newline="") as text:
+            w = csv.writer(text)
+            w.writerow(list(columns))
+            for row in zip(*columns.values()):
+                w.writerow(row)
+    elif fmt == "npz":
+        with zf.open(name + ".npz", "w") as fh:
+            np.savez(fh, **{k: np.asarray(v) for k, v in columns.items()})
+    elif fmt == "parquet":
+        # pyarrow wants a seekable file, so each table is put together in memory first
+        buf = pyarrow.BufferOutputStream()
+        pyarrow.parquet.write_table(pyarrow.table(columns), buf)
+        with zf.open(name + ".parquet", "w") as fh:
+            fh.write(buf.getvalue().to_pybytes())
+    else:
+        raise ValueError(f"unknown export format {fmt}")
+
+
+def write_archive(out, docs, tables, fmt):
+    # zip of docs' tables to the writable out, which needn't be seekable. docs: [{"id", "title"}],
+    # tables(docid) yields (name, columns) of the document
+    with zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED) as zf:
+        index = {"id": [], "title": [], "tables": []}
+        for doc in docs:
+            names = []
+            for name, columns in tables(doc["id"]):
+                write_table(zf, f"{doc['id']}/{name}", columns, fmt)
+                names.append(name)
+            index["id"].append(doc["id"])
+            index["title"].append(doc.get("title") or "")
+            index["tables"].append(" ".join(names))
+        write_table(zf, "documents", index, fmt)
+
+
+class RequestWriter(io.RawIOBase):
+    # file-like end of a streamed response, made on the reactor thread and written from another.
+    # registered as the request's producer, so writes wait while the transport's buffer is full
+    def __init__(self, req):
+        self.req = req
+        self.buf = bytearray()
+        self.flowing = threading.Event()
+        self.flowing.set()
+        self.gone = False
+        req.registerProducer(self, True)
+        req.notifyFinish().addErrback(lambda _: self.stopProducing())
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buf += data
+        if len(self.buf) >= SEND_CHUNK:
+            self.send()
+        return len(data)
+
+    def send(self):
+        while not self.flowing.wait(1):
+            if self.gone:
+                break
+        if self.gone:
+            raise ClientGone()
+        data, self.buf = bytes(self.buf), bytearray()
+        threads.blockingCallFromThread(reactor, self.req.write, data)
+
+    def finish(self):
+        self.send()
+        reactor.callFromThread(self.done)
+
+    def done(self):
+        self.req.unregisterProducer()
+        self.req.finish()
+
+    # IPushProducer, called by the reactor
+    def pauseProducing(self):
+        self.flowing.clear()
+
+    def resumeProducing(self):
+        self.flowing.set()
+
+    def stopProducing(self):
+        self.gone = True
+        self.flowing.set()
+
+
+class ExportResource(resource.Resource):
+    isLeaf = True
+
+    def __init__(self, docs, tables):
+        # docs(ids) -> [{"id", "title"}] to export, ids None for all of them. tables as for write_archive
+        super().__init__()
+        self.docs = docs
+        self.tables = tables
+
+    def render_GET(self, req):
+        fmt = (req.args.get(b"format") or [b"csv"])[0].decode()
+        if fmt not in FORMATS:
+            req.setResponseCode(400)
+            return f"format must be one of {', '.join(FORMATS)}".encode()
+        ids = (req.args.get(b"ids") or [b""])[0].decode()
+        ids = [X for X in ids.split(",") if X] or None
+
+        req.setHeader(b"Content-Type", b"application/zip")
+        req.setHeader(b"Content-Disposition", f'attachment; filename="drift-export-{fmt}.zip"'.encode())
+        reactor.callInThread(self.stream, req, RequestWriter(req), ids, fmt)
+        return server.NOT_DONE_YET
+
+    def stream(self, req, out, ids, fmt):
+        started = time.time()
+        try:
+            docs = self.docs(ids)
+            write_archive(out, docs, self.tables, fmt)
+            out.finish()
+        except ClientGone:
+            print("SYSTEM: export abandoned by the client")
+            return
+        except Exception as e:
+            # the headers are gone already, all that's left is to cut the archive short
+            print(f"SYSTEM: export failed: {e}")
+            reactor.callFromThread(req.loseConnection)
+            return
+        finally:
+            admission.job_finished(req)
+        print(f"SYSTEM: exported {len(docs)} documents as {fmt} (took {time.time() - started:.2f}s)")
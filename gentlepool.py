@@ -0,0 +1,105 @@
+# Several Gentle servers to align with. Each job goes to the healthy server with the least audio
+# still being aligned on it. A server that fails a request is skipped until a health probe finds it
+# answering again.
+
+import contextlib
+import threading
+import time
+
+import requests
+
+# seconds between probes of a server marked unhealthy, and how long a probe waits for an answer
+HEALTH_INTERVAL = 30
+HEALTH_TIMEOUT = 2
+
+
+class GentleBackend:
+    def __init__(self, address):
+        # "8765", "host:8765" or "http://host:8765"
+        address = str(address).strip()
+        if "://" not in address:
+            address = "http://" + (address if ":" in address else "localhost:" + address)
+        self.url = address.rstrip("/")
+        self.port = int(self.url.rsplit(":", 1)[1])
+
+        self.healthy = True
+        self.checked = 0
+        # seconds of audio sent and not aligned yet
+        self.outstanding = 0.0
+
+        self.jobs = 0
+        self.failures = 0
+        self.audio_seconds = 0.0
+        self.busy_seconds = 0.0
+
+    def stats(self):
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "outstanding_seconds": self.outstanding,
+            "jobs": self.jobs,
+            "failures": self.failures,
+            "audio_seconds": self.audio_seconds,
+            "busy_seconds": self.busy_seconds,
+            # seconds of audio aligned per second spent aligning
+            "throughput": self.audio_seconds / self.busy_seconds if self.busy_seconds else None,
+        }
+
+
+class GentlePool:
+    def __init__(self, addresses):
+        self.backends = [GentleBackend(X) for X in addresses]
+        self.lock = threading.Lock()
+
+    def probe(self, backend):
+        try:
+            backend.healthy = requests.get(backend.url, timeout=HEALTH_TIMEOUT).status_code < 500
+        except requests.RequestException:
+            backend.healthy = False
+        backend.checked = time.time()
+        return backend.healthy
+
+    @contextlib.contextmanager
+    def backend(self, work):
+        # with pool.backend(seconds of audio) as backend: ... send the job to backend.url
+        for backend in self.backends:
+            if not backend.healthy and time.time() - backend.checked > HEALTH_INTERVAL:
+                self.probe(backend)
+        if not any(X.healthy for X in self.backends):
+            for backend in self.backends:
+                self.probe(backend)
+
+        with self.lock:
+            # with nothing answering, try them all anyway so the job fails with the real error
+            candidates = [X for X in self.backends if X.healthy] or self.backends
+            backend = min(candidates, key=lambda X: X.outstanding)
+            backend.outstanding += work
+
+        started = time.time()
+        try:
+            yield backend
+        except requests.RequestException:
+            with self.lock:
+                backend.failures += 1
+                backend.healthy = False
+                backend.checked = time.time()
+            raise
+        else:
+            with self.lock:
+                backend.jobs += 1
+                backend.audio_seconds += work
+                backend.busy_seconds += time.time() - started
+        finally:
+            with self.lock:
+                backend.outstanding -= work
+
+    def stats(self):
+        with self.lock:
+            return [X.stats() for X in self.backends]
+
+
+def parse_addresses(value):
+    # the --gentle_port / _settings value: a port, or a comma separated list of ports and host:ports
+    if isinstance(value, (list, tuple)):
+        return [str(X) for X in value]
+    return [X for X in str(value).split(",") if X.strip()]
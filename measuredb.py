@@ -0,0 +1,133 @@
+# Full transcript measures of every document in a local SQLite database, indexed by measure,
+# so corpus questions ("WPM > 150, ordered by Dynamism") don't need each document's full_ts
+# attachment loaded or recomputed. It only mirrors full_ts, so it can be deleted and rebuilt at any time.
+
+import math
+import sqlite3
+import threading
+import time
+
+from corpusstats import CorpusStats
+
+# bump when the tables or what goes in them change. an older database is dropped and refilled from full_ts
+SCHEMA_VERSION = 2
+
+OPERATORS = {">": ">", ">=": ">=", "<": "<", "<=": "<=", "=": "=", "==": "=", "!=": "!="}
+
+
+class MeasureDB:
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+
+        with self.lock, self.db:
+            if self.db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.db.execute("DROP TABLE IF EXISTS docs")
+                self.db.execute("DROP TABLE IF EXISTS measures")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS docs (
+                docid TEXT PRIMARY KEY,
+                title TEXT,
+                full_ts TEXT,
+                calc_intense INTEGER,
+                schema_version INTEGER,
+                updated REAL)""")
+            self.db.execute("""CREATE TABLE IF NOT EXISTS measures (
+                docid TEXT,
+                label TEXT,
+                value REAL,
+                PRIMARY KEY (docid, label)) WITHOUT ROWID""")
+            self.db.execute("CREATE INDEX IF NOT EXISTS measures_label_value ON measures (label, value)")
+            self.db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        # distribution of each measure over the corpus, kept up to date by put and forget
+        self.stats = CorpusStats()
+        with self.lock:
+            for label, val in self.db.execute("SELECT label, value FROM measures"):
+                self.stats.add(label, val)
+
+    def has(self, docid, full_ts):
+        with self.lock:
+            row = self.db.execute("SELECT full_ts FROM docs WHERE docid = ?", (docid,)).fetchone()
+        return row is not None and row[0] == full_ts
+
+    def put(self, docid, title, full_ts, measures, calc_intense):
+        rows = [
+            (docid, label, float(val))
+            for label, val in measures.items()
+            if isinstance(val, (int, float)) and not isinstance(val, bool) and math.isfinite(val)
+        ]
+        with self.lock, self.db:
+            self.forget_stats(docid)
+            self.db.execute("DELETE FROM measures WHERE docid = ?", (docid,))
+            self.db.executemany("INSERT INTO measures VALUES (?, ?, ?)", rows)
+            for _docid, label, val in rows:
+                self.stats.add(label, val)
+            self.db.execute("INSERT OR REPLACE INTO docs VALUES (?, ?, ?, ?, ?, ?)",
+                (docid, title, full_ts, int(bool(calc_intense)), SCHEMA_VERSION, time.time()))
+
+    def forget(self, docids):
+        with self.lock, self.db:
+            for docid in docids:
+                self.forget_stats(docid)
+                self.db.execute("DELETE FROM measures WHERE docid = ?", (docid,))
+                self.db.execute("DELETE FROM docs WHERE docid = ?", (docid,))
+
+    def forget_stats(self, docid):
+        for label, val in self.db.execute("SELECT label, value FROM measures WHERE docid = ?", (docid,)).fetchall():
+            self.stats.remove(label, val)
+
+    def summaries(self, labels=None, quantiles=(0.05, 0.5, 0.95)):
+        # {label: {"count", "mean", "variance", "std", "quantiles": {q: value}}}, from the running summaries alone
+        with self.lock:
+            return {
+                label: self.stats.summary(label, quantiles)
+                for label in (self.stats.labels if labels is None else labels)
+                if label in self.stats.labels
+            }
+
+    def labels(self):
+        # {label: {"count", "min", "max"}}
+        with self.lock:
+            rows = self.db.execute("SELECT label, COUNT(value), MIN(value), MAX(value) FROM measures GROUP BY label").fetchall()
+        return {label: {"count": count, "min": lo, "max": hi} for label, count, lo, hi in rows}
+
+    def query(self, filters=(), order_by=None, descending=False, limit=None, labels=None):
+        # filters: [label, operator, value] that must all hold. returns
+        # [{"id", "title", "calc_intense", "measure": {label: value}}], ordered by the order_by measure
+        sql = ["SELECT d.docid, d.title, d.calc_intense FROM docs d"]
+        args = []
+
+        for idx, (label, op, val) in enumerate(filters):
+            if op not in OPERATORS:
+                raise ValueError(f"unknown operator {op}, use one of {' '.join(OPERATORS)}")
+            sql.append(f"JOIN measures f{idx} ON f{idx}.docid = d.docid AND f{idx}.label = ? AND f{idx}.value {OPERATORS[op]} ?")
+            args += [label, float(val)]
+
+        if order_by is not None:
+            # documents without the measure go last
+            sql.append("LEFT JOIN measures o ON o.docid = d.docid AND o.label = ?")
+            args.append(order_by)
+            sql.append(f"ORDER BY o.value IS NULL, o.value {'DESC' if descending else 'ASC'}, d.docid")
+        else:
+            sql.append("ORDER BY d.docid")
+
+        if limit is not None:
+            sql.append("LIMIT ?")
+            args.append(int(limit))
+
+        with self.lock:
+            docs = self.db.execute(" ".join(sql), args).fetchall()
+
+            measures = {docid: {} for docid, _title, _calc_intense in docs}
+            for docid in (measures if labels is None or len(labels) else []):
+                measure_sql = "SELECT label, value FROM measures WHERE docid = ?"
+                if labels is not None:
+                    measure_sql += f" AND label IN ({', '.join('?' * len(labels))})"
+                for label, val in self.db.execute(measure_sql, [docid] + list(labels or [])):
+                    measures[docid][label] = val
+
+        return [
+            {"id": docid, "title": title, "calc_intense": bool(calc_intense), "measure": measures[docid]}
+            for docid, title, calc_intense in docs
+        ]
+
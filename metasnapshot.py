@@ -0,0 +1,105 @@
+# Every document's meta held in memory, so reading it is a dictionary lookup instead of a trip
+# through guts' storage. Writes made through set() update it directly; changes made elsewhere
+# (the frontend's /_rec/_update etc.) are picked up with refresh(docid).
+# Subscribers are called with (docid, key, val) for every key that changes.
+
+import json
+import threading
+
+from twisted.web import resource
+
+
+class MetaSnapshot:
+    def __init__(self, load):
+        # load(docid) -> that document's meta, from the backing storage
+        self.load = load
+        self.metas = {}
+        self.subscribers = []
+        self.changed = threading.Condition()
+
+    def get(self, docid):
+        with self.changed:
+            if docid not in self.metas:
+                self.metas[docid] = dict(self.load(docid) or {})
+            # a copy, so callers holding on to it see a consistent meta
+            return dict(self.metas[docid])
+
+    def set(self, docid, key, val):
+        self.get(docid)
+        with self.changed:
+            self.metas[docid][key] = val
+            self.changed.notify_all()
+        self.notify(docid, key, val)
+
+    def refresh(self, docid):
+        try:
+            meta = dict(self.load(docid) or {})
+        except Exception:
+            # removed
+            with self.changed:
+                self.metas.pop(docid, None)
+            return
+
+        with self.changed:
+            old = self.metas.get(docid, {})
+            self.metas[docid] = meta
+            self.changed.notify_all()
+
+        for key in meta:
+            if key not in old or old[key] != meta[key]:
+                self.notify(docid, key, meta[key])
+        for key in old:
+            if key not in meta:
+                self.notify(docid, key, None)
+
+    def subscribe(self, fn, key=None, docid=None):
+        # fn(docid, key, val) on changes, optionally only to one key and/or document. returns an unsubscribe function
+        sub = (fn, key, docid)
+        self.subscribers.append(sub)
+        return lambda: self.subscribers.remove(sub)
+
+    def notify(self, docid, key, val):
+        for fn, sub_key, sub_docid in list(self.subscribers):
+            if (sub_key is None or sub_key == key) and (sub_docid is None or sub_docid == docid):
+                try:
+                    fn(docid, key, val)
+                except Exception as e:
+                    print(f"SYSTEM: meta subscriber failed on {docid} {key}: {e}")
+
+    def wait_for(self, docid, key, timeout=None):
+        # block until the key is set (truthy) on the document, returning its value
+        self.get(docid)
+        with self.changed:
+            self.changed.wait_for(lambda: self.metas.get(docid, {}).get(key), timeout)
+            return self.metas.get(docid, {}).get(key)
+
+
+class RefreshingResource(resource.Resource):
+    # passes requests through to a guts resource (/_rec), then refreshes the document each
+    # POST named by its "id" once the response is finished, i.e. once guts has applied the change
+    def __init__(self, wrapped, snapshot):
+        super().__init__()
+        self.wrapped = wrapped
+        self.snapshot = snapshot
+
+    @property
+    def isLeaf(self):
+        return self.wrapped.isLeaf
+
+    def getChildWithDefault(self, path, req):
+        return RefreshingResource(self.wrapped.getChildWithDefault(path, req), self.snapshot)
+
+    def render(self, req):
+        if req.method == b"POST":
+            docid = self.posted_id(req)
+            if docid is not None:
+                req.notifyFinish().addBoth(lambda _: self.snapshot.refresh(docid))
+        return self.wrapped.render(req)
+
+    def posted_id(self, req):
+        try:
+            body = req.content.read()
+            req.content.seek(0)
+            return json.loads(body).get("id")
+        except Exception:
+            return None
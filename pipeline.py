@@ -0,0 +1,1590 @@
+# Drift's processing stages: pitch tracking, alignment with Gentle, csv/rms/mat exports and
+# prosodic measures. Shared by the web server (serve.py) and the batch command line (batch.py),
+# so both produce the same results.
+#
+# Documents are read and written through `store`, which provides:
+#   attachpath                  directory attachments are kept in
+#   get_meta(docid)             the document's meta dict
+#   set_meta(docid, key, val)   update one meta key
+#   attach(filepath)            copy a file into attachpath, returning its name there
+#   attach_writer(suffix, mode) an AttachmentWriter writing straight into attachpath (see attachwriter.py)
+#   get_infos()                 list of {"id", "title", ...} for every document
+#   wait_for(docid, key)        block until another request has set the meta key, returning it
+
+import os
+import csv
+import tempfile
+import requests
+import subprocess
+import json
+import numpy as np
+import scipy.io as sio
+import sys
+import time
+import pyworld
+import librosa
+import math
+import bisect
+import concurrent.futures
+import difflib
+import hashlib
+
+import audioprobe
+import cancellation
+import gentlepool
+import saccpool
+import tracing
+from py import prosodic_measures
+from py.voxit_windows import WindowPool, measure_voxit_windows
+from py import track_pyramid
+from py import pitch_engines
+from py import chunked_pitch
+
+# specifies if we are releasing for MAC DMG
+BUNDLE = hasattr(sys, "frozen")
+
+# Gentle servers to align with (see gentlepool.py), and the port of the first, which the settings show
+gentle_pool = gentlepool.GentlePool(["8765"])
+GENTLE_PORT = 8765
+calc_intense = False
+# WindowPool (py/voxit_windows.py) of worker processes for windowed Voxit measures, or None to measure them in this process
+window_pool = None
+# "sacc", or one of the in-process engines in py/pitch_engines.py
+pitch_engine = "sacc"
+# saccpool.SAcCPool of warm SAcC workers, or None to start SAcC for every recording
+sacc_pool = None
+# SAcC runs on long recordings split into this many chunks at once
+pitch_chunks = 1
+
+store = None
+# measuredb.MeasureDB of every document's full transcript measures, if the caller set one up
+measure_index = None
+
+# add current directory to path so audioread (used by librosa) and our own ffmpeg calls can use ffmpeg without prepending './'
+os.environ["PATH"] += os.pathsep + '.'
+
+def use_gentle(addresses):
+    # a port, or a comma separated list of ports and host:ports
+    global gentle_pool, GENTLE_PORT
+    gentle_pool = gentlepool.GentlePool(gentlepool.parse_addresses(addresses))
+    GENTLE_PORT = gentle_pool.backends[0].port
+
+def use_window_processes(size):
+    global window_pool
+    # call before the server starts any threads, see WindowPool
+    if size > 1:
+        window_pool = WindowPool(size)
+    return window_pool
+
+def use_sacc_workers(size):
+    global sacc_pool
+    # the bundled SAcC is a frozen executable, there is no model to keep loaded
+    if size > 0 and not BUNDLE:
+        sacc_pool = saccpool.SAcCPool(size, os.path.dirname(get_calc_sbpca()))
+    return sacc_pool
+
+def _gentle_backends():
+    return {"backends": gentle_pool.stats()}
+
+def use_store(doc_store):
+    global store
+    store = doc_store
+
+
+def get_calc_sbpca():
+    if BUNDLE:
+        return "./sacc/SAcC"
+    return "./ext/calc_sbpca/python/SAcC.py"
+    # return "./py/py2/sacc_cli.py"
+
+
+def get_audio_dur(filepath):
+    # seconds, from the file's headers. for a document's recording use audio_duration, which is cached
+    return audioprobe.probe(filepath)["duration_ms"] / 1000
+
+
+def audio_info(docid):
+    # duration_ms, sample_rate and channels of the document's recording, probed once and kept in its meta
+    meta = store.get_meta(docid)
+    info = meta.get("audio_info")
+    if info is None or info.get("path") != meta["path"]:
+        with tracing.span("probe", docid):
+            info = dict(audioprobe.probe(os.path.join(store.attachpath, meta["path"])), path=meta["path"])
+        store.set_meta(docid, "audio_info", info)
+    return info
+
+
+def audio_duration(docid):
+    return audio_info(docid)["duration_ms"] / 1000
+
+
+# a job on this many minutes of audio costs one more admission slot
+JOB_COST_MINUTES = 10
+# base cost of each kind of job, in admission slots (see admission.py). measure_all goes through
+# the whole corpus and takes every slot
+JOB_COSTS = {"pitch": 1, "align": 1, "rms": 1, "harvest": 1, "measure": 1, "windowed": 2, "measure_all": float("inf"), "export": 1}
+
+def job_cost(kind, args):
+    # admission slots a job is likely to take up, from its kind, the length of audio it covers and
+    # calc_intense. only reads the cached duration, as it runs on the reactor thread
+    base = JOB_COSTS[kind]
+    if "id" not in args:
+        return base
+
+    if args.get("start_time") is not None and args.get("end_time") is not None:
+        minutes = (float(args["end_time"]) - float(args["start_time"])) / 60
+    else:
+        info = store.get_meta(args["id"]).get("audio_info")
+        minutes = info["duration_ms"] / 60000 if info else JOB_COST_MINUTES
+
+    cost = base * (1 + max(0, minutes) / JOB_COST_MINUTES)
+    # with calc_intense, measures also run Harvest and the costlier Voxit measures
+    if calc_intense and kind in ("measure", "windowed"):
+        cost *= 2
+    return cost
+
+
+@tracing.stage("pitch")
+def pitch(cmd):
+    docid = cmd["id"]
+
+    meta = store.get_meta(docid)
+
+    if pitch_engine != "sacc":
+        return pitch_in_process(docid, meta)
+
+    # Create an 8khz wav file
+    with tempfile.NamedTemporaryFile(suffix=".wav") as wav_fp:
+        ff_start = time.time()
+        with tracing.span("ffmpeg", docid, bytes=os.path.getsize(os.path.join(store.attachpath, meta["path"]))):
+            subprocess.call(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-loglevel",
+                    "panic",
+                    "-i",
+                    os.path.join(store.attachpath, meta["path"]),
+                    "-ar",
+                    "8000",
+                    "-ac",
+                    "1",
+                    wav_fp.name,
+                ]
+            )
+
+        print(f'SYSTEM: FFMPEG took {time.time() - ff_start:.2f}s')
+
+        # ...and use it to compute pitch, written straight into the attachments
+        with store.attach_writer(".txt") as pitch_fp:
+            sacc_start = time.time()
+            sacc_track(wav_fp.name, pitch_fp.path, audio_duration(docid))
+            print(f'SYSTEM: SAcC took {time.time() - sacc_start:.2f}s')
+            pitch_fp.adopt()
+
+            if pitch_fp.blank:
+                return {"error": "Pitch computation failed"}
+
+            # XXX: frozen attachdir
+            pitchhash = pitch_fp.publish()
+
+    store.set_meta(docid, "pitch", pitchhash)
+    store.set_meta(docid, "pitch_engine", "sacc")
+    gen_pyramid(docid, "pitch")
+
+    return {"pitch": pitchhash}
+
+
+def run_sacc(wavpath, outpath):
+    with tracing.span("sacc", bytes=os.path.getsize(wavpath), warm=sacc_pool is not None):
+        if sacc_pool is not None:
+            try:
+                sacc_pool.compute(wavpath, outpath)
+            except saccpool.SAcCError as e:
+                # leaves the track empty, which pitch reports
+                print(f"SYSTEM: SAcC failed on {wavpath}: {e}")
+        else:
+            subprocess.call([get_calc_sbpca(), wavpath, outpath])
+
+
+# recordings at least this long (in seconds) are tracked as pitch_chunks overlapping chunks at once
+PITCH_CHUNK_MIN_DURATION = 600
+# seconds shared by neighbouring chunks. each keeps the frames of its half
+PITCH_CHUNK_OVERLAP = 10
+
+def sacc_track(wavpath, outpath, duration):
+    # SAcC over the 8khz wav, in one go or as chunks in parallel (see py/chunked_pitch.py)
+    if pitch_chunks > 1 and duration >= PITCH_CHUNK_MIN_DURATION:
+        print(f"SYSTEM: tracking pitch in {pitch_chunks} chunks")
+        chunked_pitch.track_chunked(wavpath, outpath, tracing.carry(run_sacc), pitch_chunks, PITCH_CHUNK_OVERLAP)
+    else:
+        run_sacc(wavpath, outpath)
+
+
+def pitch_in_process(docid, meta):
+    # same track as SAcC writes, from one of py/pitch_engines.py without leaving this process
+    audio_filepath = os.path.join(store.attachpath, meta["path"])
+    dur = audio_duration(docid)
+
+    pe_start = time.time()
+    with tracing.span(pitch_engine, docid, bytes=os.path.getsize(audio_filepath)):
+        times, f0, voicing = pitch_engines.track_file(pitch_engine, audio_filepath, duration=float(dur))
+    print(f"SYSTEM: {pitch_engine} pitch took {time.time() - pe_start:.2f}s")
+
+    with store.attach_writer(".txt") as pitch_fp:
+        pitch_engines.write_track(pitch_fp, times, f0, voicing)
+
+        if pitch_fp.blank:
+            return {"error": "Pitch computation failed"}
+
+        pitchhash = pitch_fp.publish()
+
+    store.set_meta(docid, "pitch", pitchhash)
+    store.set_meta(docid, "pitch_engine", pitch_engine)
+    gen_pyramid(docid, "pitch")
+
+    return {"pitch": pitchhash}
+
+
+@tracing.stage("harvest")
+def _harvest(cmd):
+    if not calc_intense:
+        return { }
+    
+    docid = cmd["id"]
+
+    meta = store.get_meta(docid)
+    audio_filepath = os.path.join(store.attachpath, meta["path"])
+    dur = audio_duration(docid)
+
+    # bug where librosa can't load mp3's without supplying a duration. so supply a duration for all audio file types just in case
+    with tracing.span("decode", docid, bytes=os.path.getsize(audio_filepath)):
+        x, fs = librosa.load(audio_filepath, duration=math.floor(float(dur)), sr=None)
+
+    print("SYSTEM: harvesting...")
+
+    # harvest runs in one go, so a cancelled request (see cancellation.py) can only stop before or after it
+    cancellation.check()
+    hv_start = time.time()
+    with tracing.span("pyworld harvest", docid, samples=len(x)):
+        f0, timeaxis = pyworld.harvest(x.astype(np.float64), fs)
+
+    print(f"SYSTEM: finished harvesting! (took {time.time() - hv_start:.2f}s)")
+    cancellation.check()
+
+    with store.attach_writer(".txt") as harvest_fp:
+        for i in range(len(timeaxis)):
+            harvest_fp.write(f'{timeaxis[i]} {f0[i]}\n')
+
+        if harvest_fp.blank:
+            return {"error": "Harvest computation failed"}
+
+        # XXX: frozen attachdir
+        harvesthash = harvest_fp.publish()
+
+    store.set_meta(docid, "harvest", harvesthash)
+
+    return {"harvest": harvesthash}
+
+@tracing.stage("audio info")
+def save_audio_info(cmd):
+    docid = cmd["id"]
+
+    duration = audio_duration(docid)
+
+    store.set_meta(docid, "info", duration)
+
+    return {"info": duration}
+
+
+def parse_speakers_in_transcript(trans):
+    segs = []
+
+    cur_speaker = None
+    for line in trans.split("\n"):
+        if (
+            ":" in line
+            and line.index(":") < 32
+            and len(line.split(":")[0].split(" ")) < 3
+        ):
+            cur_speaker = line.split(":")[0]
+            line = ":".join(line.split(":")[1:])
+
+        line = line.strip()
+        if len(line) > 0:
+            segs.append({"speaker": cur_speaker, "line": line})
+
+    return segs
+
+
+def gentle_punctuate(wdlist, transcript):
+    # Use the punctuation from Gentle's transcript in a wdlist
+    out = []
+
+    last_word_end = None
+    next_aligned_wd = None
+
+    for wd_idx, wd in enumerate(wdlist):
+        next_wd_idx = wd_idx + 1
+        next_wd = None
+
+        is_aligned = wd.get("end") is not None
+
+        while next_wd_idx < len(wdlist):
+            next_wd = wdlist[next_wd_idx]
+            if next_wd.get("startOffset") is not None:
+                break
+            next_wd_idx += 1
+
+        if not is_aligned:
+            next_wd_idx = wd_idx + 1
+            while next_wd_idx < len(wdlist):
+                next_aligned_wd = wdlist[next_wd_idx]
+                if next_aligned_wd.get("end") is not None:
+                    break
+                else:
+                    next_aligned_wd = None
+                next_wd_idx += 1
+
+        if next_wd is None or next_wd.get("startOffset") is None:
+            # No next word - don't glob punctuation, just return what we have.
+
+            keys = ["start", "end", "phones"]
+
+            wd_obj = {"word": wd["word"]}
+            for key in keys:
+                if key in wd:
+                    wd_obj[key] = wd[key]
+
+            out.append(wd_obj)
+            break
+
+        if "startOffset" not in wd:  # or 'startOffset' not in next_wd:
+            continue
+        if wd.get("startOffset") is not None:
+            wd_str = transcript[wd["startOffset"] : next_wd["startOffset"]]
+
+            keys = ["start", "end", "phones"]
+
+            wd_obj = {"word": wd_str}
+            for key in keys:
+                if key in wd:
+                    wd_obj[key] = wd[key]
+
+            out.append(wd_obj)
+
+    return gaps_and_unaligned(out)
+
+
+def gaps_and_unaligned(seq):
+    out = []
+
+    cur_unaligned = []
+    last_end = 0
+
+    for idx, wd in enumerate(seq):
+        if wd.get("end"):
+            if len(cur_unaligned) > 0:
+                # End of an unaligned block
+                out.append(
+                    {
+                        "type": "unaligned",
+                        "start": last_end,
+                        "end": wd["start"],
+                        "word": "".join([X["word"] for X in cur_unaligned]),
+                    }
+                )
+
+                cur_unaligned = []
+
+            if len(out) > 0 and out[-1]["end"] < wd["start"]:
+                # gap
+                out.append(
+                    {
+                        "type": "gap",
+                        "start": last_end,
+                        "end": wd["start"],
+                        "word": "[gap]",
+                    }
+                )
+
+            out.append(wd)
+            last_end = wd["end"]
+        else:
+            # unaligned
+            cur_unaligned.append(wd)
+
+    if len(cur_unaligned) > 0:
+        # End of an unaligned block
+        out.append(
+            {
+                "type": "unaligned",
+                "start": last_end,
+                "word": "[%s]" % ("".join([X["word"] for X in cur_unaligned])),
+            }
+        )
+
+    return out
+
+
+def gentle_transcribe(docid, media, tscript_txt, progress=lambda pct: pct):
+    # align a transcript to an audio file with Gentle, returning its align.json and the rows of its align.csv
+    # busy Gentle servers are picked by how much audio they still have to align
+    work = float(get_audio_dur(media))
+
+    with gentle_pool.backend(work) as backend:
+        url = backend.url + "/transcriptions"
+
+        with tracing.span("gentle upload", docid, bytes=os.path.getsize(media), backend=backend.url):
+            res = requests.post(url,
+                                data={"transcript": tscript_txt},
+                                files={'audio':
+                                       ('audio', open(media, 'rb'))})
+        # a server error counts against this backend in the pool
+        res.raise_for_status()
+
+        # Find the ID
+        uid = res.history[0].headers['Location'].split('/')[-1]
+
+        # Poll for status
+        status_url = url + '/' + uid + '/status.json'
+
+        cur_status = -1
+        # Gentle's own stages (queued, transcribing, aligning...) as they're seen polling
+        phase, phase_start = None, time.time()
+
+        while True:
+            status = requests.get(status_url).json()
+            if status.get('status') != phase:
+                if phase is not None:
+                    tracing.add(f"gentle {phase.lower()}", docid, phase_start, time.time(), backend=backend.url)
+                phase, phase_start = status.get('status'), time.time()
+
+            if status.get('status') != 'OK':
+                s = status.get('percent', 0)
+                if s > cur_status:
+                    cur_status = s
+
+                    store.set_meta(docid, "align_px", progress(cur_status))
+
+                time.sleep(1)
+
+            else:
+                # transcription done
+                break
+
+        with tracing.span("gentle download", docid):
+            align_url = url + '/' + uid + '/align.json'
+            trans = requests.get(align_url).json()
+
+            # https://stackoverflow.com/questions/45978295/saving-a-downloaded-csv-file-using-python
+            aligncsv_url = url + '/' + uid + '/align.csv'
+            aligncsv = requests.get(aligncsv_url)
+            rows = [line.decode('utf-8').split(',') for line in aligncsv.iter_lines()]
+
+    return trans, rows
+
+
+def diarize(trans, segs, lines_follow=False):
+    # Re-diarize Gentle output into a sane diarization format.
+    # lines_follow: the transcript is part of a longer one, so its last line ends in a linebreak like the others
+    diary = {"segments": [{}]}
+    seg = diary["segments"][0]
+    seg["speaker"] = segs[0]["speaker"]
+
+    wdlist = []
+    end_offset = 0
+    seg_idx = 0
+
+    cur_end = 0
+
+    for wd in trans["words"]:
+        gap = trans["transcript"][end_offset : wd["startOffset"]]
+        seg_idx += len(gap.split("\n")) - 1
+
+        if "\n" in gap and len(wdlist) > 0:
+            # Linebreak - new segment!
+            wdlist[-1]["word"] += gap.split("\n")[0]
+
+            seg["wdlist"] = gentle_punctuate(wdlist, trans["transcript"])
+
+            # Compute start & end
+            seg["start"] = seg["wdlist"][0].get("start", cur_end)
+            has_end = [X for X in seg["wdlist"] if X.get("end")]
+            if len(has_end) > 0:
+                seg["end"] = has_end[-1]["end"]
+            else:
+                seg["end"] = cur_end
+            cur_end = seg["end"]
+
+            wdlist = []
+            seg = {}
+            diary["segments"].append(seg)
+            if len(segs) > seg_idx:
+                seg["speaker"] = segs[seg_idx]["speaker"]
+
+        wdlist.append(wd)
+        end_offset = wd["endOffset"]
+
+    if lines_follow and len(wdlist) > 0:
+        wdlist[-1]["word"] += trans["transcript"][end_offset:].split("\n")[0]
+
+    seg["wdlist"] = gentle_punctuate(wdlist, trans["transcript"])
+
+    # Compute start & end
+    seg["start"] = seg["wdlist"][0].get("start", cur_end)
+    has_end = [X for X in seg["wdlist"] if X.get("end")]
+    if len(has_end) > 0:
+        seg["end"] = has_end[-1]["end"]
+    else:
+        seg["end"] = cur_end
+
+    return diary
+
+
+@tracing.stage("align")
+def align(cmd):
+    meta = store.get_meta(cmd["id"])
+
+    media = os.path.join(store.attachpath, meta["path"])
+    segs = parse_speakers_in_transcript(
+        open(os.path.join(store.attachpath, meta["transcript"])).read()
+    )
+
+    realigned = partial_align(cmd["id"], meta, segs) or shard_align(cmd["id"], meta, segs)
+    if realigned is not None:
+        diary, rows = realigned
+    else:
+        tscript_txt = "\n".join([X["line"] for X in segs])
+        trans, rows = gentle_transcribe(cmd["id"], media, tscript_txt)
+        diary = diarize(trans, segs)
+
+    # For now, hit disk. Later we can explore the transcription DB.
+    with store.attach_writer(".json") as dfh:
+        json.dump(diary, dfh, indent=2)
+        alignhash = dfh.publish()
+
+    store.set_meta(cmd["id"], "align", alignhash)
+    # what was aligned, so the next transcript edit only has to realign what changed
+    store.set_meta(cmd["id"], "align_transcript", meta["transcript"])
+    
+    with store.attach_writer(".csv") as fp:
+        w = csv.writer(fp)
+        for row in rows:
+            w.writerow(row)
+        aligncsvhash = fp.publish()
+
+    store.set_meta(cmd["id"], "aligncsv", aligncsvhash)
+
+    return {"align": alignhash}
+
+
+# give up on realigning part of the recording if more than this fraction of segments changed
+PARTIAL_ALIGN_MAX_CHANGED = 0.5
+
+def partial_align(docid, meta, segs):
+    # after a transcript edit, send only the audio around the segments that changed to Gentle
+    # and splice the results into the previous alignment. None if the whole recording has to be aligned
+    if not meta.get("align") or not meta.get("aligncsv") or not meta.get("align_transcript"):
+        return None
+    if meta["align_transcript"] == meta["transcript"]:
+        return None
+
+    old_segs = parse_speakers_in_transcript(
+        open(os.path.join(store.attachpath, meta["align_transcript"])).read()
+    )
+    old_diary = json.load(open(os.path.join(store.attachpath, meta["align"])))
+    old_segments = old_diary["segments"]
+
+    # segments only line up with transcript lines if every line had words Gentle could use
+    if len(old_segments) != len(old_segs) or len(segs) == 0:
+        return None
+
+    opcodes = difflib.SequenceMatcher(None,
+        [(X["speaker"], X["line"]) for X in old_segs],
+        [(X["speaker"], X["line"]) for X in segs], autojunk=False).get_opcodes()
+
+    changed = [X for X in opcodes if X[0] != "equal"]
+    if sum(max(i2 - i1, j2 - j1) for _tag, i1, i2, j1, j2 in changed) > PARTIAL_ALIGN_MAX_CHANGED * len(segs):
+        return None
+
+    audio_len = audio_duration(docid)
+
+    spans = []
+    for tag, i1, i2, j1, j2 in changed:
+        # the audio between the unchanged segments either side
+        span_start = old_segments[i1 - 1]["end"] if i1 > 0 else 0
+        span_end = old_segments[i2]["start"] if i2 < len(old_segments) else audio_len
+        if j2 > j1 and span_end - span_start < 0.1:
+            return None
+        spans.append((span_start, span_end))
+
+    print(f"SYSTEM: realigning {len(changed)} changed parts of the transcript instead of the whole recording")
+
+    old_rows = split_rows_by_segment(open(os.path.join(store.attachpath, meta["aligncsv"])), old_segments)
+
+    segments = []
+    rows = []
+    realigned = 0
+    for tag, i1, i2, j1, j2 in opcodes:
+        if tag == "equal":
+            segments += old_segments[i1:i2]
+            for seg_rows in old_rows[i1:i2]:
+                rows += seg_rows
+            continue
+
+        if j2 == j1:
+            # deleted lines
+            realigned += 1
+            continue
+
+        span_start, span_end = spans[realigned]
+        part = realigned
+        span_segments, span_rows = align_span(docid, meta, span_start, span_end, segs[j1:j2], j2 < len(segs),
+            progress=lambda pct: (100 * part + pct) / len(changed))
+        segments += span_segments
+        for line_rows in span_rows:
+            rows += line_rows
+        realigned += 1
+
+    return {"segments": segments}, rows
+
+
+def align_span(docid, meta, span_start, span_end, segs, lines_follow, progress):
+    # align some transcript lines to the audio between span_start and span_end, with times in the whole recording.
+    # returns the diary segments, and the align csv rows of each line
+    with tempfile.NamedTemporaryFile(suffix=".wav") as wav_fp:
+        with tracing.span("ffmpeg", docid, start=span_start, end=span_end):
+            subprocess.call(
+                [
+                    "ffmpeg",
+                    "-y",
+                    "-loglevel",
+                    "panic",
+                    "-ss",
+                    str(span_start),
+                    "-to",
+                    str(span_end),
+                    "-i",
+                    os.path.join(store.attachpath, meta["path"]),
+                    wav_fp.name,
+                ]
+            )
+
+        trans, _rows = gentle_transcribe(docid, wav_fp.name, "\n".join([X["line"] for X in segs]), progress=progress)
+
+    # before diarize, which adds punctuation to Gentle's words
+    rows = [shift_rows(X, span_start) for X in rows_by_line(trans, len(segs))]
+
+    diary = diarize(trans, segs, lines_follow=lines_follow)
+    shift_segments(diary["segments"], span_start)
+
+    return diary["segments"], rows
+
+
+def rows_by_line(trans, nlines):
+    # the rows of Gentle's align.csv ([word, aligned word, start, end] of words it found, or didn't find, in the audio)
+    # rebuilt from its align.json, grouped by transcript line
+    lines = [[] for X in range(nlines)]
+    for wd in trans["words"]:
+        if wd.get("case") not in ["success", "not-found-in-audio"] or wd.get("startOffset") is None:
+            continue
+        line = min(trans["transcript"].count("\n", 0, wd["startOffset"]), nlines - 1)
+        lines[line].append([wd["word"], wd.get("alignedWord") or ""] + ["" if wd.get(X) is None else str(wd[X]) for X in ["start", "end"]])
+    return lines
+
+
+# split the first alignment of a long recording into this many Gentle jobs, run at once. 1: never split
+align_shards = 1
+# recordings shorter than this (seconds) are always aligned in one job
+SHARD_MIN_DURATION = 600
+# frames of the rms track (see rms) at or below this are silent, and cuts snap to silences at least this many frames long
+SILENCE_RMS = 0.01
+SILENCE_MIN_FRAMES = 30
+# how far (seconds) from its estimated time a cut looks for a silence
+SHARD_SNAP_WINDOW = 30
+# audio (seconds) added to both sides of a cut, so lines near it are in both spans' audio.
+# more when the cut couldn't be snapped to a silence and its time is only an estimate
+SHARD_PAD = 2
+SHARD_PAD_UNSNAPPED = 15
+# how many unaligned lines either side of a cut are realigned afterwards
+SHARD_REPAIR_LINES = 20
+
+def shard_align(docid, meta, segs):
+    # align a long recording as several (audio span, transcript lines) jobs at once, cut between lines
+    # at speaker turns or long silences. None if it should be aligned in one job
+    if align_shards <= 1 or len(segs) < 2 * align_shards:
+        return None
+
+    audio_len = audio_duration(docid)
+    if audio_len < SHARD_MIN_DURATION:
+        return None
+
+    rms = None
+    if meta.get("rms"):
+        rms = np.array(json.load(open(os.path.join(store.attachpath, meta["rms"]))))
+
+    shards = plan_shards(segs, audio_len, rms, align_shards)
+    if len(shards) < 2:
+        return None
+
+    print(f"SYSTEM: aligning in {len(shards)} parts: " + ", ".join(f"{X[2]:.0f}-{X[3]:.0f}s" for X in shards))
+
+    progress = [0] * len(shards)
+
+    def run_shard(shard_idx):
+        line_start, line_end, span_start, span_end = shards[shard_idx]
+
+        def shard_progress(pct):
+            progress[shard_idx] = pct
+            return sum(progress) / len(progress)
+
+        return align_span(docid, meta, span_start, span_end, segs[line_start:line_end], line_end < len(segs), shard_progress)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as pool:
+        results = list(pool.map(run_shard, range(len(shards))))
+
+    segments = []
+    rows = []
+    for shard_segments, shard_rows in results:
+        segments += shard_segments
+        rows += shard_rows
+
+    # a cut whose time was estimated wrong leaves the lines next to it outside their span's audio.
+    # realign those in the audio between the aligned lines either side
+    if len(segments) == len(segs):
+        for cut in [X[0] for X in shards[1:]]:
+            first = cut
+            while first > max(0, cut - SHARD_REPAIR_LINES) and not fully_aligned(segments[first - 1]):
+                first -= 1
+            last = cut
+            while last < min(len(segs), cut + SHARD_REPAIR_LINES) and not fully_aligned(segments[last]):
+                last += 1
+            if first == last:
+                continue
+
+            span_start = segments[first - 1]["end"] if first > 0 else 0
+            span_end = segments[last]["start"] if last < len(segs) else audio_len
+            print(f"SYSTEM: realigning lines {first}-{last} around a cut at {span_start:.0f}-{span_end:.0f}s")
+            repaired, repaired_rows = align_span(docid, meta, span_start, span_end, segs[first:last], last < len(segs), lambda pct: pct)
+            if len(repaired) == last - first:
+                segments[first:last] = repaired
+                rows[first:last] = repaired_rows
+
+    return {"segments": segments}, [X for line_rows in rows for X in line_rows]
+
+
+def fully_aligned(seg):
+    return not any(X.get("type") == "unaligned" for X in seg["wdlist"])
+
+
+def plan_shards(segs, audio_len, rms, count):
+    # [(first line, line after the last, span start, span end)] for up to `count` shards
+    n = len(segs)
+    window = max(1, n // (count * 4))
+
+    cuts = []
+    for k in range(1, count):
+        target = round(k * n / count)
+        # a change of speaker close by makes a better cut
+        turns = [
+            X for X in range(max(1, target - window), min(n - 1, target + window) + 1)
+            if segs[X]["speaker"] != segs[X - 1]["speaker"]
+        ]
+        cut = min(turns, key=lambda X: abs(X - target)) if turns else target
+        if 0 < cut < n and (not cuts or cut > cuts[-1]):
+            cuts.append(cut)
+
+    line_times = estimate_line_times(segs, audio_len, rms)
+    quiet = silences(rms) if rms is not None else []
+
+    times = [0.0]
+    pads = [0.0]
+    for cut in cuts:
+        t = line_times[cut]
+        near = [X for X in quiet if abs((X[0] + X[1]) / 2 - t) <= SHARD_SNAP_WINDOW]
+        if near:
+            silence = min(near, key=lambda X: abs((X[0] + X[1]) / 2 - t))
+            times.append((silence[0] + silence[1]) / 2)
+            pads.append(min(SHARD_PAD, (silence[1] - silence[0]) / 2))
+        else:
+            times.append(t)
+            pads.append(SHARD_PAD_UNSNAPPED)
+    times.append(audio_len)
+    pads.append(0.0)
+
+    bounds = [0] + cuts + [n]
+    return [
+        (bounds[i], bounds[i + 1], max(0.0, times[i] - pads[i]), min(audio_len, times[i + 1] + pads[i + 1]))
+        for i in range(len(bounds) - 1)
+    ]
+
+
+def estimate_line_times(segs, audio_len, rms):
+    # rough time each line starts, spreading the transcript's words evenly over the audio that isn't silent
+    words = np.array([len(X["line"].split()) for X in segs], dtype=float)
+    frac = np.concatenate(([0], np.cumsum(words))) / max(1, words.sum())
+
+    if rms is not None and len(rms) > 0:
+        speech = np.cumsum(rms > SILENCE_RMS)
+        if speech[-1] > 0:
+            frames = np.searchsorted(speech, frac * speech[-1])
+            return np.minimum(frames, len(rms) - 1) / 100.0
+
+    return frac * audio_len
+
+
+def silences(rms):
+    # [(start, end)] in seconds of runs of silent rms frames long enough to cut at
+    quiet = np.concatenate(([False], rms <= SILENCE_RMS, [False]))
+    edges = np.flatnonzero(quiet[1:] != quiet[:-1])
+    return [
+        (start / 100.0, end / 100.0)
+        for start, end in zip(edges[0::2], edges[1::2])
+        if end - start >= SILENCE_MIN_FRAMES
+    ]
+
+
+def split_rows_by_segment(aligncsv, segments):
+    # rows of a Gentle align csv, grouped by the diary segment they fall in. rows without times
+    # (words Gentle couldn't find in the audio) go with the next row that has them
+    ends = [X["end"] for X in segments]
+    grouped = [[] for X in segments]
+    pending = []
+    for row in csv.reader(aligncsv):
+        pending.append(row)
+        if len(row) == 4 and row[2]:
+            seg_idx = min(bisect.bisect_left(ends, float(row[2])), len(segments) - 1)
+            grouped[seg_idx] += pending
+            pending = []
+    grouped[-1] += pending
+    return grouped
+
+
+def shift_segments(segments, offset):
+    for seg in segments:
+        seg["start"] += offset
+        seg["end"] += offset
+        for wd in seg["wdlist"]:
+            for key in ["start", "end"]:
+                if wd.get(key) is not None:
+                    wd[key] += offset
+
+
+def shift_rows(rows, offset):
+    shifted = []
+    for row in rows:
+        if len(row) == 4 and row[2] and row[3]:
+            row = row[:2] + [str(round(float(row[2]) + offset, 4)), str(round(float(row[3]) + offset, 4))]
+        shifted.append(row)
+    return shifted
+
+
+@tracing.stage("csv")
+def gen_csv(cmd):
+    docid = cmd["id"]
+    meta = store.get_meta(docid)
+
+    p_path = os.path.join(store.attachpath, meta["pitch"])
+    tracing.annotate(bytes=os.path.getsize(p_path))
+    pitch = [float(X.split()[1]) for X in open(p_path) if len(X.split()) > 2]
+
+    a_path = os.path.join(store.attachpath, meta["align"])
+    align = json.load(open(a_path))
+
+    words = []
+    for seg in align["segments"]:
+        for wd in seg["wdlist"]:
+            wd_p = dict(wd)
+            wd_p["speaker"] = seg["speaker"]
+            words.append(wd_p)
+
+    with store.attach_writer(".csv") as fp:
+        w = csv.writer(fp)
+
+        w.writerow(["time (s)", "pitch (hz)", "word", "phoneme", "speaker"])
+
+        for idx, pitch_val in enumerate(pitch):
+            t = idx / 100.0
+
+            wd_txt = None
+            ph_txt = None
+            speaker = None
+
+            for wd_idx, wd in enumerate(words):
+                if wd.get("start") is None or wd.get("end") is None:
+                    continue
+
+                if wd["start"] <= t and wd["end"] >= t:
+                    wd_txt = wd["word"].encode("utf-8")
+
+                    speaker = wd["speaker"]
+
+                    # find phone
+                    cur_t = wd["start"]
+                    for phone in wd.get("phones", []):
+                        if cur_t + phone["duration"] >= t:
+                            ph_txt = phone["phone"]
+                            break
+                        cur_t += phone["duration"]
+
+                    break
+
+            if type(wd_txt) == bytes:
+                wd_txt = wd_txt.decode("utf-8")
+            elif type(wd_txt) != str:
+                wd_txt = str(wd_txt or "")
+
+            row = [t, pitch_val, wd_txt, ph_txt, speaker]
+            w.writerow(row)
+
+        csvhash = fp.publish()
+
+    # the alignment and pitch track it was built from, so precompute can tell when it's out of date
+    store.set_meta(cmd["id"], "csv_from", [meta["align"], meta["pitch"]])
+    store.set_meta(cmd["id"], "csv", csvhash)
+
+    return {"csv": csvhash}
+
+
+@tracing.stage("rms")
+def rms(cmd):
+    docid = cmd["id"]
+    info = store.get_meta(docid)
+
+    vpath = os.path.join(store.attachpath, info["path"])
+    tracing.annotate(bytes=os.path.getsize(vpath))
+
+    R = 44100
+
+    WIN_LEN = int(R / 100)
+
+    # mean square of each 10ms window, a block of windows at a time as ffmpeg decodes them
+    rms = np.concatenate([
+        (block.astype(float) ** 2).sum(axis=1) / WIN_LEN
+        for block in stream_windows(vpath, R, WIN_LEN, ffopts=["-filter:a", "dynaudnorm"])
+    ])
+
+    rms -= rms.min()
+    rms /= rms.max()
+
+    with store.attach_writer(".json") as fh:
+        json.dump(rms.tolist(), fh)
+        rmshash = fh.publish()
+
+    store.set_meta(docid, "rms", rmshash)
+    gen_pyramid(docid, "rms")
+
+    return {"rms": rmshash}
+
+
+# windows decoded per block by stream_windows, so memory stays the same for any length of recording
+STREAM_BLOCK_WINDOWS = 1000
+
+def stream_windows(path, R, win_len, ffopts=[]):
+    # mono 16 bit audio decoded by ffmpeg, as (windows, win_len) arrays of up to STREAM_BLOCK_WINDOWS
+    # windows. a partial window at the end is dropped
+    proc = subprocess.Popen(
+        ["ffmpeg", "-loglevel", "panic", "-i", path, "-vn", "-ar", str(R), "-ac", "1"]
+        + ffopts
+        + ["-f", "s16le", "-acodec", "pcm_s16le", "-"],
+        stdout=subprocess.PIPE,
+    )
+    win_bytes = win_len * 2
+    leftover = b""
+    try:
+        while True:
+            data = proc.stdout.read(STREAM_BLOCK_WINDOWS * win_bytes)
+            if not data:
+                break
+            data = leftover + data
+            usable = len(data) // win_bytes * win_bytes
+            leftover = data[usable:]
+            if usable:
+                yield np.frombuffer(data[:usable], dtype=np.int16).reshape(-1, win_len)
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+PYRAMID_TRACKS = ["rms", "pitch"]
+
+@tracing.stage("pyramid")
+def gen_pyramid(docid, track):
+    meta = store.get_meta(docid)
+    trackpath = os.path.join(store.attachpath, meta[track])
+
+    if track == "rms":
+        levels = track_pyramid.build(json.load(open(trackpath)))
+    else:
+        # second column of the SAcC output, 0 where unvoiced
+        levels = track_pyramid.build([float(X.split()[1]) for X in open(trackpath) if X.strip()], ignore_zeros=True)
+
+    with store.attach_writer(".npz", mode="wb") as fh:
+        # np.savez seeks, so it writes the file itself
+        track_pyramid.save(levels, fh.path)
+        fh.adopt()
+        pyramidhash = fh.publish()
+
+    # remember which track the pyramid was built from, so a recomputed track gets a new one
+    store.set_meta(docid, track + "_pyramid", [meta[track], pyramidhash])
+
+    return levels
+
+# loaded pyramids, per attachment
+track_pyramids = {}
+
+def get_track_pyramid(docid, track):
+    meta = store.get_meta(docid)
+    built = meta.get(track + "_pyramid")
+
+    if not built or built[0] != meta[track]:
+        levels = gen_pyramid(docid, track)
+        track_pyramids[store.get_meta(docid)[track + "_pyramid"][1]] = levels
+        return levels
+
+    if built[1] not in track_pyramids:
+        track_pyramids[built[1]] = track_pyramid.load(os.path.join(store.attachpath, built[1]))
+    return track_pyramids[built[1]]
+
+# min/max/mean of the rms or pitch track between start_time and end_time, in at most `resolution` buckets
+def _track_range(id=None, track=None, start_time=None, end_time=None, resolution=None):
+
+    if track not in PYRAMID_TRACKS:
+        return {"error": f"track must be one of {', '.join(PYRAMID_TRACKS)}"}
+
+    meta = store.get_meta(id)
+    if not meta.get(track):
+        return {"error": f"no {track} track yet"}
+
+    levels = get_track_pyramid(id, track)
+
+    start_time = cast_not_none(start_time, float) or 0
+    end_time = cast_not_none(end_time, float)
+    if end_time is None:
+        end_time = len(levels[0]["mean"]) / track_pyramid.FRAME_RATE
+    resolution = cast_not_none(resolution, int) or 1000
+
+    ret = track_pyramid.query(levels, start_time, end_time, resolution)
+    ret["track"] = track
+    return ret
+
+
+@tracing.stage("mat")
+def gen_mat(cmd):
+    id = cmd["id"]
+    # Hm!
+    meta = store.get_meta(id)
+
+    out = {}
+
+    measure = _measure(id, raw=True)
+
+    out.update(measure["measure"])
+    # out.update(measure["raw"])
+
+    if meta.get("rms"):
+        out["rms"] = np.array(
+            json.load(open(os.path.join(store.attachpath, meta["rms"])))
+        )
+    if meta.get("pitch"):
+        p_path = os.path.join(store.attachpath, meta["pitch"])
+        out["pitch"] = np.array(
+            [float(X.split()[1]) for X in open(p_path) if len(X.split()) > 2]
+        )
+    if meta.get("align"):
+        a_path = os.path.join(store.attachpath, meta["align"])
+        out["align"] = json.load(open(a_path))
+        # Remove 'None' values
+        for seg in out['align']['segments']:
+            for k,v in list(seg.items()):
+                if v is None:
+                    del seg[k]
+
+    with store.attach_writer(".mat", mode="wb") as mf:
+        sio.savemat(mf.path, out)
+        mf.adopt()
+        mathash = mf.publish()
+
+    store.set_meta(id, "mat", mathash)
+    
+    return {"mat": mathash}
+
+
+def export_docs(ids=None):
+    # documents for export.py: those asked for, or every aligned one
+    infos = store.get_infos()
+    if ids is not None:
+        return [X for X in infos if X["id"] in ids]
+    return [X for X in infos if store.get_meta(X["id"]).get("align")]
+
+def export_tables(docid):
+    # (name, columns) of the document's pitch, rms, words and full transcript measures, for
+    # export.py. only what has been computed already is exported, nothing is worked out here
+    meta = store.get_meta(docid)
+
+    if meta.get("pitch"):
+        p_path = os.path.join(store.attachpath, meta["pitch"])
+        # parsed straight into the array, a list of rows would take many times its size
+        rows = (X.split() for X in open(p_path))
+        track = np.fromiter((float(V) for X in rows if len(X) > 2 for V in X[:3]), dtype=float).reshape(-1, 3)
+        yield "pitch", {"time": track[:, 0], "pitch": track[:, 1], "voicing": track[:, 2]}
+
+    if meta.get("rms"):
+        rms = np.array(json.load(open(os.path.join(store.attachpath, meta["rms"]))), dtype=float)
+        yield "rms", {"time": np.arange(len(rms)) / 100.0, "rms": rms}
+
+    if meta.get("align"):
+        align = json.load(open(os.path.join(store.attachpath, meta["align"])))
+        words = [(seg.get("speaker") or "", wd) for seg in align["segments"] for wd in seg["wdlist"]]
+        yield "words", {
+            "speaker": [X[0] for X in words],
+            "word": [X[1]["word"] for X in words],
+            # unaligned words have no times
+            "start": np.array([X[1].get("start", np.nan) for X in words], dtype=float),
+            "end": np.array([X[1].get("end", np.nan) for X in words], dtype=float),
+            "case": [X[1].get("case", "") for X in words],
+        }
+
+    if meta.get("full_ts"):
+        measures = json.load(open(os.path.join(store.attachpath, meta["full_ts"])))["measure"]
+        yield "measures", {
+            "measure": list(measures),
+            "value": np.array([np.nan if X is None else X for X in measures.values()], dtype=float),
+        }
+
+
+@tracing.stage("measure")
+def measure(id, start_time, end_time, force_gen, raw):
+
+    meta = store.get_meta(id)
+
+    ## --- check we have all needed data
+
+    # redundacy, CSV did not load sometimes on older versions of Drift. Generate if nonexistent
+    if not meta.get("csv"):
+        gen_csv({ "id": id })
+
+    # if not meta.get("info"):
+    #     save_audio_info({ "id": id })
+
+    # check, maybe Drift is now running on calc_intense mode even though it wasn't when the audio file was originally uploaded
+    # Generate Harvest if nonexistent
+    if calc_intense and not meta.get("harvest"):
+        _harvest({ "id": id })
+
+    # this is just to prevent concurrent calls to harvest/csv during their initialization throwing errors
+    store.wait_for(id, "csv")
+    
+    # while not store.get_meta(id).get("info"):
+    #     pass
+    
+    if calc_intense:
+        store.wait_for(id, "harvest")
+    
+    # update meta with new meta that has all needed data
+    meta = store.get_meta(id)
+
+    ## --- end check we have all needed data
+
+    gentlecsv = open(os.path.join(store.attachpath, meta["aligncsv"]))
+    driftcsv = open(os.path.join(store.attachpath, meta["csv"]))    
+
+    # set start/end to transcript start/end if they're None
+    if start_time is None or end_time is None:
+        start_time, end_time = prosodic_measures.get_transcript_start_end(gentlecsv)
+        gentlecsv.seek(0)
+        full_ts = True
+    else:
+        full_ts = False
+
+    # full transcription duration should be the same for any given document,
+    # prosodic measures for these are cached so we can bulk download them.
+    if full_ts and not force_gen and meta.get("full_ts"):
+        cached = json.load(open(os.path.join(store.attachpath, meta["full_ts"])))
+        dummy_measures = prosodic_measures.measure_gentle_drift_indexed(get_prosodic_index(id, meta), 0, 1)
+        gentlecsv.seek(0)
+        driftcsv.seek(0)
+
+        # if cached measures are up to date (because maybe we have added more measures to Drift),
+        # and dynamism is part of cached data, return it. otherwise, it is outdated and must be reloaded
+        if set(dummy_measures.keys()).issubset(set(cached['measure'].keys())) and \
+            ('Dynamism' in cached['measure'] or not calc_intense):
+
+            # remove intense measures if we're on not calc_intense mode
+            if not calc_intense:
+                for measure_name in list(cached['measure'].keys()):
+                    if measure_name != "start_time" \
+                        and measure_name != "end_time"\
+                        and measure_name not in dummy_measures:
+                        del cached['measure'][measure_name]
+
+            if measure_index is not None and not measure_index.has(id, meta["full_ts"]):
+                index_measures(id)
+
+            tracing.annotate(cached=True)
+            return cached
+
+        # TODO if cached measures are not up to date, guts does not rewrite the full_ts entry
+        # but rather creates another entry with the same name. guts automatically takes the more recent one
+        # conveniently, but deleting existing entries before replacing would be nice
+        # (this applies to any time we are updating entries to guts e.g. align).
+
+    pitch = [
+        [float(Y) for Y in X.split(" ")]
+        for X in open(os.path.join(store.attachpath, meta["pitch"]))
+    ]
+    
+    full_data = {
+        "measure": {
+            "start_time": start_time,
+            "end_time": end_time
+        }
+    }
+
+    gentle_drift_data = prosodic_measures.measure_gentle_drift_indexed(get_prosodic_index(id, meta), start_time, end_time)
+    
+    full_data["measure"].update(gentle_drift_data)
+
+    if calc_intense:
+        with tracing.span("voxit", id, start=start_time, end=end_time):
+            voxit_data = prosodic_measures.measure_voxit(os.path.join(store.attachpath, meta["path"]), 
+                open(os.path.join(store.attachpath, meta["pitch"])), 
+                open(os.path.join(store.attachpath, meta["harvest"])), 
+                start_time, end_time, check=cancellation.check)
+        full_data["measure"].update(voxit_data)
+
+    # cache full transcript measures
+    if full_ts:
+        with store.attach_writer(".json") as dfh:
+            json.dump(full_data, dfh, indent=2)
+            fulltshash = dfh.publish()
+
+        store.set_meta(id, "full_ts", fulltshash)
+        store.set_meta(id, "full_ts_from", measures_from(meta))
+
+        if measure_index is not None:
+            measure_index.put(id, meta.get("title"), fulltshash, full_data["measure"], calc_intense)
+
+    return full_data
+
+def index_measures(id):
+    # copy a document's cached full transcript measures into measure_index
+    meta = store.get_meta(id)
+    cached = json.load(open(os.path.join(store.attachpath, meta["full_ts"])))
+    # whether the intense measures were calculated, from the measures themselves since full_ts doesn't say
+    measure_index.put(id, meta.get("title"), meta["full_ts"], cached["measure"], "Dynamism" in cached["measure"])
+
+def index_cached_measures():
+    # fill measure_index with documents measured before it existed, or while it was out of date
+    docids = []
+    for doc in store.get_infos():
+        docids.append(doc["id"])
+        meta = store.get_meta(doc["id"])
+        if meta.get("full_ts") and not measure_index.has(doc["id"], meta["full_ts"]):
+            index_measures(doc["id"])
+
+    print(f"SYSTEM: measure index has {len(docids)} documents")
+
+# documents matching every filter in cmd["filters"] ([label, operator, value], e.g. ["WPM", ">", 150]),
+# optionally ordered by cmd["order_by"] (descending if cmd["descending"]), limited to cmd["limit"] documents
+# and only including the measures in cmd["labels"]
+def _corpus_query(cmd):
+    if measure_index is None:
+        return {"error": "measure index not enabled"}
+
+    try:
+        docs = measure_index.query(cmd.get("filters", []), cmd.get("order_by"), cmd.get("descending", False),
+            cmd.get("limit"), cmd.get("labels"))
+    except (ValueError, TypeError) as e:
+        return {"error": str(e)}
+
+    # documents removed since they were indexed
+    existing = set(doc["id"] for doc in store.get_infos())
+    removed = [X["id"] for X in docs if X["id"] not in existing]
+    if removed:
+        measure_index.forget(removed)
+
+    return {"docs": [X for X in docs if X["id"] in existing]}
+
+# mean, variance and quantiles of each measure (or of the comma separated `labels`) over every indexed document.
+# quantiles: comma separated, default 0.05,0.5,0.95
+def _corpus_stats(labels=None, quantiles=None):
+    if measure_index is None:
+        return {"error": "measure index not enabled"}
+
+    labels = labels.split(",") if labels else None
+    quantiles = [float(X) for X in quantiles.split(",")] if quantiles else [0.05, 0.5, 0.95]
+
+    return {"stats": measure_index.summaries(labels, quantiles)}
+
+# measures in the index, with how many documents have them and their range
+def _corpus_labels():
+    if measure_index is None:
+        return {"error": "measure index not enabled"}
+
+    return {"labels": measure_index.labels()}
+
+# parsed Gentle/Drift csvs with running totals, per document. rebuilt whenever either csv changes
+prosodic_indexes = {}
+
+def get_prosodic_index(id, meta):
+    key = (meta["aligncsv"], meta["csv"])
+    cached = prosodic_indexes.get(id)
+    if cached is None or cached[0] != key:
+        index = prosodic_measures.GentleDriftIndex(
+            open(os.path.join(store.attachpath, meta["aligncsv"])),
+            open(os.path.join(store.attachpath, meta["csv"])))
+        prosodic_indexes[id] = (key, index)
+        return index
+    return cached[1]
+
+def cast_not_none(var, to_cast):
+    if var is not None and type(var) is not to_cast:
+        return to_cast(var)
+    return var
+    
+def bool_not_none(var):
+    if var is not None and type(var) is str:
+        return var.lower() == 'true'
+    return bool(var) if not None else None
+
+# note: not passing start_time and end_time defaults to sending transcript duration
+def _measure(id=None, start_time=None, end_time=None, force_gen=None, raw=None):
+
+    start_time = cast_not_none(start_time, float)
+    end_time = cast_not_none(end_time, float)
+    force_gen = bool_not_none(force_gen)
+    raw = bool_not_none(raw)
+
+    return measure(id, start_time, end_time, force_gen, raw)
+
+# only the measures that are sums or counts (WPM, pauses, mean pitch), so any selection is answered instantly
+def _measure_additive(id=None, start_time=None, end_time=None):
+
+    start_time = cast_not_none(start_time, float)
+    end_time = cast_not_none(end_time, float)
+
+    meta = store.get_meta(id)
+
+    if not meta.get("csv"):
+        gen_csv({ "id": id })
+        meta = store.get_meta(id)
+
+    if start_time is None or end_time is None:
+        start_time, end_time = prosodic_measures.get_transcript_start_end(open(os.path.join(store.attachpath, meta["aligncsv"])))
+
+    index = get_prosodic_index(id, meta)
+    gentle_drift_data = index.additive_measures(start_time, end_time)
+    if gentle_drift_data is None:
+        gentle_drift_data = prosodic_measures.measure_gentle_drift_indexed(index, start_time, end_time)
+
+    full_data = {
+        "measure": {
+            "start_time": start_time,
+            "end_time": end_time
+        }
+    }
+    full_data["measure"].update(gentle_drift_data)
+
+    return full_data
+
+def _measure_all():    
+    all_measures = {}
+    all_docs = store.get_infos()
+    for doc in all_docs:
+        cancellation.check()
+        if store.get_meta(doc["id"]).get("align"):
+            all_measures[doc["id"]] = _measure(id=doc["id"])
+            all_measures[doc["id"]]["title"] = doc["title"]
+            # guts.bschange(
+            #     rec_set.dbs[doc["id"]],
+            #     {"type": "set", "id": "meta", "key": "align_px", "val": cur_status})
+            # time.sleep(1)
+    return all_measures
+
+@tracing.stage("windowed")
+def _windowed(cmd):
+
+    id = cmd["id"]
+    params = cmd["params"]
+    meta = store.get_meta(id)
+
+    pitch = [
+        [float(Y) for Y in X.split(" ")]
+        for X in open(os.path.join(store.attachpath, meta["pitch"]))
+    ]
+
+    # redundacy, CSV did not load sometimes on older versions of Drift. Generate if nonexistent
+    if not meta.get("csv"):
+        gen_csv({ "id": id })
+
+    # check, maybe Drift is now running on calc_intense mode even though it wasn't when the audio file was originally uploaded
+    # Generate Harvest if nonexistent
+    if calc_intense and not meta.get("harvest"):
+        _harvest({ "id": id })
+
+    # this is just to prevent concurrent calls to harvest/csv during their initialization throwing errors
+    store.wait_for(id, "csv")
+    
+    if calc_intense:
+        store.wait_for(id, "harvest")
+
+    meta = store.get_meta(id)
+
+    # the last series asked for is kept. precompute works out the frontend's default one ahead of time
+    key = windowed_key(meta, params)
+    if meta.get("windowed", {}).get("key") == key:
+        tracing.annotate(cached=True)
+        return json.load(open(os.path.join(store.attachpath, meta["windowed"]["json"])))
+
+    prosodic_index = get_prosodic_index(id, meta)
+
+    batched_windows = {}
+
+    # batch window parameters so we can calculate multiple windows that have same length
+    for measure in params:
+        window_len = params[measure]
+
+        if window_len not in batched_windows:
+            batched_windows[window_len] = []
+        
+        batched_windows[window_len].append(measure)
+
+
+    batched_measures = {}
+    audio_len = len(pitch) / 100.0
+    
+    full_data = {
+        "measure": {
+        }
+    }
+    
+    if calc_intense:
+        audio_path = os.path.join(store.attachpath, meta["path"])
+        windows = [
+            (i, min(i + window_len, audio_len))
+            for window_len in batched_windows
+            for i in range(0, int(audio_len), int(window_len))
+        ]
+
+        with open(os.path.join(store.attachpath, meta["pitch"])) as pitch_file, open(os.path.join(store.attachpath, meta["harvest"])) as harvest_file, \
+                tracing.span("voxit windows", id, windows=len(windows), processes=window_pool.processes if window_pool else 1):
+            voxit_windows = measure_voxit_windows(audio_path, pitch_file, harvest_file, windows,
+                pool=window_pool, duration=audio_duration(id), check=cancellation.check)
+
+    for window_len in batched_windows:
+        measure_labels = batched_windows[window_len]
+        
+        for i in range(0, int(audio_len), int(window_len)):
+            cancellation.check()
+            win_start = i
+            win_end = min(i + window_len, audio_len)
+            
+            print(f'{win_start} - {win_end}')
+            gentle_drift_data = prosodic_measures.measure_gentle_drift_indexed(prosodic_index, win_start, win_end)
+
+            if calc_intense:
+                voxit_data = voxit_windows[(win_start, win_end)]
+
+            
+            # we'll just update full_data with returned map so that labels end up in the same order as returned by prosodic_measures
+            # this is purely for aesthetic purposes and we'll replace the values the labels are paired with in the end
+            if len(full_data["measure"]) == 0:
+                full_data["measure"].update(gentle_drift_data)
+
+                if calc_intense:
+                    full_data["measure"].update(voxit_data)
+                    
+                for label in full_data["measure"]:
+                    full_data["measure"][label] = []
+
+
+            for label in measure_labels:
+                if label in full_data["measure"]:
+                    if label in gentle_drift_data:
+                        full_data["measure"][label].append(gentle_drift_data[label])
+                    elif label in voxit_data:
+                        full_data["measure"][label].append(voxit_data[label])
+
+
+    # if full_ts:
+    #     with tempfile.NamedTemporaryFile(suffix=".json", delete=False, mode="w") as dfh:
+    #         json.dump(full_data, dfh, indent=2)
+
+    #         dfh.close()
+    #     fulltshash = store.attach(dfh.name)
+
+    #     guts.bschange(
+    #         rec_set.dbs[id],
+    #         {"type": "set", "id": "meta", "key": "full_ts", "val": fulltshash},
+    #     )
+
+    with store.attach_writer(".json") as dfh:
+        json.dump(full_data, dfh)
+        windowedhash = dfh.publish()
+    store.set_meta(id, "windowed", {"key": key, "json": windowedhash})
+
+    return full_data
+
+def measures_from(meta):
+    # what a document's measures are worked out from
+    return [meta["aligncsv"], meta["csv"], meta["pitch"], calc_intense, meta.get("harvest") if calc_intense else None]
+
+def windowed_key(meta, params):
+    # what a windowed series depends on
+    inputs = [params] + measures_from(meta)
+    return hashlib.sha1(json.dumps(inputs, sort_keys=True).encode()).hexdigest()
+
+
+# what the frontend's windowed download asks for (WINDOWED_PARAMS in src/utils/Utils.js)
+DEFAULT_WINDOWED_PARAMS = {
+    label: 20 for label in [
+        "WPM",
+        "Gentle_Pause_Count_>100ms",
+        "Gentle_Pause_Count_>500ms",
+        "Gentle_Pause_Count_>1000ms",
+        "Gentle_Pause_Count_>1500ms",
+        "Gentle_Pause_Count_>2000ms",
+        "Gentle_Pause_Count_>2500ms",
+        "Gentle_Long_Pause_Count_>3000ms",
+        "Gentle_Mean_Pause_Duration_(sec)",
+        "Gentle_Pause_Rate_(pause/sec)",
+        "Gentle_Complexity_All_Pauses",
+        "Drift_f0_Mean_(hz)",
+        "Drift_f0_Range_95_Percent_(octaves)",
+        "Drift_f0_Mean_Abs_Velocity_(octaves/sec)",
+        "Drift_f0_Mean_Abs_Accel_(octaves/sec^2)",
+        "Drift_f0_Entropy",
+        "Intensity_Mean_Abs_Velocity_(decibels/sec)",
+        "Intensity_Mean_Abs_Accel_(decibels/sec^2)",
+        "Intensity_Segment_Range_95_Percent_(decibels)",
+        "Dynamism",
+    ]
+}
+
+@tracing.stage("precompute")
+def precompute(docid, idle=lambda: None):
+    # everything the first look at a freshly aligned document asks for: the csv, harvest, the full
+    # transcript measures and the default windowed series. idle() is called before each step and
+    # can hold the next one back while people are waiting on other work (see precompute.py)
+    meta = store.get_meta(docid)
+    if not meta.get("aligncsv") or not meta.get("pitch"):
+        return
+
+    idle()
+    if meta.get("csv_from") != [meta["align"], meta["pitch"]]:
+        gen_csv({"id": docid})
+
+    if calc_intense and not store.get_meta(docid).get("harvest"):
+        idle()
+        _harvest({"id": docid})
+
+    # the cached measures may be of the previous alignment
+    meta = store.get_meta(docid)
+    if not meta.get("full_ts") or meta.get("full_ts_from") != measures_from(meta):
+        idle()
+        measure(docid, None, None, True, False)
+
+    idle()
+    _windowed({"id": docid, "params": DEFAULT_WINDOWED_PARAMS})
@@ -0,0 +1,68 @@
+# Works out a document's measures in the background once it has been aligned, so they're ready
+# by the time anyone opens it (see pipeline.precompute). One document at a time, on a thread at
+# the lowest CPU priority, and only while no analysis request is waiting for an answer.
+
+import os
+import queue
+import sys
+import threading
+import time
+
+# how often a held back step looks again for the server to be idle
+IDLE_POLL = 1.0
+
+
+class Precomputer:
+    def __init__(self, run, busy=lambda: False):
+        # run(docid, idle) does the work; busy() says whether someone is waiting on the server
+        self.run = run
+        self.busy = busy
+        self.todo = queue.Queue()
+        # documents queued and not started yet. a document changed while it's being worked on is queued again
+        self.pending = set()
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.loop, name="precompute", daemon=True)
+        self.thread.start()
+
+    def add(self, docid):
+        with self.lock:
+            if docid in self.pending:
+                return
+            self.pending.add(docid)
+        self.todo.put(docid)
+
+    def changed(self, docid, key, val):
+        # store.subscribe callback
+        if val:
+            self.add(docid)
+
+    def idle(self):
+        while self.busy():
+            time.sleep(IDLE_POLL)
+
+    def loop(self):
+        lower_priority()
+        while True:
+            docid = self.todo.get()
+            with self.lock:
+                self.pending.discard(docid)
+
+            started = time.time()
+            try:
+                self.run(docid, self.idle)
+            except Exception as e:
+                print(f"SYSTEM: precomputing {docid} failed: {e}")
+                continue
+            print(f"SYSTEM: precomputed {docid} (took {time.time() - started:.2f}s)")
+
+
+def lower_priority():
+    # niceness is per thread on Linux, and processes started from this thread inherit it
+    if sys.platform.startswith("linux"):
+        try:
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), 19)
+        except OSError as e:
+            print(f"SYSTEM: couldn't lower precompute priority: {e}")
@@ -0,0 +1,67 @@
+# Pitch tracking of long recordings as several overlapping chunks at once, for trackers like SAcC
+# that only use one core. Chunks start on 10ms frame boundaries, so their frames line up with the
+# whole recording's. Each frame is taken from the one chunk that owns it; ownership changes hands
+# halfway through each overlap, so every frame kept has at least overlap / 2 of audio on both sides.
+
+import concurrent.futures
+import math
+import os
+import tempfile
+
+from scipy.io import wavfile
+
+FRAME_RATE = 100
+
+
+def plan_chunks(n_samples, fs, chunks, overlap):
+    # [(first frame, end frame, first owned frame, end owned frame)], end owned is None for the last chunk
+    hop = fs // FRAME_RATE
+    n_frames = int(math.ceil(n_samples / hop))
+    bounds = [round(i * n_frames / chunks) for i in range(chunks + 1)]
+    context = int(overlap * FRAME_RATE / 2)
+
+    plan = []
+    for idx, (own_start, own_end) in enumerate(zip(bounds, bounds[1:])):
+        last = idx == chunks - 1
+        plan.append((
+            max(0, own_start - context),
+            n_frames if last else min(n_frames, own_end + context),
+            own_start,
+            None if last else own_end,
+        ))
+    return plan
+
+
+def track_chunked(wavpath, outpath, run, chunks, overlap):
+    # run(wavpath, outpath) tracks one wav file into a "time f0 ..." track, e.g. SAcC
+    fs, samples = wavfile.read(wavpath, mmap=True)
+    hop = fs // FRAME_RATE
+    plan = plan_chunks(len(samples), fs, chunks, overlap)
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = []
+        for idx, (start, end, _own_start, _own_end) in enumerate(plan):
+            chunk_wav = os.path.join(tmpdir, f"{idx}.wav")
+            wavfile.write(chunk_wav, fs, samples[start * hop : end * hop])
+            paths.append((chunk_wav, os.path.join(tmpdir, f"{idx}.txt")))
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=chunks) as pool:
+            list(pool.map(lambda X: run(*X), paths))
+
+        tracks = []
+        for _chunk_wav, chunk_txt in paths:
+            rows = [X.split() for X in open(chunk_txt)] if os.path.exists(chunk_txt) else []
+            rows = [X for X in rows if len(X) > 2]
+            if not rows:
+                # a chunk failed. leave the output empty, which the caller reports as a failed track
+                open(outpath, "w").close()
+                return
+            tracks.append(rows)
+
+    with open(outpath, "w") as fh:
+        for (start, _end, own_start, own_end), rows in zip(plan, tracks):
+            last = len(rows) if own_end is None else own_end - start
+            for local in range(own_start - start, last):
+                # SAcC may stop a frame or two before the chunk's end, carry its last frame on
+                row = rows[min(local, len(rows) - 1)]
+                fh.write(f"{(start + local) / FRAME_RATE:.3f} {' '.join(row[1:])}\n")
@@ -0,0 +1,216 @@
+# In-process pitch trackers, as faster alternatives to running SAcC in its own interpreter.
+# Every engine takes mono audio and its sample rate, and returns frame times, f0 (0 where unvoiced)
+# and a 0-1 voicing confidence at 100 frames per second, frame k at k / 100 seconds.
+# write_track() writes them in SAcC's "time f0 voicing" format, so everything reading the pitch
+# attachment works unchanged.
+#
+# Speed and agreement with SAcC: python3 -m py.pitch_engines recording.wav sacc.txt
+#
+# No such comparison has been run yet. The only agreement measured so far is against the known f0
+# of a synthetic gliding harmonic signal, so run the above on a few real recordings before relying
+# on these engines in place of SAcC.
+
+import argparse
+import math
+import subprocess
+import tempfile
+import time
+
+import librosa
+import numpy as np
+import pyworld
+
+FRAME_RATE = 100
+# sample rate the in-process engines track at
+SAMPLE_RATE = 16000
+# the range SAcC looks for pitch in
+F0_FLOOR = 60
+F0_CEIL = 400
+
+# YIN's cumulative mean normalized difference must dip below this for a frame to be voiced
+YIN_THRESHOLD = 0.15
+# frames quieter than this, relative to the loudest frame, are unvoiced whatever YIN finds
+YIN_SILENCE_DB = -50
+# frames per block, to keep memory flat on long recordings
+YIN_BLOCK = 4096
+
+
+def n_frames(x, fs):
+    return int(math.ceil(len(x) * FRAME_RATE / fs))
+
+
+def track_dio(x, fs):
+    # WORLD's DIO, refined with StoneMask. much faster than Harvest, a little less robust
+    x = np.ascontiguousarray(x, dtype=np.float64)
+    f0, timeaxis = pyworld.dio(x, fs, f0_floor=F0_FLOOR, f0_ceil=F0_CEIL, frame_period=1000 / FRAME_RATE)
+    f0 = pyworld.stonemask(x, f0, timeaxis, fs)
+    f0 = fit(f0, n_frames(x, fs))
+    return frame_times(len(f0)), f0, (f0 > 0).astype(float)
+
+
+def track_yin(x, fs):
+    # YIN (de Cheveigné & Kawahara 2002), every frame of a block at once
+    x = np.asarray(x, dtype=np.float64)
+    hop = fs // FRAME_RATE
+    min_lag = int(fs / F0_CEIL)
+    max_lag = int(math.ceil(fs / F0_FLOOR))
+    # integration window, one period of the lowest pitch
+    window = max_lag
+    frame_len = window + max_lag + 1
+    count = n_frames(x, fs)
+
+    # frames centred on their time
+    padded = np.pad(x, (window // 2, frame_len + hop * count))
+    loudest = max(np.abs(x).max(), 1e-9) if len(x) else 1e-9
+
+    f0 = np.zeros(count)
+    voicing = np.zeros(count)
+    for first in range(0, count, YIN_BLOCK):
+        idx = np.arange(first, min(count, first + YIN_BLOCK))
+        frames = padded[idx[:, None] * hop + np.arange(frame_len)]
+        f0[idx], voicing[idx] = yin_frames(frames, fs, window, min_lag, max_lag)
+
+        # silence gate
+        level = np.sqrt((frames[:, :window] ** 2).mean(axis=1)) / loudest
+        quiet = 20 * np.log10(np.maximum(level, 1e-12)) < YIN_SILENCE_DB
+        f0[idx[quiet]] = 0
+        voicing[idx[quiet]] = 0
+
+    return frame_times(count), f0, voicing
+
+
+def yin_frames(frames, fs, window, min_lag, max_lag):
+    lags = np.arange(max_lag + 1)
+
+    # difference function d(tau) = sum_j (x_j - x_j+tau)^2 over the window, from energies and
+    # the cross-correlation of the window with the frame
+    energy = np.concatenate([np.zeros((len(frames), 1)), np.cumsum(frames ** 2, axis=1)], axis=1)
+    e_lag = energy[:, lags + window] - energy[:, lags]
+    e_0 = e_lag[:, :1]
+    size = 1 << int(math.ceil(math.log2(frames.shape[1] + window)))
+    xcorr = np.fft.irfft(
+        np.fft.rfft(frames, size) * np.conj(np.fft.rfft(frames[:, :window], size)), size
+    )[:, : max_lag + 1]
+    diff = np.maximum(e_0 + e_lag - 2 * xcorr, 0)
+
+    # cumulative mean normalized difference
+    cmnd = np.ones_like(diff)
+    running = np.cumsum(diff[:, 1:], axis=1)
+    cmnd[:, 1:] = diff[:, 1:] * lags[1:] / np.maximum(running, 1e-12)
+
+    # first local minimum under the threshold, within the pitch range
+    inner = cmnd[:, min_lag : max_lag]
+    is_min = (inner <= cmnd[:, min_lag - 1 : max_lag - 1]) & (inner < cmnd[:, min_lag + 1 : max_lag + 1])
+    candidates = is_min & (inner < YIN_THRESHOLD)
+    voiced = candidates.any(axis=1)
+    tau = np.argmax(candidates, axis=1) + min_lag
+
+    # parabolic interpolation around the minimum
+    rows = np.arange(len(frames))
+    left, mid, right = cmnd[rows, tau - 1], cmnd[rows, tau], cmnd[rows, tau + 1]
+    denom = left - 2 * mid + right
+    shift = np.where(np.abs(denom) > 1e-12, 0.5 * (left - right) / np.where(denom == 0, 1, denom), 0)
+    period = tau + np.clip(shift, -1, 1)
+
+    f0 = np.where(voiced, fs / period, 0.0)
+    voicing = np.where(voiced, np.clip(1 - mid, 0, 1), 0.0)
+    return f0, voicing
+
+
+def frame_times(count):
+    return np.arange(count) / FRAME_RATE
+
+
+def fit(track, count):
+    # pad with unvoiced frames or trim, to one frame per 10ms of audio
+    if len(track) >= count:
+        return track[:count]
+    return np.concatenate([track, np.zeros(count - len(track))])
+
+
+# engines that run in this process. "sacc" is the default and runs as a subprocess, see pipeline.pitch
+ENGINES = {
+    "dio": track_dio,
+    "yin": track_yin,
+}
+
+
+def load_audio(soundfile, duration=None):
+    # bug where librosa can't load mp3's without supplying a duration, so callers pass one in (see pipeline._harvest)
+    x, fs = librosa.load(soundfile, sr=SAMPLE_RATE, mono=True, duration=duration)
+    return x, fs
+
+
+def track_file(engine, soundfile, duration=None):
+    x, fs = load_audio(soundfile, duration)
+    return ENGINES[engine](x, fs)
+
+
+def write_track(fh, times, f0, voicing):
+    for t, f, v in zip(times, f0, voicing):
+        fh.write(f"{t:.3f} {f:.3f} {v:.3f}\n")
+
+
+def read_sacc(path):
+    rows = [X.split() for X in open(path) if len(X.split()) > 2]
+    return np.array([float(X[1]) for X in rows])
+
+
+def agreement(reference, f0):
+    # how well f0 agrees with a reference track, frame by frame
+    count = min(len(reference), len(f0))
+    reference, f0 = reference[:count], f0[:count]
+    ref_voiced = reference > 0
+    voiced = f0 > 0
+    both = ref_voiced & voiced
+    cents = 1200 * np.abs(np.log2(f0[both] / reference[both])) if both.any() else np.array([])
+    return {
+        "frames": count,
+        # frames both call voiced, or both unvoiced
+        "voicing_agreement": float((ref_voiced == voiced).mean()) if count else None,
+        # voiced in both but more than 20% off, e.g. octave errors
+        "gross_error": float((cents > 1200 * math.log2(1.2)).mean()) if len(cents) else None,
+        "median_cents": float(np.median(cents)) if len(cents) else None,
+    }
+
+
+def benchmark(soundfile, sacctxt, engines, time_sacc=None):
+    reference = read_sacc(sacctxt)
+    audio_len = len(reference) / FRAME_RATE
+
+    report = []
+    if time_sacc:
+        # what pipeline.pitch does: ffmpeg to an 8khz wav, then SAcC on it
+        with tempfile.NamedTemporaryFile(suffix=".wav") as wav_fp, tempfile.NamedTemporaryFile(suffix=".txt") as pitch_fp:
+            sacc_start = time.time()
+            subprocess.call(["ffmpeg", "-y", "-loglevel", "panic", "-i", soundfile, "-ar", "8000", "-ac", "1", wav_fp.name])
+            subprocess.call([time_sacc, wav_fp.name, pitch_fp.name])
+            report.append(("sacc", time.time() - sacc_start, agreement(reference, read_sacc(pitch_fp.name))))
+
+    for engine in engines:
+        engine_start = time.time()
+        _times, f0, _voicing = track_file(engine, soundfile, duration=math.floor(audio_len) or None)
+        report.append((engine, time.time() - engine_start, agreement(reference, f0)))
+
+    print(f'{audio_len:.0f}s of audio, compared with {sacctxt}')
+    print()
+    print(f'{"engine":<8} {"seconds":>8} {"x realtime":>10} {"voicing":>8} {"gross err":>9} {"cents":>7}')
+    for engine, took, agrees in report:
+        print(f'{engine:<8} {took:>8.2f} {audio_len / took:>10.1f} '
+              f'{fmt(agrees["voicing_agreement"], "{:.1%}"):>8} {fmt(agrees["gross_error"], "{:.1%}"):>9} '
+              f'{fmt(agrees["median_cents"], "{:.1f}"):>7}')
+
+
+def fmt(val, spec):
+    return "-" if val is None else spec.format(val)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time in-process pitch engines and compare them with SAcC")
+    parser.add_argument("soundfile")
+    parser.add_argument("sacctxt", help="SAcC pitch track of the same recording, as attached by the pitch step")
+    parser.add_argument("-e", "--engines", help="comma separated. default: all of " + ",".join(ENGINES), default=",".join(ENGINES))
+    parser.add_argument("--time_sacc", help="path to SAcC, to time it too (needs ffmpeg)")
+    args = parser.parse_args()
+
+    benchmark(args.soundfile, args.sacctxt, [X for X in args.engines.split(",") if X], args.time_sacc)
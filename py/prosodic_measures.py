@@ -17,37 +17,26 @@ from scipy.signal import savgol_filter
 
 def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
 
-    entered = time.time()
-
     csv.field_size_limit(sys.maxsize)
 
+    # Read the Gentle align csv file
+    gentle = (row[0].split(',') for row in csv.reader(gentlecsv, delimiter=' '))
+    # Read the Drift align csv file
+    # set skipinitialspace to True so csv can read transcript that have commas
+    drift = csv.reader(driftcsv, skipinitialspace=True)
+    next(drift, None)
+
+    return measure_gentle_drift_rows(gentle, drift, start_time, end_time)
+
+def measure_gentle_drift_rows(gentle, drift, start_time, end_time):
+
+    entered = time.time()
+
     results = {}
 
     # GENTLE
-    gentle_start = []
-    gentle_end = []
-    gentle_wordcount = 0
-    # Read the Gentle align csv file
-    gentle = csv.reader(gentlecsv, delimiter=' ')
-    for row in gentle:
-        # Save measurements as list elements
-        measures = row[0].split(',')
-        # for some reason, rows might be empty. Faulty csv file perhaps?
-        if len(measures) != 4:
-            continue
-        # Start time
-        if start_time and measures[2] and float(start_time) > round(float(measures[2]) * 10000)/10000:
-            continue
-        # End time
-        if end_time and measures[3] and float(end_time) < round(float(measures[3]) * 10000)/10000:
-            break
-        # Ignore noise
-        if measures[0] != '[noise]':
-            if not (measures[1] or measures[2] or measures[3]): # ignore rows with empty cells
-                continue
-            gentle_wordcount += 1
-            gentle_start.append(round(float(measures[2]) * 10000)/10000)
-            gentle_end.append(round(float(measures[3]) * 10000)/10000)
+    gentle_start, gentle_end = read_gentle_words(gentle, start_time, end_time)
+    gentle_wordcount = len(gentle_start)
     
     selection_duration = end_time - start_time
 
@@ -112,6 +101,60 @@ def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
     results["Gentle_Pause_Rate_(pause/sec)"] = float(round(APR, 3))
 
     # Rhythmic Complexity of Pauses
+    CP = gentle_pause_complexity(gentle_start, gentle_end)
+    results["Gentle_Complexity_All_Pauses"] = CP * 100
+
+    # DRIFT
+    drift_time, drift_pitch, ixtmp = read_drift_pitch(drift, start_time, end_time)
+
+    # Pitch pre-calculations
+
+    # Calculate f0log(ivuv)
+    # ivuv is an array of the indices where vuv = 1
+    f0log = []
+    for p in drift_pitch: # S.SAcC.f0
+        f0log.append(math.log2(p)) # f0log(ivuv)
+
+    # Calculate f0mean
+    # f0mean = 2.^(mean(f0log(ivuv)));
+    f0mean = 0
+    for f in f0log:
+        f0mean += f
+    if len(f0log) != 0:
+        f0mean = math.pow(2, (f0mean / len(f0log)))
+    results["Drift_f0_Mean_(hz)"] = f0mean
+
+    drift_pitch_measures(results, drift_time, drift_pitch, ixtmp, f0mean)
+
+    # Output message
+    print(f'SYSTEM: Finished calculating Drift and Gentle measurements (took {time.time() - entered:.2f}s)')
+    
+    return results
+
+def read_gentle_words(rows, start_time, end_time):
+    # Word start/end times from Gentle align csv rows (already split on commas)
+    gentle_start = []
+    gentle_end = []
+    for measures in rows:
+        # for some reason, rows might be empty. Faulty csv file perhaps?
+        if len(measures) != 4:
+            continue
+        # Start time
+        if start_time and measures[2] and float(start_time) > round(float(measures[2]) * 10000)/10000:
+            continue
+        # End time
+        if end_time and measures[3] and float(end_time) < round(float(measures[3]) * 10000)/10000:
+            break
+        # Ignore noise
+        if measures[0] != '[noise]':
+            if not (measures[1] or measures[2] or measures[3]): # ignore rows with empty cells
+                continue
+            gentle_start.append(round(float(measures[2]) * 10000)/10000)
+            gentle_end.append(round(float(measures[3]) * 10000)/10000)
+
+    return gentle_start, gentle_end
+
+def gentle_pause_complexity(gentle_start, gentle_end):
     s = []
 
     if len(gentle_end) > 1:
@@ -154,13 +197,13 @@ def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
         CP = lempel_ziv_complexity("".join([str(i) for i in s]))
     else:
         CP = 0
-    results["Gentle_Complexity_All_Pauses"] = CP * 100
 
-    # DRIFT
+    return CP
+
+def read_drift_pitch(rows, start_time, end_time):
+    # Voiced pitch values and voiced run bounds from Drift csv rows (header removed)
     drift_time = []
     drift_pitch = []
-    # Read the Drift align csv file
-    init = True
     skip = True
     run = False
     ixtmp = []
@@ -168,15 +211,7 @@ def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
     zero_count = 0
     int_count = 0
     temp = None
-    # set skipinitialspace to True so csv can read transcript that have commas
-    drift = csv.reader(driftcsv, skipinitialspace=True)
-    i = 1
-    for measures in drift:
-        # Save measurements as list elements
-        # measures = row[0].split(',')
-        if init:
-            init = False
-            continue
+    for measures in rows:
         # Start time
         if start_time and float(start_time) > float(measures[0]):
             continue
@@ -207,23 +242,10 @@ def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
                 end = start
             ixtmp.append([start,end])
 
-    # Pitch pre-calculations
-
-    # Calculate f0log(ivuv)
-    # ivuv is an array of the indices where vuv = 1
-    f0log = []
-    for p in drift_pitch: # S.SAcC.f0
-        f0log.append(math.log2(p)) # f0log(ivuv)
-
-    # Calculate f0mean
-    # f0mean = 2.^(mean(f0log(ivuv)));
-    f0mean = 0
-    for f in f0log:
-        f0mean += f
-    if len(f0log) != 0:
-        f0mean = math.pow(2, (f0mean / len(f0log)))
-    results["Drift_f0_Mean_(hz)"] = f0mean
+    return drift_time, drift_pitch, ixtmp
 
+def drift_pitch_measures(results, drift_time, drift_pitch, ixtmp, f0mean):
+    # Pitch range, speed, acceleration and entropy, in the order they are reported
     # Calculate diffoctf0
     # diffoctf0 = log2(S.SAcC.f0)-log2(f0mean);
     diffoctf0 = []
@@ -341,13 +363,188 @@ def measure_gentle_drift(gentlecsv, driftcsv, start_time, end_time):
 
     # results["Dynamism"] = (f0velocity_mean/0.1167627388 + PE/0.3331034878)/2 + CP * 100/0.6691896835
 
-    # Output message
-    print(f'SYSTEM: Finished calculating Drift and Gentle measurements (took {time.time() - entered:.2f}s)')
-    
     return results
 
+# Per-document cumulative sums over the Gentle and Drift csv files, so the additive measures
+# (word counts, pause counts/durations, voiced frame counts and log pitch sums) of any
+# (start_time, end_time) selection come out of a couple of binary searches.
+# Order statistics (complexity, range, speed, entropy) fall back to the regular code on the
+# selected slice only, without re-reading the csv files.
+class GentleDriftIndex:
+    MIN_PAUSE = 0.1
+    MAX_PAUSE = 3
+
+    def __init__(self, gentlecsv, driftcsv):
+        csv.field_size_limit(sys.maxsize)
+
+        # GENTLE
+        self.gentle_rows = [row[0].split(',') for row in csv.reader(gentlecsv, delimiter=' ') if len(row) > 0]
+        self.gentle_rows = [X for X in self.gentle_rows if len(X) == 4]
+
+        def rounded(val):
+            return round(float(val) * 10000)/10000
+
+        # words Gentle couldn't find in the audio have no times. read_gentle_words never skips, stops
+        # at or keeps those, so only the aligned rows are indexed
+        aligned = [X for X in self.gentle_rows if X[2] and X[3]]
+        row_start = np.array([rounded(X[2]) for X in aligned], dtype=float)
+        row_end = np.array([rounded(X[3]) for X in aligned], dtype=float)
+        is_word = np.array([X[0] != '[noise]' for X in aligned], dtype=bool)
+
+        self.gentle_sorted = is_sorted(row_start) and is_sorted(row_end)
+        self.row_start = row_start
+        self.row_end = row_end
+        self.word_rows = np.concatenate(([0], np.cumsum(is_word)))
+        self.word_start = row_start[is_word]
+        self.word_end = row_end[is_word]
+
+        # pause between each word and the next
+        gaps = self.word_start[1:] - self.word_end[:-1]
+        is_pause = (gaps >= self.MIN_PAUSE) & (gaps <= self.MAX_PAUSE)
+        self.pause_counts = cumulative(is_pause)
+        # summed one at a time in additive_measures, as measure_gentle_drift_rows does, since a prefix
+        # sum can round a mean that lands near a half differently
+        self.pause_gaps = np.where(is_pause, gaps, 0.0)
+        self.long_pause_counts = cumulative(gaps > self.MAX_PAUSE)
+        self.pause_counts_over = {}
+        start_pause = 0.5
+        while start_pause < self.MAX_PAUSE:
+            label = f"Gentle_Pause_Count_>{(int)(start_pause * 1000)}ms"
+            self.pause_counts_over[label] = cumulative((gaps >= start_pause) & (gaps <= self.MAX_PAUSE))
+            start_pause += 0.5
+
+        # DRIFT
+        drift = csv.reader(driftcsv, skipinitialspace=True)
+        next(drift, None)
+        self.drift_rows = list(drift)
+
+        self.frame_time = np.array([float(X[0]) for X in self.drift_rows], dtype=float)
+        frame_pitch = np.array([float(X[1]) if X[1] else 0 for X in self.drift_rows], dtype=float)
+        voiced = frame_pitch != 0
+        self.drift_sorted = is_sorted(self.frame_time)
+        self.voiced_counts = cumulative(voiced)
+        self.log_pitch_sums = cumulative(np.log2(frame_pitch, out=np.zeros_like(frame_pitch), where=voiced))
+
+    def word_range(self, start_time, end_time):
+        # [first, last) indices into word_start/word_end kept by read_gentle_words
+        first_row = 0
+        last_row = len(self.row_start)
+        if start_time:
+            first_row = int(np.searchsorted(self.row_start, float(start_time), side='left'))
+        if end_time:
+            last_row = max(first_row, int(np.searchsorted(self.row_end, float(end_time), side='right')))
+        return int(self.word_rows[first_row]), int(self.word_rows[last_row])
+
+    def gap_range(self, first, last):
+        # [first, last) indices into the pause sums of the gaps between words [first, last). a range
+        # after the last word has none
+        gap_last = min(max(first, last - 1), len(self.pause_counts) - 1)
+        return min(first, gap_last), gap_last
+
+    def frame_range(self, start_time, end_time):
+        # [first, last) drift csv rows inside the selection
+        first = 0
+        last = len(self.drift_rows)
+        if start_time:
+            first = int(np.searchsorted(self.frame_time, float(start_time), side='left'))
+        if end_time:
+            last = max(first, int(np.searchsorted(self.frame_time, float(end_time), side='right')))
+        return first, last
+
+    def gentle_words(self, start_time, end_time):
+        if not self.gentle_sorted:
+            return read_gentle_words(self.gentle_rows, start_time, end_time)
+        first, last = self.word_range(start_time, end_time)
+        return self.word_start[first:last].tolist(), self.word_end[first:last].tolist()
+
+    def drift_pitch(self, start_time, end_time):
+        rows = self.drift_rows
+        if self.drift_sorted:
+            first, last = self.frame_range(start_time, end_time)
+            rows = rows[first:last]
+        return read_drift_pitch(rows, start_time, end_time)
+
+    def additive_measures(self, start_time, end_time):
+        # Same values and labels as measure_gentle_drift, for the measures that are sums or counts
+        if not (self.gentle_sorted and self.drift_sorted):
+            return None
+
+        results = {}
+
+        first, last = self.word_range(start_time, end_time)
+        gap_first, gap_last = self.gap_range(first, last)
+
+        def total(cum):
+            return cum[gap_last] - cum[gap_first]
+
+        selection_duration = end_time - start_time
+        if selection_duration == 0:
+            WPM = 0
+        else:
+            WPM = math.floor((last - first) / (selection_duration / 60))
+        results["WPM"] = WPM
+
+        pause_count = int(total(self.pause_counts))
+        results["Gentle_Pause_Count_>100ms"] = pause_count
+        for label in self.pause_counts_over:
+            results[label] = int(total(self.pause_counts_over[label]))
+        results["Gentle_Long_Pause_Count_>3000ms"] = int(total(self.long_pause_counts))
+
+        if pause_count == 0:
+            APL = 0
+        else:
+            APL = decimal.Decimal(float(np.cumsum(self.pause_gaps[gap_first:gap_last])[-1]) / pause_count)
+        results["Gentle_Mean_Pause_Duration_(sec)"] = float(round(APL, 2))
+
+        if selection_duration != 0:
+            APR = decimal.Decimal(pause_count / selection_duration)
+        else:
+            APR = 0
+        results["Gentle_Pause_Rate_(pause/sec)"] = float(round(APR, 3))
+
+        # the first row of the selection is always skipped, see read_drift_pitch
+        first, last = self.frame_range(start_time, end_time)
+        first = min(first + 1, last)
+        voiced_count = int(self.voiced_counts[last] - self.voiced_counts[first])
+        f0mean = 0
+        if voiced_count != 0:
+            f0mean = math.pow(2, float(self.log_pitch_sums[last] - self.log_pitch_sums[first]) / voiced_count)
+        results["Drift_f0_Mean_(hz)"] = f0mean
+
+        return results
+
+def measure_gentle_drift_indexed(index, start_time, end_time):
+    # measure_gentle_drift over a GentleDriftIndex instead of the csv files
+    entered = time.time()
+
+    results = index.additive_measures(start_time, end_time)
+    if results is None:
+        # unsorted csv, replay the rows through the regular code
+        return measure_gentle_drift_rows(index.gentle_rows, index.drift_rows, start_time, end_time)
+
+    f0mean = results.pop("Drift_f0_Mean_(hz)")
+
+    gentle_start, gentle_end = index.gentle_words(start_time, end_time)
+    CP = gentle_pause_complexity(gentle_start, gentle_end)
+    results["Gentle_Complexity_All_Pauses"] = CP * 100
+
+    results["Drift_f0_Mean_(hz)"] = f0mean
+    drift_time, drift_pitch, ixtmp = index.drift_pitch(start_time, end_time)
+    drift_pitch_measures(results, drift_time, drift_pitch, ixtmp, f0mean)
+
+    print(f'SYSTEM: Finished calculating indexed Drift and Gentle measurements (took {time.time() - entered:.2f}s)')
+
+    return results
+
+def is_sorted(arr):
+    return bool(np.all(arr[1:] >= arr[:-1]))
+
+def cumulative(arr):
+    return np.concatenate(([0], np.cumsum(arr)))
+
 # make sure sound file is the original sampling rate if it has been converted
-def measure_voxit(soundfile, sacctxt, harvesttxt, start_time, end_time):
+def measure_voxit(soundfile, sacctxt, harvesttxt, start_time, end_time, check=lambda: None):
+    # check() is called between steps, and raises to stop early (see cancellation.py)
 
     entered = time.time()
     
@@ -363,45 +560,65 @@ def measure_voxit(soundfile, sacctxt, harvesttxt, start_time, end_time):
     print(f'SYSTEM: Librosa took {time.time() - lb_start}s')
 
     # load tsacc and psacc from sacctxt
-    tsacc = []
-    psacc = []
-    for line in sacctxt:
-        data = line.split()
-        if start_time and float(data[0]) < round(start_time * 10000) / 10000:
-            continue
-        if end_time and float(data[0]) > round(end_time * 10000) / 10000:
-            continue
-        tsacc.append(float(data[0]))
-        # TODO filter out 60 and 50 Hz
-        psacc.append(float(data[1]))
-    tsacc = np.array(tsacc)
-    psacc = np.array(psacc)
+    # TODO filter out 60 and 50 Hz
+    tsacc, psacc = read_track(sacctxt, start_time, end_time)
     
     # load timeaxis and f0 from harvesttxt
-    timeaxis = []
-    f0 = []
-    fullf0 = []
-    for line in harvesttxt:
+    timeaxis, f0 = read_track(harvesttxt, start_time, end_time)
+
+    results = measure_voxit_arrays(x, fs, tsacc, psacc, timeaxis, f0, start_time, check)
+
+    # Output message
+    print(f'SYSTEM: Finished calculating Voxit measurements (took {time.time() - entered:.2f}s)')
+
+    return results
+
+def read_track(lines, start_time, end_time):
+    # "time value" lines of a SAcC or Harvest pitch file, within the selection
+    times = []
+    values = []
+    for line in lines:
         data = line.split()
         if start_time and float(data[0]) < round(start_time * 10000) / 10000:
             continue
         if end_time and float(data[0]) > round(end_time * 10000) / 10000:
             continue
-        timeaxis.append(float(data[0]))
-        f0.append(float(data[1]))
-    timeaxis = np.array(timeaxis)
-    f0 = np.array(f0)
+        times.append(float(data[0]))
+        values.append(float(data[1]))
+    return np.array(times), np.array(values)
+
+def track_window(times, values, start_time, end_time):
+    # same selection as read_track, on an already loaded (time-sorted) track
+    first = 0
+    last = len(times)
+    if start_time:
+        first = int(np.searchsorted(times, round(start_time * 10000) / 10000, side='left'))
+    if end_time:
+        last = max(first, int(np.searchsorted(times, round(end_time * 10000) / 10000, side='right')))
+    return times[first:last], values[first:last]
+
+def audio_window(x, fs, start_time, end_time):
+    # same samples librosa.load(offset=start_time, duration=...) reads, from an already decoded file
+    first = int(start_time * fs)
+    if end_time > start_time:
+        return x[first:first + int((end_time - start_time) * fs)]
+    return x[first:]
+
+# x, fs: audio of the selection only. tsacc/psacc, timeaxis/f0: SAcC and Harvest tracks of the selection
+def measure_voxit_arrays(x, fs, tsacc, psacc, timeaxis, f0, start_time, check=lambda: None):
 
     results = {}
 
     ## start calculations
 
+    check()
     ct_start = time.time()
 
     # this is the bottleneck of voxit calculations, but there's nothing we can do about it (?)
     sp = pyworld.cheaptrick(x.astype(np.float64), f0, timeaxis - start_time, fs)
 
     print(f'SYSTEM: Cheaptrick took {time.time() - ct_start:.2f}s')
+    check()
     
     linPower = np.sum(np.divide(sp, np.max(sp)), axis=1)
     logPower = 10 * np.log10(linPower)
@@ -511,9 +728,6 @@ def measure_voxit(soundfile, sacctxt, harvesttxt, start_time, end_time):
     results["Intensity_Mean_Abs_Accel_(decibels/sec^2)"] = 0 if len(Ivelocity) is 0 else np.mean(np.abs(Iaccel))
     results["Intensity_Segment_Range_95_Percent_(decibels)"] = 0 if len(IsegmentMeans) is 0 else np.quantile(IsegmentMeans, .975) - np.quantile(IsegmentMeans, .025)
 
-    # Output message
-    print(f'SYSTEM: Finished calculating Voxit measurements (took {time.time() - entered:.2f}s)')
-
     return results
 
 def get_transcript_start_end(gentlecsv):
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# Long-lived SAcC worker for saccpool.py. Builds the SAcC model once, the way SAcC.py's main does,
+# then tracks pitch for every "<wav path>\t<output path>" line on stdin, answering "ok" or
+# "error <message>" on a line of its own. Runs under python2, like SAcC itself.
+#
+# usage: python sacc_worker.py <directory of SAcC.py>
+
+from __future__ import print_function
+
+import os
+import sys
+import traceback
+
+import numpy as np
+
+
+def reply(out, msg):
+    out.write(msg + "\n")
+    out.flush()
+
+
+def main(argv):
+    sacc_dir = os.path.abspath(argv[1])
+    sys.path.insert(0, sacc_dir)
+
+    # anything SAcC prints goes to stderr, so it can't be taken for a reply
+    replies = sys.stdout
+    sys.stdout = sys.stderr
+
+    import SAcC
+
+    config = SAcC.default_config()
+    # model files named relative to SAcC's directory, for when we're started from elsewhere
+    for key, val in config.items():
+        if isinstance(val, str) and not os.path.exists(val) and os.path.exists(os.path.join(sacc_dir, val)):
+            config[key] = os.path.join(sacc_dir, val)
+    extractor = SAcC.SAcC(config)
+
+    reply(replies, "ready")
+
+    for line in iter(sys.stdin.readline, ""):
+        line = line.rstrip("\n")
+        if not line:
+            continue
+        try:
+            inwavfile, outptfile = line.split("\t")
+            features = extractor(inwavfile)
+            np.savetxt(outptfile, features, fmt="%.3f", delimiter=" ", newline="\n")
+            reply(replies, "ok")
+        except Exception:
+            reply(replies, "error " + traceback.format_exc().replace("\n", " | "))
+
+
+if __name__ == "__main__":
+    main(sys.argv)
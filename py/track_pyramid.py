@@ -0,0 +1,78 @@
+# Min/max/mean pyramids of Drift's 100 frames per second tracks (rms, pitch), so any time range
+# can be drawn from a few hundred buckets instead of the whole track.
+# Level k has one bucket per 2**k frames. Buckets with nothing in them are nan.
+
+import math
+
+import numpy as np
+
+FRAME_RATE = 100
+
+
+def build(values, ignore_zeros=False):
+    # ignore_zeros: leave unvoiced (0 Hz) pitch frames out of every statistic
+    values = np.asarray(values, dtype=float)
+    valid = values != 0 if ignore_zeros else np.ones(len(values), dtype=bool)
+
+    mins = np.where(valid, values, np.inf)
+    maxs = np.where(valid, values, -np.inf)
+    sums = np.where(valid, values, 0.0)
+    counts = valid.astype(np.int64)
+
+    levels = [finish(mins, maxs, sums, counts)]
+    while len(mins) > 1:
+        if len(mins) % 2:
+            mins = np.append(mins, np.inf)
+            maxs = np.append(maxs, -np.inf)
+            sums = np.append(sums, 0.0)
+            counts = np.append(counts, 0)
+        mins = np.minimum(mins[0::2], mins[1::2])
+        maxs = np.maximum(maxs[0::2], maxs[1::2])
+        sums = sums[0::2] + sums[1::2]
+        counts = counts[0::2] + counts[1::2]
+        levels.append(finish(mins, maxs, sums, counts))
+
+    return levels
+
+
+def finish(mins, maxs, sums, counts):
+    empty = counts == 0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        means = sums / counts
+    return {
+        "min": np.where(empty, np.nan, mins).astype(np.float32),
+        "max": np.where(empty, np.nan, maxs).astype(np.float32),
+        "mean": np.where(empty, np.nan, means).astype(np.float32),
+    }
+
+
+def save(levels, fh):
+    np.savez(fh, **{f"{stat}{k}": level[stat] for k, level in enumerate(levels) for stat in level})
+
+
+def load(path):
+    with np.load(path) as arrs:
+        return [
+            {stat: arrs[f"{stat}{k}"] for stat in ["min", "max", "mean"]}
+            for k in range(len(arrs.files) // 3)
+        ]
+
+
+def query(levels, start_time, end_time, resolution):
+    # the finest level giving at most `resolution` buckets between start_time and end_time
+    frames = max(1.0, (end_time - start_time) * FRAME_RATE)
+    level = max(0, math.ceil(math.log2(frames / max(1, resolution))))
+    level = min(level, len(levels) - 1)
+    size = 2 ** level
+
+    first = max(0, int(start_time * FRAME_RATE) // size)
+    last = min(len(levels[level]["mean"]), math.ceil(end_time * FRAME_RATE / size))
+    last = max(first, last)
+
+    ret = {
+        "start_time": first * size / FRAME_RATE,
+        "step": size / FRAME_RATE,
+    }
+    for stat in ["min", "max", "mean"]:
+        ret[stat] = [None if math.isnan(X) else round(X, 5) for X in levels[level][stat][first:last].tolist()]
+    return ret
@@ -0,0 +1,252 @@
+# Voxit measures over many windows of one recording, optionally spread over worker processes.
+# The recording is decoded and its SAcC and Harvest tracks parsed once, into shared memory, so every
+# worker reads the same arrays instead of each loading and parsing its own copy per window.
+#
+# Scaling report: python3 -m py.voxit_windows recording.wav sacc.txt harvest.txt -w 10
+#
+# Loading once is the measured saving: on one core, 3 minutes of audio in 10s windows went from
+# 3.9s to 2.3-2.8s. Whether more than one process helps hasn't been measured, so run the report on
+# the machine before raising serve.py's -p.
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+import librosa
+import numpy as np
+import soundfile as sf
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import resource_tracker, shared_memory
+
+from py import prosodic_measures
+
+# frames decoded at a time when decoding into shared memory
+DECODE_BLOCK = 1 << 16
+
+
+def load_tracks(soundfile, sacctxt, harvesttxt, duration=None):
+    # bug where librosa can't load mp3's without supplying a duration, so callers pass one in (see pipeline._harvest)
+    x, fs = librosa.load(soundfile, sr=None, duration=duration)
+    tsacc, psacc = prosodic_measures.read_track(sacctxt, None, None)
+    timeaxis, f0 = prosodic_measures.read_track(harvesttxt, None, None)
+
+    return fs, {"x": x, "tsacc": tsacc, "psacc": psacc, "timeaxis": timeaxis, "f0": f0}
+
+
+def load_shared_tracks(soundfile, sacctxt, harvesttxt, duration=None):
+    # load_tracks, but into shared memory. the audio is decoded a block at a time straight into its
+    # shared block, at its own rate like load_tracks, so the whole recording is never held twice
+    shared = SharedTracks()
+    try:
+        fs = decode_into(shared, soundfile, duration)
+        tsacc, psacc = prosodic_measures.read_track(sacctxt, None, None)
+        shared.put("tsacc", tsacc)
+        shared.put("psacc", psacc)
+        timeaxis, f0 = prosodic_measures.read_track(harvesttxt, None, None)
+        shared.put("timeaxis", timeaxis)
+        shared.put("f0", f0)
+    except BaseException:
+        shared.close()
+        raise
+    return fs, shared
+
+
+def decode_into(shared, soundfile, duration=None):
+    # the same samples librosa.load(sr=None, duration=duration) gives, as shared track "x"
+    try:
+        fh = sf.SoundFile(soundfile)
+    except RuntimeError:
+        # a format only librosa's audioread fallback decodes, copied in whole
+        x, fs = librosa.load(soundfile, sr=None, duration=duration)
+        shared.put("x", x)
+        return fs
+
+    with fh:
+        frames = fh.frames
+        if duration is not None:
+            frames = min(frames, int(duration * fh.samplerate))
+        x = shared.new("x", frames, np.float32)
+        done = 0
+        while done < frames:
+            block = fh.read(frames=min(DECODE_BLOCK, frames - done), dtype="float32", always_2d=True)
+            if len(block) == 0:
+                break
+            # down to mono like librosa, by averaging the channels
+            x[done:done + len(block)] = block.mean(axis=1)
+            done += len(block)
+        # headers can promise more frames than there are
+        shared.shrink("x", done)
+        return fh.samplerate
+
+
+def measure_window(fs, tracks, start_time, end_time):
+    # same measures as prosodic_measures.measure_voxit on the files, but slicing the loaded tracks
+    x = prosodic_measures.audio_window(tracks["x"], fs, start_time, end_time)
+    tsacc, psacc = prosodic_measures.track_window(tracks["tsacc"], tracks["psacc"], start_time, end_time)
+    timeaxis, f0 = prosodic_measures.track_window(tracks["timeaxis"], tracks["f0"], start_time, end_time)
+
+    return prosodic_measures.measure_voxit_arrays(x, fs, tsacc, psacc, timeaxis, f0, start_time)
+
+
+class SharedTracks:
+    # tracks in shared memory blocks, which workers attach to by name
+    def __init__(self):
+        self.blocks = []
+        self.spec = {}
+
+    def new(self, name, length, dtype):
+        # an empty track, to be filled in place through the returned array
+        dtype = np.dtype(dtype)
+        shm = shared_memory.SharedMemory(create=True, size=max(1, length * dtype.itemsize))
+        self.blocks.append(shm)
+        self.spec[name] = (shm.name, (length,), dtype.str)
+        return np.ndarray((length,), dtype=dtype, buffer=shm.buf)
+
+    def put(self, name, arr):
+        self.new(name, len(arr), arr.dtype)[...] = arr
+
+    def shrink(self, name, length):
+        # workers only see the first length values
+        shm_name, _shape, dtype = self.spec[name]
+        self.spec[name] = (shm_name, (length,), dtype)
+
+    def close(self):
+        for shm in self.blocks:
+            shm.close()
+            shm.unlink()
+        self.blocks = []
+
+
+class WindowPool:
+    # worker processes kept for as long as the server runs. they are forked once, when the server
+    # starts and before it has other threads, since a fork of a multithreaded process can copy a lock
+    # some other thread held. the recording's tracks are passed to them with each window
+    def __init__(self, processes):
+        self.processes = processes
+        self.broken = False
+        # fork where we can: serve.py runs the server at import, so a spawned worker re-importing it would start another one
+        mp_context = multiprocessing.get_context("fork") if "fork" in multiprocessing.get_all_start_methods() else None
+        # started ahead of the workers, so they share it instead of each starting their own
+        resource_tracker.ensure_running()
+        self.executor = ProcessPoolExecutor(max_workers=processes, mp_context=mp_context)
+        # workers are only started by the first job, so give them one now
+        concurrent.futures.wait([self.executor.submit(os.getpid) for _ in range(processes)])
+
+
+# per worker process: the shared blocks of the last recording it measured, and arrays viewing them
+_worker_spec = None
+_worker_blocks = []
+_worker_tracks = {}
+
+
+def attach(spec):
+    global _worker_spec, _worker_blocks
+    if spec == _worker_spec:
+        return
+
+    _worker_tracks.clear()
+    for shm in _worker_blocks:
+        shm.close()
+    _worker_blocks = []
+    for name, (shm_name, shape, dtype) in spec.items():
+        # workers share the parent's resource tracker, which unlinks the blocks if the parent dies
+        shm = shared_memory.SharedMemory(name=shm_name)
+        _worker_blocks.append(shm)
+        _worker_tracks[name] = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+    _worker_spec = spec
+
+
+def worker_measure_window(fs, spec, window):
+    attach(spec)
+    return window, measure_window(fs, _worker_tracks, window[0], window[1])
+
+
+def measure_voxit_windows(soundfile, sacctxt, harvesttxt, windows, pool=None, duration=None, check=lambda: None):
+    # returns {(start_time, end_time): voxit measures} for each window, on pool's workers if given a
+    # WindowPool. check() is called after every window, and raises to stop early (see cancellation.py)
+    # windows of different lengths can line up, only compute those once
+    windows = list(dict.fromkeys(windows))
+
+    results = {}
+
+    ld_start = time.time()
+    if pool is None or pool.broken or len(windows) < 2:
+        fs, tracks = load_tracks(soundfile, sacctxt, harvesttxt, duration)
+        print(f'SYSTEM: Loading audio and pitch tracks took {time.time() - ld_start:.2f}s')
+        for window in windows:
+            results[window] = measure_window(fs, tracks, window[0], window[1])
+            check()
+        return results
+
+    fs, shared = load_shared_tracks(soundfile, sacctxt, harvesttxt, duration)
+    print(f'SYSTEM: Loading audio and pitch tracks took {time.time() - ld_start:.2f}s')
+
+    futures = []
+    try:
+        for window in windows:
+            futures.append(pool.executor.submit(worker_measure_window, fs, shared.spec, window))
+        for future in futures:
+            window, voxit_data = future.result()
+            results[window] = voxit_data
+            check()
+    except BrokenProcessPool:
+        # a worker died (e.g. out of memory). starting new ones would mean forking the running
+        # server, so later windows are measured in this process
+        print("SYSTEM: Voxit worker processes died, measuring windows in the server process from now on")
+        pool.broken = True
+        raise
+    finally:
+        # windows not started yet are dropped when we stop early. those running finish before the tracks go
+        for future in futures:
+            future.cancel()
+        concurrent.futures.wait(futures)
+        shared.close()
+
+    return results
+
+
+def scaling_report(soundfile, sacctxt, harvesttxt, window_len, max_processes):
+    sacc = open(sacctxt).readlines()
+    harvest = open(harvesttxt).readlines()
+    audio_len = float(prosodic_measures.read_track(sacc, None, None)[0][-1])
+    windows = [(i, min(i + window_len, audio_len)) for i in range(0, int(audio_len), int(window_len))]
+
+    print(f'{len(windows)} windows of {window_len}s over {audio_len:.0f}s of audio')
+
+    # baseline: what _windowed did before, loading audio and parsing both tracks for every window
+    per_window_start = time.time()
+    for start_time, end_time in windows:
+        prosodic_measures.measure_voxit(soundfile, sacc, harvest, start_time, end_time)
+    per_window = time.time() - per_window_start
+
+    report = [("per-window load", 1, per_window)]
+    processes = 1
+    while processes <= max_processes:
+        pool = WindowPool(processes) if processes > 1 else None
+        pool_start = time.time()
+        measure_voxit_windows(soundfile, sacc, harvest, windows, pool)
+        report.append(("shared", processes, time.time() - pool_start))
+        if pool is not None:
+            pool.executor.shutdown()
+        processes *= 2
+
+    print()
+    print(f'{"mode":<16} {"processes":>9} {"seconds":>9} {"speedup":>8}')
+    for mode, processes, took in report:
+        print(f'{mode:<16} {processes:>9} {took:>9.2f} {per_window / took:>7.2f}x')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="time windowed Voxit measures with 1, 2, 4... worker processes")
+    parser.add_argument("soundfile")
+    parser.add_argument("sacctxt", help="SAcC pitch track, as attached by the pitch step")
+    parser.add_argument("harvesttxt", help="Harvest pitch track, as attached by the harvest step")
+    parser.add_argument("-w", "--window", help="window length in seconds. default: 10", type=float, default=10)
+    parser.add_argument("-p", "--max_processes", help="default: number of cores", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    scaling_report(args.soundfile, args.sacctxt, args.harvesttxt, args.window, args.max_processes)
@@ -0,0 +1,150 @@
+# SAcC worker processes kept running between pitch requests, so each request doesn't pay for a
+# python2 interpreter and SAcC's model loading (see py/py2/sacc_worker.py). Jobs go to an idle
+# worker over its stdin. A worker that dies, hangs or stops making sense is killed and replaced,
+# and the job is tried once more on the new one.
+
+import os
+import queue
+import select
+import subprocess
+import threading
+import time
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "py", "py2", "sacc_worker.py")
+# how long a worker gets to load the model, and to track one recording
+START_TIMEOUT = 120
+JOB_TIMEOUT = 1800
+
+
+class SAcCError(Exception):
+    pass
+
+
+class SAcCJobError(SAcCError):
+    # SAcC failed on the recording. the worker itself is fine
+    pass
+
+
+class SAcCWorker:
+    def __init__(self, python, sacc_dir):
+        try:
+            self.proc = subprocess.Popen(
+                [python, WORKER_SCRIPT, sacc_dir],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+                bufsize=1,
+            )
+        except OSError as e:
+            raise SAcCError(f"SAcC worker didn't start: {e}")
+
+        started = time.time()
+        try:
+            ready = self.read_reply(START_TIMEOUT)
+        except SAcCError:
+            self.kill()
+            raise
+        if ready != "ready":
+            self.kill()
+            raise SAcCError(f"SAcC worker didn't start: {ready}")
+        print(f"SYSTEM: SAcC worker {self.proc.pid} ready (took {time.time() - started:.2f}s)")
+
+    def read_reply(self, timeout):
+        readable, _, _ = select.select([self.proc.stdout], [], [], timeout)
+        if not readable:
+            raise SAcCError(f"SAcC worker {self.proc.pid} timed out")
+        line = self.proc.stdout.readline()
+        if not line:
+            raise SAcCError(f"SAcC worker {self.proc.pid} exited with {self.proc.wait()}")
+        return line.rstrip("\n")
+
+    def run(self, wavpath, outpath):
+        try:
+            self.proc.stdin.write(f"{os.path.abspath(wavpath)}\t{os.path.abspath(outpath)}\n")
+            self.proc.stdin.flush()
+        except (BrokenPipeError, OSError) as e:
+            raise SAcCError(f"SAcC worker {self.proc.pid} is gone: {e}")
+
+        reply = self.read_reply(JOB_TIMEOUT)
+        if reply == "ok":
+            return
+        if reply.startswith("error "):
+            raise SAcCJobError(reply[len("error "):])
+        raise SAcCError(f"SAcC worker {self.proc.pid} said {reply!r}")
+
+    def alive(self):
+        return self.proc.poll() is None
+
+    def kill(self):
+        if self.alive():
+            self.proc.kill()
+        self.proc.wait()
+
+
+class SAcCPool:
+    def __init__(self, size, sacc_dir, python="python"):
+        self.size = size
+        self.sacc_dir = sacc_dir
+        self.python = python
+        self.idle = queue.Queue()
+        self.started = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        # bring every worker up now rather than on the first requests
+        while self.started < self.size:
+            try:
+                self.idle.put(self.spawn())
+            except SAcCError as e:
+                print(f"SYSTEM: {e}")
+                break
+
+    def spawn(self):
+        with self.lock:
+            self.started += 1
+        try:
+            return SAcCWorker(self.python, self.sacc_dir)
+        except Exception:
+            with self.lock:
+                self.started -= 1
+            raise
+
+    def compute(self, wavpath, outpath):
+        # SAcC's pitch track of wavpath written to outpath, like running SAcC.py wavpath outpath
+        worker = self.checkout()
+        for attempt in range(2):
+            try:
+                worker.run(wavpath, outpath)
+                break
+            except SAcCJobError:
+                self.idle.put(worker)
+                raise
+            except SAcCError as e:
+                print(f"SYSTEM: {e}, replacing it")
+                worker.kill()
+                with self.lock:
+                    self.started -= 1
+                if attempt:
+                    raise
+                worker = self.spawn()
+        self.idle.put(worker)
+
+    def checkout(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self.lock:
+            grow = self.started < self.size
+        if grow:
+            return self.spawn()
+        return self.idle.get()
+
+    def close(self):
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.kill()
@@ -1,9 +1,28 @@
 
 from guts import Root
 
-from twisted.web import server, static, resource
+from twisted.web import server, static, resource, http
 from twisted.internet import reactor, ssl
 
+import gzip
+import os
+import queue
+import threading
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# attachments worth compressing (align/rms json, pitch txt, csv). audio is already compressed
+COMPRESSIBLE = [".json", ".txt", ".csv"]
+
+# (suffix, content-encoding, compress) in order of preference. brotli's top qualities are many
+# times slower for a few percent smaller
+ENCODINGS = [(".gz", "gzip", lambda data: gzip.compress(data, 9, mtime=0))]
+if brotli is not None:
+    ENCODINGS.insert(0, (".br", "br", lambda data: brotli.compress(data, quality=5)))
+
 class FolderlessFile(static.File):
     def render(self, req):
         req.setHeader('Access-Control-Allow-Origin', '*')
@@ -23,6 +42,96 @@ class FolderlessFile(static.File):
     def directoryListing(self):
         return resource.NoResource()
 
+def precompress(path):
+    # write compressed copies next to an attachment, e.g. <hash>.json.gz, for MediaFile to serve
+    if os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+        return
+
+    data = None
+    for suffix, _encoding, compress in ENCODINGS:
+        if os.path.exists(path + suffix):
+            continue
+        if data is None:
+            with open(path, "rb") as fh:
+                data = fh.read()
+        packed = compress(data)
+        if len(packed) >= len(data):
+            continue
+        # write then rename, so a half-written copy is never served
+        with open(path + suffix + ".tmp", "wb") as fh:
+            fh.write(packed)
+        os.replace(path + suffix + ".tmp", path + suffix)
+
+# attachments are compressed the first time they're asked for, so those never fetched through
+# /media (e.g. the windowed json, replaced whenever its params change) never are. one thread of
+# its own does it, one file at a time: requests don't wait for it, and it takes at most one core
+pending = queue.Queue()
+# paths already handed to the thread. only used from the reactor thread
+queued = set()
+
+def precompressor():
+    while True:
+        path = pending.get()
+        try:
+            precompress(path)
+        except OSError:
+            # served uncompressed
+            pass
+
+def precompress_later(path):
+    if path in queued or os.path.splitext(path)[1].lower() not in COMPRESSIBLE:
+        return
+    if not queued:
+        threading.Thread(target=precompressor, daemon=True).start()
+    queued.add(path)
+    pending.put(path)
+
+def accepted_encodings(req):
+    # content-codings from Accept-Encoding, leaving out those refused with q=0
+    accepted = set()
+    for part in (req.getHeader("accept-encoding") or "").split(","):
+        coding, *params = [X.strip() for X in part.split(";")]
+        quality = 1.0
+        for param in params:
+            key, _, val = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    quality = float(val)
+                except ValueError:
+                    pass
+        if coding and quality > 0:
+            accepted.add(coding.lower())
+    return accepted
+
+class MediaFile(FolderlessFile):
+    # attachments are named by the hash of their content and never change, so they can be cached
+    # forever and validated by name alone. compressed copies from precompress are served when
+    # accepted, once they've been made
+    def render_GET(self, req):
+        if not self.isfile():
+            return super().render_GET(req)
+
+        req.setHeader(b"cache-control", b"public, max-age=31536000, immutable")
+        req.setHeader(b"vary", b"accept-encoding")
+
+        name = os.path.splitext(self.basename())[0]
+        accepted = accepted_encodings(req)
+        if any(encoding in accepted and not os.path.exists(self.path + suffix) for suffix, encoding, _compress in ENCODINGS):
+            precompress_later(self.path)
+        for suffix, encoding, _compress in ENCODINGS:
+            if encoding in accepted and os.path.exists(self.path + suffix):
+                if req.setETag(f'"{name}-{encoding}"'.encode()) == http.CACHED:
+                    return b""
+                encoded = static.File(self.path + suffix)
+                # the type of the original, not of .gz/.br
+                encoded.type, _ = static.getTypeAndEncoding(self.basename(), self.contentTypes, self.contentEncodings, self.defaultType)
+                encoded.encoding = encoding
+                return encoded.render_GET(req)
+
+        if req.setETag(f'"{name}"'.encode()) == http.CACHED:
+            return b""
+        return super().render_GET(req)
+
 class FolderlessRoot(Root):
     def __init__(self, port=8000, interface='0.0.0.0', dirpath='.'):
         super().__init__(port, interface, dirpath)
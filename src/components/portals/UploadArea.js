@@ -1,12 +1,12 @@
 import React, { useContext, useEffect } from 'react';
 import { createPortal } from 'react-dom';
 import { GutsContext } from 'context/GutsContext';
-import { postCreateDoc, postTriggerHarvestCreation, postTriggerPitchCreation, postTriggerRMSCreation, postUpdateDoc } from 'utils/Queries';
+import { postCreateDoc, postTriggerHarvestCreation, postTriggerPitchCreation, postTriggerRMSCreation, postUpdateDoc, uploadFileChunked } from 'utils/Queries';
 
 function UploadArea() {
 
     const { 
-        pushNewDoc, attachPutFile, updateDoc, calcIntense 
+        pushNewDoc, updateDoc, calcIntense 
     } = useContext(GutsContext);
 
     const handleFiles = files => {
@@ -23,10 +23,14 @@ function UploadArea() {
     
                     pushNewDoc(createResponse, { opened: true });
 
-                    let putResponse = await attachPutFile(file, progress => {
-                        updateDoc(createResponse.id, {
-                            upload_status: progress / createResponse.size,
-                        })
+                    let putResponse = await uploadFileChunked({
+                        file,
+                        docid: createResponse.id,
+                        onProgress: progress => {
+                            updateDoc(createResponse.id, {
+                                upload_status: progress / createResponse.size,
+                            })
+                        },
                     });
 
                     let updateResponse = await postUpdateDoc({ 
@@ -5,13 +5,23 @@ module.exports = function(app) {
     // normal routes
     [
         "/_settings",
+        "/_gentle_backends",
+        "/_admission",
         "/_measure",
+        "/_measure_additive",
         "/_measure_all",
         "/_windowed",
+        "/_cancel",
+        "/_export",
+        "/_trace",
+        "/_corpus_query",
+        "/_corpus_labels",
+        "/_corpus_stats",
         "/_rec/**",
         "/media/**",
         "/_pitch",
         "/_rms",
+        "/_track_range",
         "/_harvest",
         "/_align",
         "/_csv",
@@ -24,6 +34,7 @@ module.exports = function(app) {
     [
         "/_db",
         "/_attach",
+        "/_upload",
     ].forEach(path => app.use(createProxyMiddleware(path, { 
         target: `http://localhost:${ process.env.REACT_APP_DRIFT_PORT }`,
         ws: true,
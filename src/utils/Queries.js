@@ -16,6 +16,11 @@ async function postSettings({ calcIntense, gentlePort }) {
     return res.data;
 };
 
+async function getGentleBackends() {
+    const res = await axios.get(`/_gentle_backends`);
+    return res.data;
+};
+
 function getGentle({ gentlePort }) {
     return fetch(`//localhost:${ gentlePort }`, { mode: 'no-cors' });
 }
@@ -41,9 +46,32 @@ async function getRMS(rmsURL) {
     return res.data;
 }
 
+// min/max/mean of the 'rms' or 'pitch' track over a time range, in at most `resolution` buckets of `step` seconds
+async function getTrackRange(docid, track, startTime, endTime, resolution) {
+    const res = await axios.get(`/_track_range?id=${docid}&track=${track}&start_time=${startTime}&end_time=${endTime}&resolution=${resolution}`);
+    return res.data;
+}
+
+// the request of the selection being measured in each document, aborted when that document's selection changes again
+const measureSelectionControllers = {};
+
 async function getMeasureSelection(docid, startTime, endTime) {
-    const res = await axios.get(`/_measure?id=${docid}&start_time=${startTime}&end_time=${endTime}`);
-    return res.data.measure;
+    if (measureSelectionControllers[docid])
+        measureSelectionControllers[docid].abort();
+    const controller = new AbortController();
+    measureSelectionControllers[docid] = controller;
+
+    // the server also drops any older selection of this document still being measured
+    try {
+        const res = await axios.get(
+            `/_measure?id=${docid}&start_time=${startTime}&end_time=${endTime}&cancel_token=measure-${docid}`,
+            { signal: controller.signal }
+        );
+        return res.data.measure;
+    } finally {
+        if (measureSelectionControllers[docid] === controller)
+            delete measureSelectionControllers[docid];
+    }
 }
 
 async function getMeasureFullTS(docid, forceGen) {
@@ -53,11 +81,105 @@ async function getMeasureFullTS(docid, forceGen) {
     return res.data.measure;
 }
 
+// link to a zip of the documents' pitch, rms, words and measures, every aligned document without ids.
+// format: "csv", "npz" or, if the server has pyarrow, "parquet"
+function getExportUrl({ ids, format }) {
+    const params = new URLSearchParams({ format: format || "csv" });
+    if (ids && ids.length)
+        params.set("ids", ids.join(","));
+    return `/_export?${params}`;
+}
+
+// link to the document's processing timeline, a Chrome trace for chrome://tracing or ui.perfetto.dev
+function getTraceUrl(docid) {
+    return `/_trace?id=${encodeURIComponent(docid)}`;
+}
+
+// filters: [[label, operator, value], ...] e.g. [["WPM", ">", 150]]
+async function postCorpusQuery({ filters, order_by, descending, limit, labels }) {
+    const res = await axios.post(`/_corpus_query`, { filters, order_by, descending, limit, labels });
+    return res.data;
+}
+
+async function getCorpusLabels() {
+    const res = await axios.get(`/_corpus_labels`);
+    return res.data.labels;
+}
+
+// { label: { count, mean, variance, std, quantiles: { "0.05", "0.5", "0.95" } } }
+async function getCorpusStats(labels) {
+    const res = await axios.get(`/_corpus_stats`, { params: labels ? { labels: labels.join(",") } : {} });
+    return res.data.stats;
+}
+
 async function postDeleteDoc(docid) {
     const res = await axios.post(`/_rec/_remove`, { id: docid });
     return res.data;
 }
 
+// big recordings go up in chunks (see chunkupload.py), resuming where they left off after a dropped
+// connection or a page reload. resolves to { path } like guts' attach
+const UPLOAD_CHUNK = 8 * 1024 * 1024;
+const UPLOAD_RETRIES = 8;
+
+async function chunkSha1(chunk) {
+    // crypto.subtle is only there on https and localhost, the server takes chunks without a hash too
+    if (!window.crypto || !window.crypto.subtle) return undefined;
+    const digest = await window.crypto.subtle.digest('SHA-1', await chunk.arrayBuffer());
+    return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+}
+
+async function uploadFileChunked({ file, docid, onProgress }) {
+    const resumeKey = `upload:${ docid }:${ file.name }:${ file.size }:${ file.lastModified }`;
+
+    let upload = localStorage.getItem(resumeKey);
+    let offset = 0;
+    if (upload) {
+        try {
+            offset = (await axios.get(`/_upload/${ upload }`)).data.offset;
+        } catch (e) {
+            upload = null;
+        }
+    }
+    if (!upload) {
+        const res = await axios.post(`/_upload`, { name: file.name, size: file.size, id: docid });
+        upload = res.data.upload;
+        localStorage.setItem(resumeKey, upload);
+    }
+
+    let failures = 0;
+    while (true) {
+        const chunk = file.slice(offset, offset + UPLOAD_CHUNK);
+        const headers = { 'Upload-Offset': offset, 'Content-Type': 'application/octet-stream' };
+        const sha1 = await chunkSha1(chunk);
+        if (sha1) headers['Chunk-Sha1'] = sha1;
+
+        try {
+            const res = await axios.put(`/_upload/${ upload }`, chunk, {
+                headers,
+                onUploadProgress: ev => onProgress && onProgress(offset + ev.loaded),
+            });
+            offset = res.data.offset;
+            failures = 0;
+
+            if (res.data.path) {
+                localStorage.removeItem(resumeKey);
+                return { path: res.data.path };
+            }
+        } catch (e) {
+            if (e.response && e.response.data && e.response.data.offset !== undefined) {
+                // the server tells us where to go on from
+                offset = e.response.data.offset;
+            } else if (e.response && e.response.status === 404) {
+                localStorage.removeItem(resumeKey);
+                throw e;
+            }
+            if (++failures > UPLOAD_RETRIES) throw e;
+            await new Promise(resolve => setTimeout(resolve, 1000 * Math.min(30, 2 ** failures)));
+        }
+    }
+}
+
 async function postCreateDoc({ title, size, date }) {
     const res = await axios.post(`/_rec/_create`, { title, size, date });
     return res.data;
@@ -102,7 +224,13 @@ async function postTriggerMatCreation(docid) {
 }
 
 async function postGetWindowedData({ id, params }) {
-    const res = await axios.post(`/_windowed`, { id, params });
+    // a newer windowed request for the document replaces this one on the server
+    const res = await axios.post(`/_windowed`, { id, params, cancel_token: `windowed-${id}` });
+    return res.data;
+}
+
+async function postCancel(cancelToken) {
+    const res = await axios.post(`/_cancel`, { cancel_token: cancelToken });
     return res.data;
 }
 
@@ -111,13 +239,21 @@ export {
     getSettings,
     postSettings,
     getGentle,
+    getGentleBackends,
     getPitch,
     getAlign,
     getRMS,
+    getTrackRange,
     getMeasureSelection,
     getMeasureFullTS,
+    getExportUrl,
+    getTraceUrl,
+    postCorpusQuery,
+    getCorpusLabels,
+    getCorpusStats,
     postDeleteDoc,
     postCreateDoc,
+    uploadFileChunked,
     postUpdateDoc,
     postTriggerPitchCreation,
     postTriggerRMSCreation,
@@ -126,4 +262,5 @@ export {
     postTriggerCSVCreation,
     postTriggerMatCreation,
     postGetWindowedData,
+    postCancel,
 };
@@ -1,3 +1,4 @@
+import axios from "axios";
 import { getAlign, getPitch, getRMS, postGetWindowedData } from "./Queries";
 
 /* ======== constants ========= */
@@ -264,10 +265,22 @@ async function downloadWindowedData({ filenameBase, id, fullTSProsMeasuresReady,
         process.env.REACT_APP_BUILD === "bundle" ? ' or change settings' : ''
     }!`, 4000);
 
-    const { measure: measureJSON } = await postGetWindowedData({
-        id: id,
-        params: WINDOWED_PARAMS,
-    });
+    let res;
+    try {
+        res = await postGetWindowedData({
+            id: id,
+            params: WINDOWED_PARAMS,
+        });
+    } catch (err) {
+        // aborted, or turned away by the server (e.g. busy when hosted), there's nothing to save
+        if (axios.isCancel(err) || err.response)
+            return;
+        throw err;
+    }
+    // the server answers { error, cancelled } when a newer request for the document replaced this one
+    if (!res || res.error || !res.measure)
+        return;
+    const measureJSON = res.measure;
 
     let maxSegments = -1;
 
@@ -0,0 +1,27 @@
+import os
+import sys
+import threading
+import types
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# pytest installs a py.py shim of the old pylib, which takes the name ahead of Drift's py/ directory
+# (a namespace package). point the name back at the directory
+if getattr(sys.modules.get("py"), "__path__", None) != [os.path.join(ROOT, "py")]:
+    py = types.ModuleType("py")
+    py.__path__ = [os.path.join(ROOT, "py")]
+    sys.modules["py"] = py
+
+
+@pytest.fixture(scope="session")
+def running_reactor():
+    # the twisted reactor, running on its own thread for the whole session as it can't be restarted
+    from twisted.internet import reactor
+    thread = threading.Thread(target=reactor.run, kwargs={"installSignalHandlers": False}, daemon=True)
+    thread.start()
+    yield reactor
+    reactor.callFromThread(reactor.stop)
+    thread.join(5)
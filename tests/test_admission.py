@@ -0,0 +1,111 @@
+import http.client
+import json
+import socket
+import threading
+import time
+
+import pytest
+from twisted.internet import threads
+from twisted.internet.address import IPv4Address
+from twisted.web import resource, server
+from twisted.web.test.requesthelper import DummyRequest
+
+import admission
+
+
+class PostJson(resource.Resource):
+    # what guts.PostJson(fn, runasync=True) does: fn(body) on a thread, its result as the answer
+    isLeaf = True
+
+    def __init__(self, fn):
+        super().__init__()
+        self.fn = fn
+
+    def render_POST(self, req):
+        gone = []
+        req.notifyFinish().addErrback(lambda _: gone.append(True))
+
+        def send(result):
+            if not gone:
+                req.write(json.dumps(result).encode())
+                req.finish()
+
+        threads.deferToThread(self.fn, json.loads(req.content.read())).addCallback(send)
+        return server.NOT_DONE_YET
+
+
+@pytest.fixture
+def slow(running_reactor):
+    started = threading.Event()
+    proceed = threading.Event()
+
+    def handler(cmd):
+        started.set()
+        proceed.wait(10)
+        return {"id": cmd["id"]}
+
+    gate = admission.Gate(capacity=1, max_client=1, max_queue=1, max_wait=5)
+    root = resource.Resource()
+    root.putChild(b"_slow", admission.AdmittedResource(PostJson(admission.job(handler)), gate, lambda args: 1))
+    port = threads.blockingCallFromThread(running_reactor, running_reactor.listenTCP, 0, server.Site(root), interface="127.0.0.1")
+    yield gate, port.getHost().port, started, proceed
+    proceed.set()
+    threads.blockingCallFromThread(running_reactor, port.stopListening)
+
+
+def on_reactor(fn):
+    from twisted.internet import reactor
+    return threads.blockingCallFromThread(reactor, fn)
+
+
+def post(port, body):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=10)
+    conn.request("POST", "/_slow", json.dumps(body))
+    res = conn.getresponse()
+    return res.status, res.read()
+
+
+def test_disconnect_keeps_slot_until_handler_returns(slow):
+    gate, port, started, proceed = slow
+
+    # post and hang up while the handler is still running
+    sock = socket.create_connection(("127.0.0.1", port))
+    body = json.dumps({"id": "a"}).encode()
+    sock.sendall(b"POST /_slow HTTP/1.1\r\nHost: x\r\nContent-Length: %d\r\n\r\n%s" % (len(body), body))
+    assert started.wait(5)
+    sock.close()
+    time.sleep(0.3)
+
+    # the job's slots and its client's count are still taken, so hanging up again and again
+    # doesn't get round the limits
+    assert on_reactor(lambda: (gate.used, dict(gate.clients))) == (1, {"127.0.0.1": 1})
+    status, _ = post(port, {"id": "b"})
+    assert status == 429
+
+    proceed.set()
+    for _ in range(50):
+        if on_reactor(lambda: gate.used) == 0:
+            break
+        time.sleep(0.1)
+    assert on_reactor(lambda: (gate.used, dict(gate.clients))) == (0, {})
+    assert post(port, {"id": "c"}) == (200, b'{"id": "c"}')
+    assert admission.jobs == {}
+
+
+def request_from(host, forwarded=None):
+    req = DummyRequest([b""])
+    req.client = IPv4Address("TCP", host, 5000)
+    if forwarded is not None:
+        req.requestHeaders.setRawHeaders(b"x-forwarded-for", [forwarded])
+    return req
+
+
+def test_forwarded_for_only_from_trusted_proxies():
+    # anyone can send the header, it's only believed from a trusted proxy
+    assert admission.client_of(request_from("203.0.113.5", "10.9.9.9")) == "203.0.113.5"
+    assert admission.client_of(request_from("203.0.113.5", "10.9.9.9"), ["127.0.0.1"]) == "203.0.113.5"
+    assert admission.client_of(request_from("127.0.0.1", "198.51.100.7"), ["127.0.0.1"]) == "198.51.100.7"
+    # what the client put in front of the proxy's hop doesn't count
+    assert admission.client_of(request_from("127.0.0.1", "10.9.9.9, 198.51.100.7"), ["127.0.0.1"]) == "198.51.100.7"
+    # through two trusted proxies
+    assert admission.client_of(request_from("127.0.0.1", "198.51.100.7, 10.0.0.2"), ["127.0.0.1", "10.0.0.2"]) == "198.51.100.7"
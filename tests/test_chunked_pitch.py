@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from scipy.io import wavfile
+
+from py import chunked_pitch
+
+FS = 8000
+HOP = FS // chunked_pitch.FRAME_RATE
+# audio on each side of a frame the fake tracker looks at, well inside overlap / 2
+CONTEXT = 3 * HOP
+
+
+def fake_run(wavpath, outpath, drop_last=0):
+    # deterministic stand-in for SAcC: each frame's "f0" and "prob" come from the samples around it,
+    # so a frame only comes out the same in a chunk as in the whole file if it has enough context
+    _fs, samples = wavfile.read(wavpath)
+    samples = samples.astype(float)
+    n_frames = int(np.ceil(len(samples) / HOP)) - drop_last
+    with open(outpath, "w") as fh:
+        for i in range(n_frames):
+            around = samples[max(0, i * HOP - CONTEXT) : i * HOP + CONTEXT]
+            fh.write(f"{i / chunked_pitch.FRAME_RATE:.3f} {np.abs(around).sum():.1f} {around[::7].sum():.1f}\n")
+
+
+@pytest.fixture
+def wav(tmp_path):
+    rng = np.random.default_rng(0)
+    # an odd length, so the last frame is a partial one
+    samples = (rng.standard_normal(FS * 7 + 37) * 3000).astype(np.int16)
+    path = tmp_path / "a.wav"
+    wavfile.write(path, FS, samples)
+    return str(path), len(samples)
+
+
+def read(path):
+    return [line.split() for line in open(path)]
+
+
+@pytest.mark.parametrize("chunks", [1, 2, 3, 5])
+def test_plan_owns_every_frame_once(chunks):
+    n_samples = FS * 7 + 37
+    plan = chunked_pitch.plan_chunks(n_samples, FS, chunks, overlap=0.5)
+    n_frames = int(np.ceil(n_samples / HOP))
+
+    owned = []
+    for start, end, own_start, own_end in plan:
+        own_end = end if own_end is None else own_end
+        assert start <= own_start <= own_end <= end
+        owned.extend(range(own_start, own_end))
+        # frames kept have overlap / 2 of audio on both sides, except at the ends of the recording
+        if own_start > 0:
+            assert own_start - start >= 25
+        if own_end < n_frames:
+            assert end - own_end >= 25
+    assert owned == list(range(n_frames))
+
+
+@pytest.mark.parametrize("chunks", [2, 3, 5])
+def test_chunked_matches_single_pass(wav, tmp_path, chunks):
+    wavpath, _n = wav
+    fake_run(wavpath, tmp_path / "whole.txt")
+    chunked_pitch.track_chunked(wavpath, tmp_path / "chunked.txt", fake_run, chunks, overlap=0.5)
+
+    assert read(tmp_path / "chunked.txt") == read(tmp_path / "whole.txt")
+
+
+def test_short_chunk_track_carries_last_frame(wav, tmp_path):
+    # SAcC can stop a frame before the end of a chunk. with no overlap the chunk's own last frame is
+    # missing, and the merge carries the frame before it on so the track has no gap
+    wavpath, n_samples = wav
+    run = lambda wavpath, outpath: fake_run(wavpath, outpath, drop_last=1)
+    chunked_pitch.track_chunked(wavpath, tmp_path / "chunked.txt", run, 3, overlap=0)
+    rows = read(tmp_path / "chunked.txt")
+
+    n_frames = int(np.ceil(n_samples / HOP))
+    # only the end of the recording comes out a frame short, as it does from a single pass
+    assert [float(X[0]) for X in rows] == [round(i / chunked_pitch.FRAME_RATE, 3) for i in range(n_frames - 1)]
+    for _start, _end, _own_start, own_end in chunked_pitch.plan_chunks(n_samples, FS, 3, 0)[:-1]:
+        assert rows[own_end - 1][1:] == rows[own_end - 2][1:]
+
+
+def test_failed_chunk_leaves_empty_track(wav, tmp_path):
+    wavpath, _n = wav
+    calls = []
+
+    def run(wavpath, outpath):
+        calls.append(wavpath)
+        if len(calls) != 2:
+            fake_run(wavpath, outpath)
+
+    out = tmp_path / "chunked.txt"
+    chunked_pitch.track_chunked(wavpath, out, run, 3, overlap=0.5)
+    assert out.read_text() == ""
@@ -0,0 +1,30 @@
+import numpy as np
+import pytest
+
+pytest.importorskip("lempel_ziv_complexity")
+
+from drift.measure import Measure
+
+
+def segment(*words):
+    return {"start": 0.2, "end": 2.5, "speaker": "A", "wdlist": list(words)}
+
+
+FOUND = {"word": "a", "alignedWord": "a", "case": "success", "start": 0.3, "end": 0.9,
+         "phones": [{"phone": "a_S", "duration": 0.6}]}
+NOT_FOUND = {"word": "b", "case": "not-found-in-audio"}
+
+
+@pytest.mark.parametrize("start_time,end_time", [(None, None), (0.5, 2.0), (0.0, 0.6)])
+def test_words_not_found_in_audio_are_left_out(start_time, end_time):
+    pitch = 120 + 30 * np.sin(np.arange(300) / 7.0)
+    pitch[150:170] = 0
+
+    # a word Gentle couldn't place has no times, and counts for nothing, like it isn't there
+    measure = Measure(pitch, {"segments": [segment(FOUND, NOT_FOUND)]})
+    without = Measure(pitch, {"segments": [segment(FOUND)]})
+
+    assert measure.compute(start_time, end_time) == without.compute(start_time, end_time)
+    additive = measure.compute_additive(start_time, end_time)
+    assert additive == without.compute_additive(start_time, end_time)
+    assert additive["words_per_minute"] > 0
@@ -0,0 +1,208 @@
+import email.parser
+import email.policy
+import http.server
+import io
+import json
+import re
+import subprocess
+import threading
+import uuid
+
+import numpy as np
+import pytest
+import soundfile
+
+import batch
+import gentlepool
+import pipeline
+
+FS = 8000
+LEAD = 5.0
+# word i of the transcript is spoken from LEAD + i * WORD_STEP for WORD_LEN seconds
+WORD_LEN = 0.4
+WORD_STEP = 0.5
+LINES = 40
+WORDS_PER_LINE = 8
+
+
+def spoken(i):
+    start = LEAD + i * WORD_STEP
+    return start, start + WORD_LEN
+
+
+class StubGentle(http.server.ThreadingHTTPServer):
+    # answers like Gentle's /transcriptions API. the recording's samples are their own time in
+    # seconds, so a clip's first sample says where in the recording it was cut from, and a word is
+    # "found" if it's spoken inside the clip
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubGentleHandler)
+        self.jobs = {}
+        self.offsets = []
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def align(self, audio, transcript):
+        samples, fs = soundfile.read(io.BytesIO(audio), dtype="float32")
+        offset = round(float(samples[0]) * fs) / fs
+        duration = len(samples) / fs
+        self.offsets.append(offset)
+
+        words = []
+        for m in re.finditer(r"w(\d+)", transcript):
+            start, end = spoken(int(m.group(1)))
+            wd = {"word": m.group(0), "startOffset": m.start(), "endOffset": m.end()}
+            if offset <= start and end <= offset + duration:
+                wd.update(case="success", alignedWord=m.group(0), start=start - offset, end=end - offset,
+                          phones=[{"phone": "w_B", "duration": WORD_LEN}])
+            else:
+                wd.update(case="not-found-in-audio")
+            words.append(wd)
+        return {"transcript": transcript, "words": words}
+
+
+class StubGentleHandler(http.server.BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def reply(self, body, content_type="application/json"):
+        body = body.encode() if isinstance(body, str) else body
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        form = email.parser.BytesParser(policy=email.policy.default).parsebytes(
+            f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + body)
+        fields = {X.get_param("name", header="content-disposition"): X.get_payload(decode=True) for X in form.iter_parts()}
+
+        uid = uuid.uuid4().hex
+        self.server.jobs[uid] = self.server.align(fields["audio"], fields["transcript"].decode())
+        self.send_response(302)
+        self.send_header("Location", f"/transcriptions/{uid}")
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if len(parts) == 2:
+            return self.reply("<html>aligning</html>", "text/html")
+        job = self.server.jobs[parts[1]]
+        if parts[2] == "status.json":
+            return self.reply(json.dumps({"status": "OK"}))
+        if parts[2] == "align.json":
+            return self.reply(json.dumps(job))
+        rows = [
+            ",".join([X["word"], X.get("alignedWord", ""), str(X.get("start", "")), str(X.get("end", ""))])
+            for X in job["words"]
+        ]
+        return self.reply("\n".join(rows), "text/csv")
+
+
+def fake_ffmpeg(real_call):
+    # cuts -ss .. -to of -i into the output the way ffmpeg does, so the test doesn't need ffmpeg
+    def call(args, *rest, **kwargs):
+        if args[0] != "ffmpeg":
+            return real_call(args, *rest, **kwargs)
+        samples, fs = soundfile.read(args[args.index("-i") + 1], dtype="float32")
+        start = int(round(float(args[args.index("-ss") + 1]) * fs))
+        end = int(round(float(args[args.index("-to") + 1]) * fs))
+        soundfile.write(args[-1], samples[start:end], fs, subtype="FLOAT")
+        return 0
+    return call
+
+
+@pytest.fixture
+def gentle(monkeypatch):
+    server = StubGentle()
+    server.thread.start()
+    monkeypatch.setattr(pipeline, "gentle_pool", gentlepool.GentlePool([server.url]))
+    monkeypatch.setattr(pipeline.subprocess, "call", fake_ffmpeg(subprocess.call))
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    n_words = LINES * WORDS_PER_LINE
+    duration = spoken(n_words - 1)[1] + LEAD
+    wav = tmp_path / "a.wav"
+    soundfile.write(wav, (np.arange(int(duration * FS)) / FS).astype(np.float32), FS, subtype="FLOAT")
+
+    # a change of speaker every five lines, punctuation at the end of each line
+    lines = []
+    for li in range(LINES):
+        words = " ".join(f"w{li * WORDS_PER_LINE + k}" for k in range(WORDS_PER_LINE))
+        lines.append(f"{'AB'[li // 5 % 2]}: {words}.")
+    transcript = tmp_path / "a.txt"
+    transcript.write_text("\n".join(lines))
+
+    folder = batch.FolderStore(str(tmp_path / "out"))
+    monkeypatch.setattr(pipeline, "store", folder)
+    for docid in ["whole", "sharded"]:
+        folder.set_meta(docid, "path", folder.attach(str(wav)))
+        folder.set_meta(docid, "transcript", folder.attach(str(transcript)))
+    return folder
+
+
+def aligned(store, docid):
+    meta = store.get_meta(docid)
+    segments = json.load(open(f"{store.attachpath}/{meta['align']}"))["segments"]
+    rows = [X.split(",") for X in open(f"{store.attachpath}/{meta['aligncsv']}").read().splitlines()]
+    return segments, rows
+
+
+def test_sharded_alignment_matches_one_job(store, gentle, monkeypatch):
+    monkeypatch.setattr(pipeline, "SHARD_MIN_DURATION", 0)
+    monkeypatch.setattr(pipeline, "align_shards", 1)
+    pipeline.align({"id": "whole"})
+    assert gentle.offsets == [0]
+
+    monkeypatch.setattr(pipeline, "align_shards", 3)
+    pipeline.align({"id": "sharded"})
+    # three shards, cut at speaker turns, and no repairs
+    assert len(gentle.offsets) == 4
+    shard_offsets = sorted(gentle.offsets[1:])
+    assert shard_offsets[0] == 0 and 0 < shard_offsets[1] < shard_offsets[2]
+
+    whole, whole_rows = aligned(store, "whole")
+    sharded, sharded_rows = aligned(store, "sharded")
+
+    # every word in transcript order, at the time it's spoken in the whole recording
+    n_words = LINES * WORDS_PER_LINE
+    assert [X[0] for X in sharded_rows] == [f"w{i}" for i in range(n_words)]
+    for i, row in enumerate(sharded_rows):
+        assert float(row[2]) == pytest.approx(spoken(i)[0], abs=1e-4)
+        assert float(row[3]) == pytest.approx(spoken(i)[1], abs=1e-4)
+    assert [X[:2] for X in sharded_rows] == [X[:2] for X in whole_rows]
+
+    # the same segments, speakers, punctuation and times as aligning in one job
+    assert len(sharded) == len(whole) == LINES
+    for seg, one in zip(sharded, whole):
+        assert seg["speaker"] == one["speaker"]
+        assert seg["start"] == pytest.approx(one["start"], abs=1e-6)
+        assert seg["end"] == pytest.approx(one["end"], abs=1e-6)
+        assert [X["word"] for X in seg["wdlist"]] == [X["word"] for X in one["wdlist"]]
+        for wd, one_wd in zip(seg["wdlist"], one["wdlist"]):
+            assert wd["start"] == pytest.approx(one_wd["start"], abs=1e-6)
+            assert wd["end"] == pytest.approx(one_wd["end"], abs=1e-6)
+
+
+def test_plan_shards_cuts_at_speaker_turns():
+    segs = [{"speaker": "AB"[li // 5 % 2], "line": "a b c d"} for li in range(LINES)]
+    shards = pipeline.plan_shards(segs, 200.0, None, 3)
+
+    # the even cuts would be at lines 13 and 27, the nearest turns are at 15 and 25
+    assert [X[:2] for X in shards] == [(0, 15), (15, 25), (25, 40)]
+    # the shards' lines follow on from each other, and their audio overlaps around each cut
+    assert shards[0][0] == 0 and shards[-1][1] == LINES
+    for (_, end, _, span_end), (start, _, span_start, _) in zip(shards, shards[1:]):
+        assert end == start
+        assert span_start < span_end
+    assert shards[0][2] == 0 and shards[-1][3] == 200.0
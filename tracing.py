@@ -0,0 +1,246 @@
+# Timeline of where each document's processing time went: a span for every pipeline stage and
+# the steps inside it (ffmpeg, SAcC, Gentle's queue and alignment, harvest, csv, measures), with
+# its thread and process and how many bytes it went through. Exported as Chrome trace events,
+# which chrome://tracing, ui.perfetto.dev and speedscope open:
+#
+#   GET /_trace?id=<docid>  -> {"traceEvents": [...]}
+#
+# A span belongs to the document it's given, or else to the span it's nested in on the same
+# thread. Work handed to another thread keeps its document with carry(fn).
+
+import collections
+import contextlib
+import functools
+import json
+import os
+import re
+import threading
+import time
+
+from twisted.internet import threads
+from twisted.web import resource, server
+
+# events are also appended to <dirpath>/<docid>.jsonl when set, so they outlast a restart
+dirpath = None
+# events kept of each document, in memory and in its file once that has grown past MAX_FILE bytes
+MAX_EVENTS = 5000
+MAX_FILE = 4 * 1024 * 1024
+# spans held back before they're appended to the file
+FLUSH_EVENTS = 200
+SAFE_ID = re.compile(r"^[A-Za-z0-9_-][A-Za-z0-9_.-]*$")
+
+events = collections.defaultdict(lambda: collections.deque(maxlen=MAX_EVENTS))
+unwritten = collections.defaultdict(list)
+lock = threading.Lock()
+# held while a trace file is written or read
+file_lock = threading.Lock()
+local = threading.local()
+
+
+class Span:
+    def __init__(self, docid, name, cat, args):
+        self.docid = docid
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+
+def stack():
+    if not hasattr(local, "stack"):
+        local.stack = []
+    return local.stack
+
+
+def current():
+    # the document the running span belongs to, if any
+    spans = stack()
+    if spans:
+        return spans[-1].docid
+    return getattr(local, "docid", None)
+
+
+@contextlib.contextmanager
+def span(name, docid=None, cat="pipeline", **args):
+    # with span("ffmpeg", bytes=...) as sp: ... sp.args holds what's recorded with it
+    sp = Span(docid if docid is not None else current(), name, cat, args)
+    spans = stack()
+    spans.append(sp)
+    started = time.time()
+    try:
+        yield sp
+    except Exception as e:
+        sp.args["error"] = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        spans.pop()
+        if sp.docid is not None:
+            record(sp, started, time.time())
+
+
+def annotate(**args):
+    # add to what the innermost running span records
+    spans = stack()
+    if spans:
+        spans[-1].args.update(args)
+
+
+def stage(name):
+    # decorator for a pipeline stage, whose first argument is a cmd dict with "id" or the docid
+    def wrap(fn):
+        @functools.wraps(fn)
+        def run(first, *args, **kwargs):
+            docid = first["id"] if isinstance(first, dict) else first
+            with span(name, docid, cat="stage") as sp:
+                ret = fn(first, *args, **kwargs)
+                if isinstance(ret, dict) and ret.get("error"):
+                    sp.args["error"] = ret["error"]
+                return ret
+        return run
+    return wrap
+
+
+def add(name, docid, started, ended, cat="pipeline", **args):
+    # a span the caller timed itself, e.g. a phase of a job on another server that it polls
+    if docid is not None:
+        record(Span(docid, name, cat, args), started, ended)
+
+
+def carry(fn):
+    # fn, run under the calling thread's document wherever it ends up running
+    docid = current()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        outer = getattr(local, "docid", None)
+        local.docid = docid
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            local.docid = outer
+    return run
+
+
+def safe_id(docid):
+    # trace files are named after the document, so only plain names get one
+    return isinstance(docid, str) and SAFE_ID.match(docid) is not None
+
+
+def record(sp, started, ended):
+    if not safe_id(sp.docid):
+        return
+    thread = threading.current_thread()
+    event = {
+        "name": sp.name,
+        "cat": sp.cat,
+        "ph": "X",
+        "ts": int(started * 1e6),
+        "dur": int((ended - started) * 1e6),
+        "pid": os.getpid(),
+        "tid": thread.native_id,
+        "args": dict(sp.args, thread=thread.name),
+    }
+    with lock:
+        events[sp.docid].append(event)
+        if dirpath is not None:
+            unwritten[sp.docid].append(event)
+            full = len(unwritten[sp.docid]) >= FLUSH_EVENTS
+    # spans are written once the outermost one on the thread is done, or a batch has built up
+    if dirpath is not None and (full or not stack()):
+        flush(sp.docid)
+
+
+def flush(docid):
+    # append the document's unwritten spans to its file
+    with lock:
+        batch = unwritten.pop(docid, [])
+    if not batch or dirpath is None:
+        return
+
+    with file_lock:
+        os.makedirs(dirpath, exist_ok=True)
+        path = os.path.join(dirpath, f"{docid}.jsonl")
+        with open(path, "a") as fh:
+            fh.writelines(json.dumps(X) + "\n" for X in batch)
+            size = fh.tell()
+        if size > MAX_FILE:
+            lines = open(path).readlines()[-MAX_EVENTS:]
+            with open(path + ".tmp", "w") as fh:
+                fh.writelines(lines)
+            os.replace(path + ".tmp", path)
+
+
+def read_events(path):
+    # a line cut short when the server was killed is left out
+    for line in open(path):
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if isinstance(event, dict) and all(K in event for K in ("ts", "pid", "tid", "args")):
+            yield event
+
+
+def trace(docid):
+    # the document's spans as a Chrome trace
+    if dirpath is not None:
+        flush(docid)
+        path = os.path.join(dirpath, f"{docid}.jsonl")
+    else:
+        path = None
+
+    with file_lock:
+        if path is not None and os.path.exists(path):
+            found = list(read_events(path))
+        else:
+            with lock:
+                found = list(events.get(docid, []))
+
+    # name the processes and threads, and order threads by when they first did something
+    meta = []
+    seen = set()
+    for event in sorted(found, key=lambda X: X["ts"]):
+        if event["pid"] not in seen:
+            seen.add(event["pid"])
+            meta.append({"name": "process_name", "ph": "M", "pid": event["pid"], "args": {"name": f"drift {event['pid']}"}})
+        key = (event["pid"], event["tid"])
+        if key not in seen:
+            seen.add(key)
+            meta.append({"name": "thread_name", "ph": "M", "pid": event["pid"], "tid": event["tid"], "args": {"name": event["args"].get("thread", str(event["tid"]))}})
+            meta.append({"name": "thread_sort_index", "ph": "M", "pid": event["pid"], "tid": event["tid"], "args": {"sort_index": len(seen)}})
+
+    return {"traceEvents": meta + found, "displayTimeUnit": "ms", "otherData": {"id": docid}}
+
+
+class TraceResource(resource.Resource):
+    # GET /_trace?id=<docid>. known(docid) says whether the document exists, anything else is a 404
+    isLeaf = True
+
+    def __init__(self, known):
+        super().__init__()
+        self.known = known
+
+    def render_GET(self, req):
+        docid = (req.args.get(b"id") or [b""])[0].decode("utf-8", "replace")
+        if not safe_id(docid) or not self.known(docid):
+            req.setResponseCode(404)
+            req.setHeader(b"Content-Type", b"application/json")
+            return json.dumps({"error": "no such document"}).encode()
+
+        # reading a long trace takes a while, so not on the reactor
+        gone = []
+        req.notifyFinish().addErrback(lambda _: gone.append(True))
+
+        def send(body):
+            if not gone:
+                req.setHeader(b"Content-Type", b"application/json")
+                req.write(body)
+                req.finish()
+
+        def failed(failure):
+            print(f"SYSTEM: couldn't read the trace of {docid}: {failure.getErrorMessage()}")
+            if not gone:
+                req.setResponseCode(500)
+                send(json.dumps({"error": "couldn't read the trace"}).encode())
+
+        threads.deferToThread(lambda: json.dumps(trace(docid)).encode()).addCallbacks(send, failed)
+        return server.NOT_DONE_YET